@@ -3,17 +3,103 @@ AI Agent Engine - Manages agent reasoning, planning, and tool execution
 """
 import json
 import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from tools import execute_tool, TOOL_DEFINITIONS
+from tracing import tracer
+from speculation import call_key
+
+# JSON-schema types for tool parameters that aren't plain strings
+PARAMETER_TYPES = {
+    'max_results': 'integer',
+    'max_chars': 'integer'
+}
+
+# References to earlier plan step outputs, e.g. {{s1}} or {{s1.results.0.link}}
+STEP_REFERENCE = re.compile(r'\{\{\s*(\w+)((?:\.\w+)*)\s*\}\}')
+
+# Marker closing a text-protocol tool call; used as a stop sequence so generation
+# ends right after the PARAMETERS JSON (or before a hallucinated TOOL_RESULT)
+TOOL_CALL_END = 'END_TOOL_CALL'
+TOOL_CALL_STOP_SEQUENCES = [TOOL_CALL_END, 'TOOL_RESULT']
+
+# Seconds a successful result may be reused from the shared cache, for tools whose
+# results depend only on their parameters and change slowly
+CACHED_TOOLS = {
+    'web_search': 600,
+    'get_weather': 900
+}
+# How long a model's rejection of the native tools API is remembered across workers
+NATIVE_TOOLS_RETRY_AFTER = 24 * 3600
 
 class AgentEngine:
     """AI Agent with reasoning and tool-using capabilities"""
     
-    def __init__(self):
+    def __init__(self, cache=None):
         self.tools = TOOL_DEFINITIONS
+        # Optional SharedCache for CACHED_TOOLS results, shared by all worker processes
+        self.cache = cache
         self.max_iterations = 5
+        self.tool_schemas = self.create_tool_schemas()
+        self.native_tools_unsupported = set()
+    
+    def create_tool_schemas(self):
+        """Convert TOOL_DEFINITIONS into OpenAI-compatible `tools` schemas"""
+        schemas = []
+        for tool_name, tool_info in self.tools.items():
+            properties = {}
+            required = []
+            for param, description in tool_info['parameters'].items():
+                properties[param] = {
+                    'type': PARAMETER_TYPES.get(param, 'string'),
+                    'description': description
+                }
+                if '(default' not in description:
+                    required.append(param)
+            schemas.append({
+                'type': 'function',
+                'function': {
+                    'name': tool_name,
+                    'description': tool_info['description'],
+                    'parameters': {
+                        'type': 'object',
+                        'properties': properties,
+                        'required': required
+                    }
+                }
+            })
+        return schemas
+    
+    def supports_native_tools(self, model):
+        """Check if a model hasn't rejected the native tools API (in any worker process)"""
+        if model in self.native_tools_unsupported:
+            return False
+        if self.cache and self.cache.get(f"native_tools_unsupported:{model}"):
+            self.native_tools_unsupported.add(model)
+            return False
+        return True
+    
+    def disable_native_tools(self, model):
+        """Remember that a model doesn't support the native tools API, shared through the cache"""
+        self.native_tools_unsupported.add(model)
+        if self.cache:
+            self.cache.set(f"native_tools_unsupported:{model}", True, ttl=NATIVE_TOOLS_RETRY_AFTER)
     
-    def create_system_prompt(self):
+    def is_tool_support_error(self, status_code, response_text):
+        """Check if an upstream error means the model can't do function calling"""
+        return status_code in (400, 404, 422) and 'tool' in response_text.lower()
+    
+    def create_system_prompt(self, native_tools=False):
         """Create system prompt with tool information"""
+        if native_tools:
+            # Tool schemas travel in the request payload, so no format instructions needed
+            return """You are an advanced AI agent with the ability to use tools and reason about tasks.
+
+Call tools whenever they help; you may call several tools at once when they are independent.
+After receiving tool results, either call more tools or give the final answer to the user.
+Be helpful, accurate, and proactive in solving user problems.
+"""
+        
         tools_info = "Available Tools:\n"
         for tool_name, tool_info in self.tools.items():
             tools_info += f"\n{tool_name}:\n"
@@ -27,6 +113,9 @@ class AgentEngine:
 When you need to use a tool, respond in this exact format:
 TOOL_CALL: tool_name
 PARAMETERS: {{"param1": "value1", "param2": "value2"}}
+{TOOL_CALL_END}
+
+Then stop and wait for the TOOL_RESULT.
 
 After receiving tool results, you can either:
 1. Use another tool if needed (for multi-step tasks)
@@ -66,11 +155,305 @@ Think step-by-step for complex tasks.
             print(f"Error parsing tool call: {e}")
             return None, None
     
-    def execute_tool_call(self, tool_name, parameters):
-        """Execute a tool and return results"""
-        try:
-            result = execute_tool(tool_name, **parameters)
+    def parse_native_tool_calls(self, message):
+        """
+        Read structured tool calls from an OpenAI-compatible response message
+        Returns: List of {'id', 'name', 'parameters', 'error'} dicts (empty if none)
+        """
+        calls = []
+        for i, tool_call in enumerate(message.get('tool_calls') or []):
+            function = tool_call.get('function', {})
+            arguments = function.get('arguments') or {}
+            error = None
+            if isinstance(arguments, str):
+                try:
+                    arguments = json.loads(arguments) if arguments.strip() else {}
+                except json.JSONDecodeError as e:
+                    error = f"Invalid JSON arguments: {e}"
+                    arguments = {}
+            calls.append({
+                'id': tool_call.get('id') or f"call_{i}",
+                'name': function.get('name'),
+                'parameters': arguments,
+                'error': error
+            })
+        return calls
+    
+    def execute_tool_calls(self, calls, speculation=None):
+        """Execute parsed native tool calls, running independent calls in parallel"""
+        def run(call):
+            if call['error']:
+                return {'success': False, 'error': call['error']}
+            return self.execute_tool_call(call['name'], call['parameters'], speculation)
+        
+        if len(calls) == 1:
+            return [run(calls[0])]
+        return self.run_parallel(run, calls)
+    
+    def run_parallel(self, function, items, max_workers=8):
+        """Map function over items in a thread pool, keeping the caller's trace context"""
+        contexts = [contextvars.copy_context() for _ in items]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(lambda context, item: context.run(function, item), contexts, items))
+    
+    def format_native_tool_call_message(self, message, calls):
+        """Build the assistant message that records native tool calls"""
+        return {
+            'role': 'assistant',
+            'content': message.get('content') or '',
+            'tool_calls': [{
+                'id': call['id'],
+                'type': 'function',
+                'function': {
+                    'name': call['name'],
+                    'arguments': json.dumps(call['parameters'])
+                }
+            } for call in calls]
+        }
+    
+    def format_native_tool_result(self, call, result):
+        """Build the `tool` role message carrying a tool result"""
+        return {
+            'role': 'tool',
+            'tool_call_id': call['id'],
+            'name': call['name'],
+            'content': json.dumps(result)
+        }
+    
+    def uses_native_protocol(self, conversation):
+        """Check if a conversation has the native system prompt or native tool call messages"""
+        native_prompt = self.create_system_prompt(native_tools=True)
+        return any(
+            msg['role'] == 'tool' or msg.get('tool_calls')
+            or (msg['role'] == 'system' and msg['content'] == native_prompt)
+            for msg in conversation
+        )
+    
+    def convert_to_text_protocol(self, conversation):
+        """
+        Rewrite a conversation that used native tool calls into the text
+        TOOL_CALL/TOOL_RESULT protocol, in place
+        """
+        converted = []
+        for msg in conversation:
+            if msg['role'] == 'system':
+                converted.append({'role': 'system', 'content': self.create_system_prompt()})
+            elif msg['role'] == 'assistant' and msg.get('tool_calls'):
+                content = msg.get('content') or ''
+                for tool_call in msg['tool_calls']:
+                    function = tool_call['function']
+                    content += f"\nTOOL_CALL: {function['name']}\nPARAMETERS: {function['arguments']}"
+                converted.append({'role': 'assistant', 'content': content.strip()})
+            elif msg['role'] == 'tool':
+                result = json.loads(msg['content'])
+                converted.append({'role': 'user', 'content': self.format_tool_result(msg['name'], result)})
+            else:
+                converted.append(msg)
+        conversation[:] = converted
+    
+    def create_planning_prompt(self):
+        """Create the instruction asking the model for a tool dependency graph"""
+        tools_info = "\n".join(
+            f"- {name}({', '.join(info['parameters'])}): {info['description']}"
+            for name, info in self.tools.items()
+        )
+        return f"""[System: Plan the whole task before acting. Available tools:
+{tools_info}
+
+Respond ONLY with JSON in this format:
+{{"steps": [{{"id": "s1", "tool": "tool_name", "parameters": {{"param": "value"}}, "depends_on": []}}]}}
+
+Steps without dependencies run in parallel. To use an earlier step's output in a parameter,
+write {{{{step_id}}}} for the whole result or {{{{step_id.field}}}} for one field, and list that
+step in depends_on. If no tools are needed, respond with {{"steps": [], "answer": "your answer"}}.]"""
+    
+    def parse_plan(self, message):
+        """
+        Parse a JSON tool plan from an AI message
+        Returns: (steps, answer)
+        Raises: ValueError if the message isn't a valid plan
+        """
+        start, end = message.find('{'), message.rfind('}')
+        if start == -1 or end <= start:
+            raise ValueError("No JSON plan found")
+        plan = json.loads(message[start:end + 1])
+        if not isinstance(plan, dict):
+            raise ValueError("Plan must be a JSON object")
+        steps = plan.get('steps', [])
+        if not isinstance(steps, list):
+            raise ValueError("Plan steps must be a list")
+        
+        ids = set()
+        for i, step in enumerate(steps):
+            if not isinstance(step, dict):
+                raise ValueError(f"Plan step {i + 1} must be an object")
+            step.setdefault('id', f"s{i + 1}")
+            step.setdefault('parameters', {})
+            step.setdefault('depends_on', [])
+            if step.get('tool') not in self.tools:
+                raise ValueError(f"Unknown tool in plan: {step.get('tool')}")
+            if not isinstance(step['parameters'], dict) or not isinstance(step['depends_on'], list):
+                raise ValueError(f"Invalid parameters or depends_on in step {step['id']}")
+            if step['id'] in ids:
+                raise ValueError(f"Duplicate step id: {step['id']}")
+            ids.add(step['id'])
+        return steps, plan.get('answer')
+    
+    def rename_reused_ids(self, steps, used):
+        """
+        Give the steps of a revised plan whose id is already used a fresh id.
+        Inside the revised plan, depends_on and {{step_id.path}} references to a
+        renamed id point to its new step.
+        Returns: dict of old id -> new id
+        """
+        taken = set(used) | {step['id'] for step in steps}
+        renamed = {}
+        for step in steps:
+            if step['id'] not in used:
+                continue
+            n = 2
+            while f"{step['id']}_{n}" in taken:
+                n += 1
+            renamed[step['id']] = step['id'] = f"{step['id']}_{n}"
+            taken.add(step['id'])
+        
+        def rename(value):
+            if isinstance(value, dict):
+                return {k: rename(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [rename(v) for v in value]
+            if not isinstance(value, str):
+                return value
+            return STEP_REFERENCE.sub(
+                lambda match: match.group(0).replace(match.group(1), renamed.get(match.group(1), match.group(1)), 1),
+                value
+            )
+        
+        if renamed:
+            for step in steps:
+                step['depends_on'] = [renamed.get(dep, dep) for dep in step['depends_on']]
+                step['parameters'] = rename(step['parameters'])
+        return renamed
+    
+    def resolve_step_references(self, value, results):
+        """Substitute {{step_id.path}} references with earlier step outputs"""
+        if isinstance(value, dict):
+            return {k: self.resolve_step_references(v, results) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.resolve_step_references(v, results) for v in value]
+        if not isinstance(value, str):
+            return value
+        
+        def lookup(match):
+            resolved = results[match.group(1)]
+            for key in filter(None, match.group(2).split('.')):
+                resolved = resolved[int(key)] if isinstance(resolved, list) else resolved[key]
+            return resolved
+        
+        # A parameter that is a single reference keeps the referenced value's type
+        whole = STEP_REFERENCE.fullmatch(value.strip())
+        if whole:
+            return lookup(whole)
+        
+        def substitute(match):
+            resolved = lookup(match)
+            return resolved if isinstance(resolved, str) else json.dumps(resolved)
+        return STEP_REFERENCE.sub(substitute, value)
+    
+    def execute_plan(self, steps, results=None):
+        """
+        Execute a tool plan as a DAG, running independent steps in parallel
+        Args:
+            steps: Parsed plan steps
+            results: Outputs of previously executed steps, by step id
+        Returns:
+            (results, parameters): dicts of step id -> tool result (includes
+            previous results) and step id -> parameters the tool was called
+            with, after step references were resolved
+        """
+        results = dict(results or {})
+        parameters = {}
+        pending = {step['id']: step for step in steps}
+        
+        while pending:
+            ready = [step for step in pending.values()
+                     if all(dep in results for dep in step['depends_on'])]
+            if not ready:
+                for step_id in pending:
+                    results[step_id] = {'success': False, 'error': 'Unresolvable or circular dependency'}
+                break
+            
+            def run(step):
+                failed = [dep for dep in step['depends_on'] if not results[dep].get('success', True)]
+                if failed:
+                    return step['parameters'], {'success': False, 'error': f"Skipped: dependency {', '.join(failed)} failed"}
+                try:
+                    resolved = self.resolve_step_references(step['parameters'], results)
+                except (KeyError, IndexError, ValueError, TypeError) as e:
+                    return step['parameters'], {'success': False, 'error': f"Could not resolve reference: {e}"}
+                return resolved, self.execute_tool_call(step['tool'], resolved)
+            
+            for step, (resolved, result) in zip(ready, self.run_parallel(run, ready)):
+                parameters[step['id']] = resolved
+                results[step['id']] = result
+                del pending[step['id']]
+        
+        for step_id in pending:
+            parameters[step_id] = pending[step_id]['parameters']
+        return results, parameters
+    
+    def format_plan_results(self, steps, results):
+        """Format executed plan steps for AI consumption"""
+        lines = ["\nPLAN_RESULTS:"]
+        for step in steps:
+            lines.append(f"\n[{step['id']}] {step['tool']} {json.dumps(step['parameters'])}")
+            lines.append(json.dumps(results.get(step['id']), indent=2))
+        return "\n".join(lines) + "\n"
+    
+    def failed_steps(self, steps, results):
+        """Return the plan steps whose tool call didn't succeed"""
+        return [step for step in steps if not results.get(step['id'], {}).get('success', True)]
+    
+    def execute_tool_call(self, tool_name, parameters, speculation=None):
+        """
+        Execute a tool and return results
+        Args:
+            speculation: Optional SpeculationBatch whose matching result is used instead of running the tool
+        """
+        with tracer.span('tool.execute', **{'tool.name': tool_name}) as span:
+            try:
+                key = call_key(tool_name, parameters)
+            except (TypeError, ValueError):
+                # Arguments that aren't an object can't be matched or cached; run_tool reports the error
+                key = None
+            if speculation and key:
+                result = speculation.take(tool_name, parameters)
+                if result is not None:
+                    span.set_attribute('tool.speculative_hit', True)
+                    return result
+            ttl = CACHED_TOOLS.get(tool_name)
+            if self.cache and ttl and key:
+                computed = []
+                def compute():
+                    computed.append(True)
+                    return self.run_tool(tool_name, parameters)
+                result = self.cache.get_or_compute(
+                    ('tool',) + key,
+                    compute,
+                    ttl=ttl,
+                    cache_if=lambda value: isinstance(value, dict) and value.get('success')
+                )
+                span.set_attribute('tool.cache_hit', not computed)
+            else:
+                result = self.run_tool(tool_name, parameters)
+            if isinstance(result, dict) and not result.get('success', True):
+                span.set_error(result.get('error', 'tool failed'))
             return result
+    
+    def run_tool(self, tool_name, parameters):
+        """Run a tool, turning exceptions into an error result"""
+        try:
+            return execute_tool(tool_name, **parameters)
         except Exception as e:
             return {
                 'success': False,
@@ -100,6 +483,10 @@ Think step-by-step for complex tasks.
         if any(word in message_lower for word in ['search', 'find', 'look up', 'google', 'what is', 'who is', 'tell me about']):
             suggestions.append('web_search')
         
+        # Page-reading keywords
+        if any(word in message_lower for word in ['http://', 'https://', 'www.', 'read the page', 'open the link', 'this article']):
+            suggestions.append('fetch_url')
+        
         # Time-related keywords
         if any(word in message_lower for word in ['time', 'date', 'today', 'now', 'current']):
             suggestions.append('get_current_time')
@@ -112,6 +499,9 @@ Think step-by-step for complex tasks.
         if any(word in message_lower for word in ['read file', 'open file', 'file content']):
             suggestions.append('read_file')
         
+        if any(word in message_lower for word in ['in my files', 'in the documents', 'search files', 'which file', 'in the docs']):
+            suggestions.append('search_documents')
+        
         if any(word in message_lower for word in ['write file', 'save file', 'create file']):
             suggestions.append('write_file')
         
@@ -1,62 +1,697 @@
-from flask import Flask, request, jsonify, session
-from flask_cors import CORS
-from dotenv import load_dotenv
+from flask import Blueprint, Flask, current_app, request, jsonify, session, g, send_from_directory, after_this_request
+from werkzeug.local import LocalProxy
 from datetime import timedelta
+from functools import wraps
 import os
+import re
 import json
-import requests
-from agent_engine import AgentEngine
-from tools import execute_tool
+import uuid
+import hmac
+import hashlib
+import random
+from rate_limiter import RateLimitExceeded
+from idempotency import PENDING, DONE, CONFLICT
+from tracing import tracer
+from generation_policy import TOOL, PLAN, ANSWER, estimate_tokens
 
-# Load environment variables from .env file
-load_dotenv()
+# OpenRouter configuration (free alternative)
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Using a free model that's known to work
+OPENROUTER_MODEL = "nvidia/nemotron-nano-9b-v2:free"
+# Fallback to Hugging Face
+HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
 
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Required for session
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)  # Session expires in 2 hours
+UPSTREAM_MAX_RETRIES = 2
+# Generation settings used when ADAPTIVE_GENERATION is off
+DEFAULT_GENERATION = {'max_tokens': 1000, 'temperature': 0.7, 'stop': None}
+CONTINUE_PROMPT = "[System: Your previous reply was cut off. Continue exactly where it stopped, without repeating anything.]"
+MEMORY_TEXT_LIMIT = 1500
+MAX_REPLANS = 1
 
-# Enable CORS for all routes
-CORS(app, supports_credentials=True)
+# Long-lived cookie so conversations and memories outlive the 2 hour session
+CLIENT_COOKIE = 'client_id'
+CLIENT_COOKIE_MAX_AGE = 365 * 24 * 3600
 
-# Get OpenRouter API key from environment variables (free alternative)
-openrouter_api_key = os.getenv('OPENROUTER_API_KEY')
-# If no OpenRouter key, fall back to Hugging Face key
-api_key = openrouter_api_key or os.getenv('HUGGINGFACE_API_KEY')
+def load_config(overrides=None):
+    """
+    Read configuration from environment variables (and the .env file)
+    Args:
+        overrides: Optional dict of settings that take precedence over the environment
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    # Requests queued by the scheduler wait in a gunicorn request thread, so its
+    # limits default to a share of them: half run agents, a quarter may queue
+    request_threads = int(os.getenv('GUNICORN_WORKERS', 4)) * int(os.getenv('GUNICORN_THREADS', 4))
+    
+    config = {
+        # Get OpenRouter API key from environment variables (free alternative)
+        'OPENROUTER_API_KEY': os.getenv('OPENROUTER_API_KEY'),
+        # If no OpenRouter key, fall back to Hugging Face key
+        'HUGGINGFACE_API_KEY': os.getenv('HUGGINGFACE_API_KEY'),
+        # Set SECRET_KEY so sessions work across gunicorn workers
+        'SECRET_KEY': os.getenv('SECRET_KEY') or os.urandom(24),
+        'RATE_LIMIT_DB': os.getenv('RATE_LIMIT_DB'),
+        'UPSTREAM_RATE_PER_MINUTE': int(os.getenv('UPSTREAM_RATE_PER_MINUTE', 20)),
+        'UPSTREAM_BURST': int(os.getenv('UPSTREAM_BURST', 0)) or None,
+        'UPSTREAM_MAX_QUEUE_WAIT': float(os.getenv('UPSTREAM_MAX_QUEUE_WAIT', 15)),
+        # Native function calling via the OpenAI-compatible tools API (OpenRouter only)
+        'NATIVE_TOOL_CALLING': os.getenv('NATIVE_TOOL_CALLING', 'True') == 'True',
+        # Agent mode: "loop" (one tool per LLM call) or "plan" (plan a tool DAG, then synthesize)
+        'AGENT_MODE': os.getenv('AGENT_MODE', 'loop'),
+        'CONVERSATION_DB': os.getenv('CONVERSATION_DB'),
+        'CONVERSATION_TTL_HOURS': int(os.getenv('CONVERSATION_TTL_HOURS', 168)),
+        # Long-term memory: relevant past turns are recalled instead of re-sending the whole transcript
+        'MEMORY_ENABLED': os.getenv('MEMORY_ENABLED', 'True') == 'True',
+        'MEMORY_DIR': os.getenv('MEMORY_DIR'),
+        'MEMORY_DIM': int(os.getenv('MEMORY_DIM', 256)),
+        'MEMORY_TOP_K': int(os.getenv('MEMORY_TOP_K', 4)),
+        'MEMORY_MAX_PER_CLIENT': int(os.getenv('MEMORY_MAX_PER_CLIENT', 200000)),
+        'MEMORY_TTL_DAYS': int(os.getenv('MEMORY_TTL_DAYS', 180)),
+        'HISTORY_WINDOW': int(os.getenv('HISTORY_WINDOW', 12)),
+        'IDEMPOTENCY_DB': os.getenv('IDEMPOTENCY_DB'),
+        'IDEMPOTENCY_TTL_HOURS': int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24)),
+        'IDEMPOTENCY_MAX_ENTRIES': int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 10000)),
+        # Opt-in request profiling: X-Profile header with a valid X-Admin-Token, or PROFILE_SAMPLE_RATE
+        'PROFILE_DIR': os.getenv('PROFILE_DIR'),
+        'ADMIN_TOKEN': os.getenv('ADMIN_TOKEN'),
+        'PROFILE_SAMPLE_RATE': float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+        # Fair admission of agent loops: global and per-client concurrency, per-client and total queue length
+        'SCHEDULER_DB': os.getenv('SCHEDULER_DB'),
+        'MAX_CONCURRENT_AGENTS': int(os.getenv('MAX_CONCURRENT_AGENTS', max(1, request_threads // 2))),
+        'PER_CLIENT_CONCURRENCY': int(os.getenv('PER_CLIENT_CONCURRENCY', 2)),
+        'PER_CLIENT_QUEUE': int(os.getenv('PER_CLIENT_QUEUE', 2)),
+        'MAX_QUEUED_AGENTS': int(os.getenv('MAX_QUEUED_AGENTS', max(1, request_threads // 4))),
+        'SCHEDULER_MAX_WAIT': float(os.getenv('SCHEDULER_MAX_WAIT', 60)),
+        # Per-iteration token budgets and stop sequences learned from reply lengths per intent
+        'ADAPTIVE_GENERATION': os.getenv('ADAPTIVE_GENERATION', 'True') == 'True',
+        'MAX_CONTINUATIONS': int(os.getenv('MAX_CONTINUATIONS', 2)),
+        # Start predicted side-effect-free tool calls in parallel with the first upstream call
+        'SPECULATIVE_EXECUTION': os.getenv('SPECULATIVE_EXECUTION', 'True') == 'True',
+        # Cache of tool results and fetched pages shared by all worker processes on the host
+        'SHARED_CACHE_ENABLED': os.getenv('SHARED_CACHE_ENABLED', 'True') == 'True',
+        'SHARED_CACHE_DB': os.getenv('SHARED_CACHE_DB'),
+        'SHARED_CACHE_MAX_MB': int(os.getenv('SHARED_CACHE_MAX_MB', 256)),
+        # Spans of requests, agent iterations, upstream and tool calls, as rotated JSONL
+        'TRACING_ENABLED': os.getenv('TRACING_ENABLED', 'True') == 'True',
+        'TRACE_FILE': os.getenv('TRACE_FILE'),
+        'TRACE_MAX_MB': int(os.getenv('TRACE_MAX_MB', 50)),
+        'TRACE_BACKUPS': int(os.getenv('TRACE_BACKUPS', 2)),
+    }
+    config.update(overrides or {})
+    
+    api_key = config['OPENROUTER_API_KEY'] or config['HUGGINGFACE_API_KEY']
+    if not api_key:
+        raise ValueError("API key not found in environment variables. Please set either OPENROUTER_API_KEY or HUGGINGFACE_API_KEY")
+    
+    if config['OPENROUTER_API_KEY']:
+        config['API_URL'] = OPENROUTER_API_URL
+        config['API_HEADERS'] = {
+            "Authorization": f"Bearer {config['OPENROUTER_API_KEY']}",  # Use the specific key
+            "HTTP-Referer": "http://localhost:5000",  # Optional, for openrouter stats
+            "X-Title": "AI Assistant",  # Optional, for openrouter stats
+            "Content-Type": "application/json"
+        }
+        config['MODEL'] = OPENROUTER_MODEL
+    else:
+        config['API_URL'] = HUGGINGFACE_API_URL
+        config['API_HEADERS'] = {"Authorization": f"Bearer {api_key}"}
+        config['MODEL'] = None
+    config['RATE_LIMIT_KEY'] = config['MODEL'] or config['API_URL']
+    return config
 
-if not api_key:
-    raise ValueError("API key not found in environment variables. Please set either OPENROUTER_API_KEY or HUGGINGFACE_API_KEY")
+class Assistant:
+    """
+    Shared services of one app instance. Backends with expensive imports
+    (memory vectors, tool libraries) are loaded on first use, or up front by
+    warm() when the app is preloaded before gunicorn forks its workers.
+    """
+    
+    def __init__(self, config):
+        from agent_engine import AgentEngine, TOOL_CALL_STOP_SEQUENCES
+        from generation_policy import GenerationPolicy
+        from rate_limiter import RateLimitGovernor
+        from conversation_store import ConversationStore
+        from idempotency import IdempotencyStore
+        from profiler import RequestProfiler
+        from scheduler import FairScheduler
+        from speculation import Speculator
+        from shared_cache import SharedCache, set_shared_cache
+        
+        self.config = config
+        self.shared_cache = None
+        if config['SHARED_CACHE_ENABLED']:
+            self.shared_cache = SharedCache(
+                db_path=config['SHARED_CACHE_DB'],
+                max_bytes=config['SHARED_CACHE_MAX_MB'] * 1024 * 1024
+            )
+        # The tool layer (fetch_url's page cache) uses the same instance
+        set_shared_cache(self.shared_cache)
+        self.agent_engine = AgentEngine(cache=self.shared_cache)
+        self.generation_policy = GenerationPolicy(stop_sequences=TOOL_CALL_STOP_SEQUENCES)
+        self.speculator = Speculator()
+        # Upstream rate limiting shared by all worker processes on this host
+        self.rate_governor = RateLimitGovernor(
+            db_path=config['RATE_LIMIT_DB'],
+            rate_per_minute=config['UPSTREAM_RATE_PER_MINUTE'],
+            burst=config['UPSTREAM_BURST'],
+            max_wait=config['UPSTREAM_MAX_QUEUE_WAIT']
+        )
+        # Conversation histories live server-side; the session only identifies the client
+        self.conversation_store = ConversationStore(
+            db_path=config['CONVERSATION_DB'],
+            ttl_seconds=config['CONVERSATION_TTL_HOURS'] * 3600
+        )
+        # Deduplication of retried/double-submitted /chat requests
+        self.idempotency_store = IdempotencyStore(
+            db_path=config['IDEMPOTENCY_DB'],
+            ttl_seconds=config['IDEMPOTENCY_TTL_HOURS'] * 3600,
+            max_entries=config['IDEMPOTENCY_MAX_ENTRIES']
+        )
+        self.request_profiler = RequestProfiler(
+            directory=config['PROFILE_DIR'],
+            admin_token=config['ADMIN_TOKEN'],
+            sample_rate=config['PROFILE_SAMPLE_RATE']
+        )
+        # Per-client fair queueing in front of the agent loop
+        self.scheduler = FairScheduler(
+            db_path=config['SCHEDULER_DB'],
+            max_concurrent=config['MAX_CONCURRENT_AGENTS'],
+            per_client_limit=config['PER_CLIENT_CONCURRENCY'],
+            max_queued_per_client=config['PER_CLIENT_QUEUE'],
+            max_queued=config['MAX_QUEUED_AGENTS'],
+            max_wait=config['SCHEDULER_MAX_WAIT']
+        )
+        self._memory_store = None
+    
+    @property
+    def memory_store(self):
+        """Long-term memory store (imports NumPy on first use), or None if disabled"""
+        if self._memory_store is None and self.config['MEMORY_ENABLED']:
+            from memory_store import MemoryStore
+            self._memory_store = MemoryStore(
+                directory=self.config['MEMORY_DIR'],
+                dim=self.config['MEMORY_DIM'],
+                max_memories=self.config['MEMORY_MAX_PER_CLIENT'],
+                ttl_days=self.config['MEMORY_TTL_DAYS']
+            )
+        return self._memory_store
+    
+    def warm(self):
+        """Load every lazy backend now so forked workers share it copy-on-write"""
+        import requests
+        from tools import preload_backends
+        preload_backends()
+        self.memory_store
 
-# OpenRouter configuration (free alternative)
-if openrouter_api_key:
-    API_URL = "https://openrouter.ai/api/v1/chat/completions"
-    API_HEADERS = {
-        "Authorization": f"Bearer {openrouter_api_key}",  # Use the specific key
-        "HTTP-Referer": "http://localhost:5000",  # Optional, for openrouter stats
-        "X-Title": "AI Assistant",  # Optional, for openrouter stats
-        "Content-Type": "application/json"
-    }
-    # Using a free model that's known to work
-    MODEL = "nvidia/nemotron-nano-9b-v2:free"
-else:
-    # Fallback to Hugging Face
-    API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
-    API_HEADERS = {"Authorization": f"Bearer {api_key}"}
-    MODEL = None
-
-# Initialize agent engine
-agent_engine = AgentEngine()
-
-# Initialize conversation history in session
-def get_conversation():
-    if 'conversation' not in session:
+def get_assistant():
+    """The Assistant services of the current app"""
+    return current_app.extensions['assistant']
+
+# Services of the current app, usable like the module-level objects they replace
+agent_engine = LocalProxy(lambda: get_assistant().agent_engine)
+rate_governor = LocalProxy(lambda: get_assistant().rate_governor)
+conversation_store = LocalProxy(lambda: get_assistant().conversation_store)
+idempotency_store = LocalProxy(lambda: get_assistant().idempotency_store)
+request_profiler = LocalProxy(lambda: get_assistant().request_profiler)
+scheduler = LocalProxy(lambda: get_assistant().scheduler)
+generation_policy = LocalProxy(lambda: get_assistant().generation_policy)
+speculator = LocalProxy(lambda: get_assistant().speculator)
+memory_store = LocalProxy(lambda: get_assistant().memory_store)
+
+bp = Blueprint('assistant', __name__)
+
+def call_upstream(payload):
+    """
+    Send a request to the upstream API, paced by the shared rate governor.
+    Upstream 429s are retried while the wait fits in the queue budget.
+    Raises RateLimitExceeded when the request has to be shed.
+    """
+    import requests
+    config = current_app.config
+    for attempt in range(UPSTREAM_MAX_RETRIES + 1):
+        with tracer.span('upstream.attempt', kind='SPAN_KIND_CLIENT', attempt=attempt + 1) as span:
+            span.set_attribute('rate_limit.queue_seconds', round(rate_governor.acquire(config['RATE_LIMIT_KEY']), 3))
+            response = requests.post(
+                config['API_URL'],
+                headers=config['API_HEADERS'],
+                json=payload
+            )
+            span.set_attribute('http.status_code', response.status_code)
+            retry_after = rate_governor.update_from_headers(
+                config['RATE_LIMIT_KEY'], response.status_code, response.headers
+            )
+        if response.status_code != 429:
+            return response
+        print(f"Upstream rate limited (attempt {attempt + 1}), retry after {retry_after:.1f}s")
+        if retry_after > rate_governor.max_wait:
+            break
+    raise RateLimitExceeded(
+        "Upstream API rate limit reached, please retry shortly",
+        retry_after=retry_after,
+        status_code=429
+    )
+
+def rate_limit_response(error):
+    """Build a 429/503 response with a Retry-After header"""
+    response = jsonify({"error": str(error), "retry_after": round(error.retry_after, 1)})
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = str(max(1, int(error.retry_after + 0.999)))
+    return response
+
+def admin_required(view):
+    """Reject requests to view without a valid X-Admin-Token header"""
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        token = current_app.config['ADMIN_TOKEN']
+        if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+            return jsonify({"error": "Admin token required"}), 403
+        return view(*args, **kwargs)
+    return guarded
+
+def use_native_tools():
+    """Check if the current model should get tool schemas instead of text instructions"""
+    config = current_app.config
+    return bool(config['OPENROUTER_API_KEY']) and config['NATIVE_TOOL_CALLING'] \
+        and agent_engine.supports_native_tools(config['MODEL'])
+
+def get_client_id():
+    """Get the ID that scopes this browser's conversations and memories"""
+    if 'client_id' not in g:
+        client_id = request.cookies.get(CLIENT_COOKIE) or session.get('client_id')
+        if not client_id or not re.fullmatch(r'[0-9a-f]{32}', client_id):
+            client_id = uuid.uuid4().hex
+        g.client_id = client_id
+    return g.client_id
+
+def get_requester_id():
+    """
+    Stable identity of the caller for idempotency keys and per-client limits.
+    A request without the client cookie is issued a fresh client ID, so
+    clients that don't keep cookies are identified by their Authorization
+    header or, failing that, their remote address instead.
+    """
+    client_id = request.cookies.get(CLIENT_COOKIE) or session.get('client_id')
+    if client_id and re.fullmatch(r'[0-9a-f]{32}', client_id):
+        return f"client:{client_id}"
+    credentials = request.headers.get('Authorization')
+    if credentials:
+        return f"auth:{hashlib.sha256(credentials.encode()).hexdigest()[:32]}"
+    return f"addr:{request.remote_addr or 'unknown'}"
+
+@bp.after_app_request
+def persist_client_id(response):
+    """Set the client ID cookie when it was just issued"""
+    if 'client_id' in g and request.cookies.get(CLIENT_COOKIE) != g.client_id:
+        response.set_cookie(CLIENT_COOKIE, g.client_id, max_age=CLIENT_COOKIE_MAX_AGE, httponly=True)
+    return response
+
+def get_conversation_id(data):
+    """Get the conversation ID from the request, defaulting to one per session"""
+    conversation_id = (data or {}).get('conversation_id')
+    if conversation_id:
+        return str(conversation_id)[:128]
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
+    return session['conversation_id']
+
+def get_conversation(conversation_id):
+    """
+    Resume a conversation from the store, or start a new one
+    Returns: (conversation, number of messages already persisted)
+    """
+    with tracer.span('conversation.load') as span:
+        conversation = conversation_store.load(get_client_id(), conversation_id)
+        span.set_attribute('messages', len(conversation or []))
+    if not conversation:
         # Use agent system prompt instead of basic prompt
-        session['conversation'] = [
-            {"role": "system", "content": agent_engine.create_system_prompt()}
+        conversation = [
+            {"role": "system", "content": agent_engine.create_system_prompt(native_tools=use_native_tools())}
+        ]
+        return conversation, 0
+    if not use_native_tools() and agent_engine.uses_native_protocol(conversation):
+        # Recorded before the model fell back to the text protocol: rewrite it and persist from the start
+        agent_engine.convert_to_text_protocol(conversation)
+        return conversation, 0
+    return conversation, len(conversation)
+
+def save_conversation(conversation_id, conversation, persisted, checkpoint=None):
+    """
+    Persist the messages added since the conversation was loaded
+    Args:
+        checkpoint: State of the unfinished turn; None marks the turn as finished
+    Returns: number of messages now persisted
+    """
+    with tracer.span('conversation.save', messages_written=len(conversation) - persisted,
+                     checkpoint=checkpoint is not None):
+        conversation_store.save(get_client_id(), conversation_id, conversation, start=persisted, checkpoint=checkpoint)
+    if random.random() < 0.01:
+        conversation_store.purge_expired()
+    return len(conversation)
+
+def save_checkpoint(conversation_id, conversation, persisted, user_message, turn_start, iterations, tool_calls,
+                    mode='loop'):
+    """
+    Persist an unfinished turn after a completed tool step, so a retry or
+    /chat/resume continues from it instead of repeating tool calls and upstream requests
+    Args:
+        mode: "loop", or "plan" once an executed plan only needs its synthesis call
+    Returns: number of messages now persisted
+    """
+    return save_conversation(conversation_id, conversation, persisted, checkpoint={
+        'user_message': user_message,
+        'turn_start': turn_start,
+        'iterations': iterations,
+        'tool_calls': tool_calls,
+        'mode': mode
+    })
+
+def history_window_start(conversation, turn_start):
+    """
+    Index of the oldest message sent upstream: the last HISTORY_WINDOW
+    messages before this turn, starting at a user message
+    """
+    if not memory_store:
+        return 1
+    start = max(1, turn_start - current_app.config['HISTORY_WINDOW'])
+    while start < turn_start and conversation[start]['role'] != 'user':
+        start += 1
+    return start
+
+def recall_memories(conversation_id, query, window_start):
+    """Find memories relevant to the new message that aren't already in the history window"""
+    if not memory_store:
+        return []
+    try:
+        with tracer.span('memory.recall') as span:
+            memories = memory_store.search(
+                get_client_id(), query, top_k=current_app.config['MEMORY_TOP_K'],
+                exclude=lambda memory: memory.get('conversation_id') == conversation_id
+                    and memory.get('position', 0) >= window_start
+            )
+            span.set_attribute('memories', len(memories))
+            return memories
+    except Exception as e:
+        print(f"Memory recall failed: {str(e)}")
+        return []
+
+def build_context(conversation, window_start, memories):
+    """Messages sent upstream: system prompt with recalled memories, then the history window"""
+    system_message = conversation[0]
+    if memories:
+        recalled = "\n".join(f"- {memory['text']}" for memory in memories)
+        system_message = {
+            "role": "system",
+            "content": f"{system_message['content']}\n\nRelevant memories from earlier conversations:\n{recalled}"
+        }
+    return [system_message] + conversation[window_start:]
+
+def remember_turn(conversation_id, turn_start, user_message, reply, tool_calls):
+    """Store a finished turn and its tool results as long-term memories"""
+    if not memory_store:
+        return
+    metadata = {'conversation_id': conversation_id, 'position': turn_start}
+    try:
+        texts = [f"User: {user_message}\nAssistant: {reply}"[:MEMORY_TEXT_LIMIT]]
+        for tool_call in tool_calls:
+            texts.append(
+                f"Tool {tool_call['tool']}({json.dumps(tool_call['parameters'])}) returned: "
+                f"{json.dumps(tool_call['result'])}"[:MEMORY_TEXT_LIMIT]
+            )
+        memory_store.add_many(get_client_id(), texts, metadata)
+        if random.random() < 0.01:
+            memory_store.purge_expired()
+    except Exception as e:
+        print(f"Failed to store memory: {str(e)}")
+
+def generation_settings(intent, phase, text_protocol):
+    """Token budget, temperature and stop sequences for one upstream call"""
+    if not current_app.config['ADAPTIVE_GENERATION']:
+        return DEFAULT_GENERATION
+    return generation_policy.settings(intent, phase, text_protocol)
+
+def build_payload(conversation, native_tools, generation=None):
+    """Build the upstream request payload for the configured API"""
+    generation = generation or DEFAULT_GENERATION
+    if current_app.config['OPENROUTER_API_KEY']:
+        # Use OpenRouter API format
+        payload = {
+            "model": current_app.config['MODEL'],
+            "messages": conversation,
+            "temperature": generation['temperature'],
+            "max_tokens": generation['max_tokens']
+        }
+        if generation['stop']:
+            payload["stop"] = generation['stop']
+        if native_tools:
+            payload["tools"] = agent_engine.tool_schemas
+            payload["tool_choice"] = "auto"
+        return payload
+    
+    # Fallback to Hugging Face format
+    prompt = "<s>[INST] "
+    system_message = None
+    conversation_messages = []
+    
+    for msg in conversation:
+        if msg["role"] == "system":
+            system_message = msg["content"]
+        else:
+            conversation_messages.append(msg)
+    
+    if system_message:
+        prompt += f"<<SYS>>\n{system_message}\n<</SYS>>\n\n"
+    
+    for i, msg in enumerate(conversation_messages):
+        if msg["role"] == "user":
+            if i > 0:
+                prompt += "[INST] "
+            prompt += f"{msg['content']} [/INST]"
+        elif msg["role"] == "assistant":
+            prompt += f" {msg['content']}</s>"
+    
+    payload = {
+        "inputs": prompt,
+        "parameters": {
+            "max_new_tokens": generation['max_tokens'],
+            "temperature": generation['temperature'],
+            "top_p": 0.9,
+            "return_full_text": False
+        }
+    }
+    if generation['stop']:
+        payload["parameters"]["stop"] = generation['stop']
+    return payload
+
+class UpstreamError(Exception):
+    """Raised when the upstream API returns an unusable response"""
+
+def extract_reply(response_data):
+    """Pull the generated text out of an upstream response body"""
+    if current_app.config['OPENROUTER_API_KEY']:
+        if "choices" in response_data and len(response_data["choices"]) > 0:
+            return (response_data["choices"][0]["message"].get("content") or "").strip()
+    elif isinstance(response_data, list) and len(response_data) > 0:
+        return response_data[0]['generated_text'].strip()
+    return ""
+
+def record_usage(span, response_data):
+    """Attach token usage from an OpenAI-compatible response to a span"""
+    usage = response_data.get('usage') if isinstance(response_data, dict) else None
+    if usage:
+        span.set_attribute('llm.usage.prompt_tokens', usage.get('prompt_tokens'))
+        span.set_attribute('llm.usage.completion_tokens', usage.get('completion_tokens'))
+        span.set_attribute('llm.usage.total_tokens', usage.get('total_tokens'))
+
+def finish_reason(response_data):
+    """Why generation stopped ('stop', 'length', ...), if the upstream reports it"""
+    if isinstance(response_data, dict) and response_data.get('choices'):
+        return response_data['choices'][0].get('finish_reason')
+    return None
+
+def has_tool_calls(response_data):
+    """Check if an upstream response's message carries native tool calls"""
+    if isinstance(response_data, dict) and response_data.get('choices'):
+        return bool(response_data['choices'][0].get('message', {}).get('tool_calls'))
+    return False
+
+def completion_tokens(response_data, text):
+    """Tokens generated for a reply, estimated from its text when usage is missing"""
+    usage = response_data.get('usage') if isinstance(response_data, dict) else None
+    return (usage or {}).get('completion_tokens') or estimate_tokens(text)
+
+def continue_reply(context, text, response_data, native_tools, intent):
+    """
+    Continue a reply that was cut off by its token budget. Only adaptive
+    generation continues; with the fixed settings a cut-off reply is returned
+    as is, and so is a message carrying tool calls, which a plain-text
+    continuation would drop.
+    Returns: (full reply text, completion tokens of all parts)
+    """
+    tokens = completion_tokens(response_data, text)
+    if not current_app.config['ADAPTIVE_GENERATION']:
+        return text, tokens
+    for _ in range(current_app.config['MAX_CONTINUATIONS']):
+        if finish_reason(response_data) != 'length' or has_tool_calls(response_data):
+            break
+        print(f"Reply hit the token budget after {tokens} tokens, continuing")
+        messages = context + [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": CONTINUE_PROMPT}
+        ]
+        with tracer.span('upstream.continuation', kind='SPAN_KIND_CLIENT', tokens_so_far=tokens) as span:
+            response = call_upstream(build_payload(messages, native_tools, generation_policy.continuation_settings(intent, not native_tools)))
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code != 200:
+                # Keep the partial reply rather than failing the turn
+                span.set_error(response.text[:200])
+                break
+            response_data = response.json()
+            record_usage(span, response_data)
+        more = extract_reply(response_data)
+        text = f"{text} {more}" if text[-1:].isalnum() and more[:1].isalnum() else text + more
+        tokens += completion_tokens(response_data, more)
+    return text, tokens
+
+def request_completion(messages, intent='chat', phase=ANSWER):
+    """Make one plain-text upstream call (no native tools) and return the reply text"""
+    with tracer.span('upstream.request', kind='SPAN_KIND_CLIENT', model=current_app.config['RATE_LIMIT_KEY'],
+                     native_tools=False, messages=len(messages)) as span:
+        generation = generation_settings(intent, phase, text_protocol=True)
+        span.set_attribute('generation.max_tokens', generation['max_tokens'])
+        response = call_upstream(build_payload(messages, native_tools=False, generation=generation))
+        print(f"Response status: {response.status_code}")
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code != 200:
+            raise UpstreamError(f"API error: {response.text}")
+        response_data = response.json()
+        record_usage(span, response_data)
+    reply, tokens = continue_reply(messages, extract_reply(response_data), response_data, False, intent)
+    generation_policy.record(intent, phase, tokens)
+    return reply
+
+def start_speculation(user_message, suggestions):
+    """
+    Run predicted side-effect-free tool calls in the background while the
+    first upstream call is in flight; unused results are dropped with the request
+    """
+    if not current_app.config['SPECULATIVE_EXECUTION']:
+        return None
+    speculation = speculator.start(agent_engine.execute_tool_call, user_message, suggestions)
+    if speculation:
+        @after_this_request
+        def discard_speculation(response):
+            speculation.discard()
+            return response
+    return speculation
+
+def run_plan_mode(conversation, window_start, memories, intent='chat'):
+    """
+    Plan-then-execute: ask for a tool dependency graph and run it. Re-plans
+    once if a step fails. The plan and its results are added to the
+    conversation for synthesize_plan_reply().
+    Returns: (reply, tool_calls, llm_calls), reply being None when tools ran and
+    the synthesis call is still due, or None if the model didn't return a usable plan
+    """
+    context = build_context(conversation, window_start, memories)
+    user_message = context[-1]
+    planning_messages = context[:-1] + [{
+        "role": "user",
+        "content": f"{user_message['content']}\n\n{agent_engine.create_planning_prompt()}"
+    }]
+    
+    print("\n=== Planning ===")
+    with tracer.span('agent.plan'):
+        plan_response = request_completion(planning_messages, intent, PLAN)
+    llm_calls = 1
+    try:
+        steps, answer = agent_engine.parse_plan(plan_response)
+    except ValueError as e:
+        print(f"Could not parse plan, falling back to agent loop: {e}")
+        return None
+    
+    if not steps:
+        reply = answer or plan_response
+        conversation.append({"role": "assistant", "content": reply})
+        return reply, [], llm_calls
+    
+    all_steps = list(steps)
+    print(f"Executing plan with {len(steps)} steps")
+    with tracer.span('agent.execute_plan', steps=len(steps)):
+        results, parameters = agent_engine.execute_plan(steps)
+    
+    for _ in range(MAX_REPLANS):
+        failed = agent_engine.failed_steps(all_steps, results)
+        if not failed:
+            break
+        print(f"\n=== Re-planning after failed steps: {[step['id'] for step in failed]} ===")
+        replan_messages = planning_messages + [
+            {"role": "assistant", "content": plan_response},
+            {"role": "user", "content": agent_engine.format_plan_results(all_steps, results) +
+                "\nSome steps failed. Return a revised plan for the remaining work only, using new step ids. "
+                "You may reference the successful steps above."}
         ]
-    return session['conversation']
+        with tracer.span('agent.replan', failed_steps=len(failed)):
+            plan_response = request_completion(replan_messages, intent, PLAN)
+        llm_calls += 1
+        try:
+            steps, _ = agent_engine.parse_plan(plan_response)
+        except ValueError as e:
+            print(f"Could not parse revised plan: {e}")
+            break
+        renamed = agent_engine.rename_reused_ids(steps, results)
+        if renamed:
+            # Reported to the model through the recorded plan and PLAN_RESULTS
+            print(f"Revised plan reused step ids, renamed: {renamed}")
+        all_steps.extend(steps)
+        with tracer.span('agent.execute_plan', steps=len(steps)):
+            results, revised_parameters = agent_engine.execute_plan(steps, results)
+        parameters.update(revised_parameters)
+    
+    # Report what each tool was actually called with, not the {{step.path}} templates
+    tool_calls = [{
+        'tool': step['tool'],
+        'parameters': parameters[step['id']],
+        'result': results[step['id']]
+    } for step in all_steps]
+    
+    # Record the plan and its results in the text protocol so either mode can continue the conversation
+    conversation.append({"role": "assistant", "content": json.dumps({"steps": all_steps})})
+    conversation.append({
+        "role": "user",
+        "content": agent_engine.format_plan_results(all_steps, results) +
+            "\nUsing these results, give the final answer to the user. Do not call any more tools."
+    })
+    return None, tool_calls, llm_calls
+
+def synthesize_plan_reply(conversation, window_start, memories, intent='chat'):
+    """Make the single synthesis call over the plan results recorded by run_plan_mode()"""
+    print("\n=== Synthesis ===")
+    with tracer.span('agent.synthesis'):
+        reply = request_completion(build_context(conversation, window_start, memories), intent) or "I've completed the task. Let me know if you need anything else!"
+    conversation.append({"role": "assistant", "content": reply})
+    return reply
+
+@bp.before_app_request
+def start_profile():
+    """Start sampling this request's thread if it was selected for profiling"""
+    if request_profiler.enabled and request_profiler.should_profile(request.headers):
+        g.profile_session = request_profiler.start()
 
-@app.route('/')
+@bp.after_app_request
+def finish_profile(response):
+    """Write the request's profile and return its ID in X-Profile-Id"""
+    profile_session = g.pop('profile_session', None)
+    if profile_session:
+        profile_id = request_profiler.finish(profile_session, {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code
+        })
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@bp.route('/')
 def home():
     """Health check endpoint"""
     return jsonify({
@@ -65,169 +700,357 @@ def home():
         'version': '1.0.0'
     })
 
-@app.route('/chat', methods=['POST'])
+@bp.route('/chat', methods=['POST'])
 def chat():
     """
     Handle chat messages with agentic capabilities
-    Expects JSON: {"message": "user message"}
-    Returns: {"reply": "AI response", "tool_calls": [], "iterations": 0}
+    Expects JSON: {"message": "user message", "conversation_id": "id" (optional),
+                   "mode": "loop" | "plan" (optional)}
+    Optional header: Idempotency-Key - duplicates wait for the first request's
+    result, retries after it finished get the stored reply
+    Returns: {"reply": "AI response", "tool_calls": [], "iterations": 0, "conversation_id": "id"}
+    """
+    with tracer.span('POST /chat', kind='SPAN_KIND_SERVER') as span:
+        response = current_app.make_response(handle_idempotent_chat())
+        span.set_attribute('http.status_code', response.status_code)
+        if span.trace_id:
+            response.headers['X-Trace-Id'] = span.trace_id
+        if 'queue_wait' in g:
+            response.headers['X-Queue-Wait'] = f"{g.queue_wait:.3f}"
+        return response
+
+@bp.route('/chat/resume', methods=['POST'])
+def resume_chat():
+    """
+    Continue a turn interrupted by an upstream failure from its last completed step
+    Expects optional JSON: {"conversation_id": "id"} (defaults to the session's conversation)
+    Returns: the /chat response for the interrupted message, or 404 if there is nothing to resume
+    """
+    with tracer.span('POST /chat/resume', kind='SPAN_KIND_SERVER') as span:
+        data = request.get_json(silent=True) or {}
+        conversation_id = get_conversation_id(data)
+        checkpoint = conversation_store.load_checkpoint(get_client_id(), conversation_id)
+        if not checkpoint:
+            response = current_app.make_response((jsonify({"error": "No interrupted turn to resume"}), 404))
+        else:
+            response = current_app.make_response(run_scheduled_chat({
+                **data,
+                'message': checkpoint['user_message'],
+                'conversation_id': conversation_id
+            }))
+        span.set_attribute('http.status_code', response.status_code)
+        if span.trace_id:
+            response.headers['X-Trace-Id'] = span.trace_id
+        return response
+
+def handle_idempotent_chat():
+    """Run /chat, deduplicating by the Idempotency-Key header when present"""
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        return run_scheduled_chat()
+    
+    key = f"{get_requester_id()}:{idempotency_key[:128]}"
+    fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+    state, stored = idempotency_store.begin(key, fingerprint)
+    if state == PENDING:
+        print(f"Duplicate request for Idempotency-Key {idempotency_key}, waiting for the original")
+        state, stored = idempotency_store.wait(key, fingerprint)
+    
+    if state == CONFLICT:
+        return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+    if state == PENDING:
+        return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+    if state == DONE:
+        status, body = stored
+        response = current_app.response_class(body, status=status, mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    
+    # Only successful replies are stored; failed requests release the key so a retry runs again
+    completed = False
+    try:
+        response = current_app.make_response(run_scheduled_chat())
+        if response.status_code == 200:
+            idempotency_store.complete(key, response.status_code, response.get_data(as_text=True))
+            completed = True
+        return response
+    finally:
+        if not completed:
+            idempotency_store.abandon(key)
+
+def run_scheduled_chat(data=None):
+    """Run /chat once the fair scheduler admits this client"""
+    try:
+        with tracer.span('scheduler.wait') as span:
+            ticket, waited = scheduler.acquire(get_requester_id())
+            span.set_attribute('scheduler.wait_seconds', round(waited, 3))
+    except RateLimitExceeded as e:
+        print(f"Scheduler: {e}")
+        return rate_limit_response(e)
+    g.queue_wait = waited
+    try:
+        return run_chat(data)
+    finally:
+        scheduler.release(ticket)
+
+def run_chat(data=None):
+    """
+    Run the agent loop for one /chat request
+    Args:
+        data: Request JSON (defaults to the current request's body)
     """
     try:
         # Get user message from request
-        data = request.get_json()
+        if data is None:
+            data = request.get_json()
         if not data or 'message' not in data:
             return jsonify({"error": "Message is required"}), 400
         
         user_message = data['message']
         
-        # Get conversation history
-        conversation = get_conversation()
+        # Resume conversation history from the server-side store
+        conversation_id = get_conversation_id(data)
+        conversation, persisted = get_conversation(conversation_id)
+        
+        # A retry of an interrupted turn continues from its last completed step
+        checkpoint = conversation_store.load_checkpoint(get_client_id(), conversation_id) if persisted else None
+        resuming = checkpoint is not None and checkpoint['user_message'] == user_message
+        if checkpoint and not resuming:
+            # A different message abandons the interrupted turn
+            del conversation[checkpoint['turn_start']:]
+            persisted = min(persisted, checkpoint['turn_start'])
+        
+        if resuming:
+            print(f"Resuming interrupted turn after {len(checkpoint['tool_calls'])} tool calls")
+            turn_start = checkpoint['turn_start']
+        else:
+            # Enhance message with intent detection
+            enhanced_message = agent_engine.enhance_message_with_intent(user_message)
+            
+            # Add user message to conversation
+            turn_start = len(conversation)
+            conversation.append({"role": "user", "content": enhanced_message})
         
-        # Enhance message with intent detection
-        enhanced_message = agent_engine.enhance_message_with_intent(user_message)
+        # Send recent history plus recalled memories instead of the full transcript
+        window_start = history_window_start(conversation, turn_start)
+        memories = recall_memories(conversation_id, user_message, window_start)
+        suggestions = agent_engine.detect_intent(user_message)
+        intent = generation_policy.intent_key(suggestions)
         
-        # Add user message to conversation
-        conversation.append({"role": "user", "content": enhanced_message})
+        if resuming:
+            plan_mode = checkpoint.get('mode') == 'plan'
+        else:
+            plan_mode = data.get('mode', current_app.config['AGENT_MODE']) == 'plan'
+        if plan_mode:
+            if resuming:
+                # The plan already ran; only its synthesis call is left
+                plan_result = None, checkpoint['tool_calls'], checkpoint['iterations']
+            else:
+                try:
+                    plan_result = run_plan_mode(conversation, window_start, memories, intent)
+                except RateLimitExceeded as e:
+                    print(f"Rate limit in plan mode: {str(e)}")
+                    return rate_limit_response(e)
+                except UpstreamError as e:
+                    return jsonify({"error": str(e)}), 500
+            
+            if plan_result:
+                reply, tool_calls_made, llm_calls = plan_result
+                if reply is None:
+                    # Checkpoint the tool results, so a failed synthesis doesn't run the plan again
+                    if not resuming:
+                        persisted = save_checkpoint(conversation_id, conversation, persisted, user_message,
+                                                    turn_start, llm_calls, tool_calls_made, mode='plan')
+                    try:
+                        reply = synthesize_plan_reply(conversation, window_start, memories, intent)
+                    except RateLimitExceeded as e:
+                        print(f"Rate limit in plan synthesis: {str(e)}")
+                        return rate_limit_response(e)
+                    except UpstreamError as e:
+                        return jsonify({
+                            "error": str(e),
+                            "resumable": True,
+                            "conversation_id": conversation_id
+                        }), 500
+                    llm_calls += 1
+                save_conversation(conversation_id, conversation, persisted)
+                remember_turn(conversation_id, turn_start, user_message, reply, tool_calls_made)
+                return jsonify({
+                    "reply": reply,
+                    "tool_calls": tool_calls_made,
+                    "iterations": llm_calls,
+                    "conversation_id": conversation_id
+                })
         
         # Agent loop for multi-step reasoning
-        iterations = 0
+        iterations = checkpoint['iterations'] if resuming else 0
         max_iterations = 5
-        tool_calls_made = []
+        tool_calls_made = checkpoint['tool_calls'] if resuming else []
+        speculation = None if tool_calls_made else start_speculation(user_message, suggestions)
         
         while iterations < max_iterations:
             iterations += 1
             
-            try:
-                if openrouter_api_key:
-                    # Use OpenRouter API format
-                    # Use full conversation for better context
-                    payload = {
-                        "model": MODEL,
-                        "messages": conversation,
-                        "temperature": 0.7,
-                        "max_tokens": 1000
-                    }
-                else:
-                    # Fallback to Hugging Face format
-                    prompt = "<s>[INST] "
-                    system_message = None
-                    conversation_messages = []
-                    
-                    for msg in conversation:
-                        if msg["role"] == "system":
-                            system_message = msg["content"]
-                        else:
-                            conversation_messages.append(msg)
+            with tracer.span('agent.iteration', iteration=iterations) as iteration_span:
+                try:
+                    native_tools = use_native_tools()
+                    context = build_context(conversation, window_start, memories)
+                    first_iteration = not tool_calls_made
+                    phase = generation_policy.predict_phase(intent, tool_calls_made)
+                    generation = generation_settings(intent, phase, text_protocol=not native_tools)
+                    iteration_span.set_attribute('generation.phase', phase)
+                    iteration_span.set_attribute('generation.max_tokens', generation['max_tokens'])
+                    payload = build_payload(context, native_tools, generation)
+                
+                    print(f"\n=== Iteration {iterations} ===")
+                    print(f"Sending request to: {current_app.config['API_URL']}")
+                
+                    # Make request to API
+                    with tracer.span('upstream.request', kind='SPAN_KIND_CLIENT', model=current_app.config['RATE_LIMIT_KEY'],
+                                     native_tools=native_tools, messages=len(payload.get('messages', []))) as upstream_span:
+                        response = call_upstream(payload)
                     
-                    if system_message:
-                        prompt += f"<<SYS>>\n{system_message}\n<</SYS>>\n\n"
+                        print(f"Response status: {response.status_code}")
+                        upstream_span.set_attribute('http.status_code', response.status_code)
                     
-                    for i, msg in enumerate(conversation_messages):
-                        if msg["role"] == "user":
-                            if i > 0:
-                                prompt += "[INST] "
-                            prompt += f"{msg['content']} [/INST]"
-                        elif msg["role"] == "assistant":
-                            prompt += f" {msg['content']}</s>"
+                        if response.status_code != 200:
+                            upstream_span.set_error(response.text[:200])
+                            if native_tools and agent_engine.is_tool_support_error(response.status_code, response.text):
+                                # Model can't do function calling, fall back to the text protocol
+                                print(f"Native tool calling unsupported by {current_app.config['MODEL']}, using text protocol")
+                                agent_engine.disable_native_tools(current_app.config['MODEL'])
+                                agent_engine.convert_to_text_protocol(conversation)
+                                persisted = 0  # earlier messages were rewritten
+                                iterations -= 1
+                                continue
+                            return jsonify({
+                                "error": f"API error: {response.text}",
+                                "resumable": bool(tool_calls_made),
+                                "conversation_id": conversation_id
+                            }), 500
                     
-                    payload = {
-                        "inputs": prompt,
-                        "parameters": {
-                            "max_new_tokens": 1000,
-                            "temperature": 0.7,
-                            "top_p": 0.9,
-                            "return_full_text": False
-                        }
-                    }
-                
-                print(f"\n=== Iteration {iterations} ===")
-                print(f"Sending request to: {API_URL}")
-                
-                # Make request to API
-                response = requests.post(
-                    API_URL,
-                    headers=API_HEADERS,
-                    json=payload
-                )
+                        response_data = response.json()
+                        record_usage(upstream_span, response_data)
                 
-                print(f"Response status: {response.status_code}")
-                
-                if response.status_code != 200:
-                    return jsonify({"error": f"API error: {response.text}"}), 500
-                
-                response_data = response.json()
-                
-                if openrouter_api_key:
-                    if "choices" in response_data and len(response_data["choices"]) > 0:
-                        ai_response = response_data["choices"][0]["message"]["content"].strip()
-                        if not ai_response:
-                            ai_response = "I'm processing your request. How can I help you?"
-                    else:
-                        ai_response = "Sorry, I couldn't generate a response. Please try again."
-                else:
-                    if isinstance(response_data, list) and len(response_data) > 0:
-                        ai_response = response_data[0]['generated_text'].strip()
+                    if current_app.config['OPENROUTER_API_KEY']:
+                        if "choices" in response_data and len(response_data["choices"]) > 0:
+                            message = response_data["choices"][0]["message"]
+                        
+                            with tracer.span('tool.parse', protocol='native'):
+                                native_calls = agent_engine.parse_native_tool_calls(message) if native_tools else []
+                            if native_calls:
+                                print(f"Native tool calls detected: {[call['name'] for call in native_calls]}")
+                                generation_policy.record(intent, TOOL, completion_tokens(response_data, ''), first_iteration)
+                            
+                                # Execute all requested tools (in parallel when there are several)
+                                results = agent_engine.execute_tool_calls(native_calls, speculation)
+                                conversation.append(agent_engine.format_native_tool_call_message(message, native_calls))
+                                for call, tool_result in zip(native_calls, results):
+                                    tool_calls_made.append({
+                                        'tool': call['name'],
+                                        'parameters': call['parameters'],
+                                        'result': tool_result
+                                    })
+                                    conversation.append(agent_engine.format_native_tool_result(call, tool_result))
+                                persisted = save_checkpoint(conversation_id, conversation, persisted, user_message,
+                                                            turn_start, iterations, tool_calls_made)
+                            
+                                # Continue loop to let AI process the results
+                                continue
+                        
+                            ai_response = (message.get("content") or "").strip()
+                            # Replies cut off by the token budget are continued transparently
+                            ai_response, reply_tokens = continue_reply(context, ai_response, response_data, native_tools, intent)
+                            if not ai_response:
+                                ai_response = "I'm processing your request. How can I help you?"
+                        else:
+                            ai_response = "Sorry, I couldn't generate a response. Please try again."
+                            reply_tokens = None
                     else:
-                        ai_response = "Sorry, I couldn't generate a response. Please try again."
+                        if isinstance(response_data, list) and len(response_data) > 0:
+                            ai_response = response_data[0]['generated_text'].strip()
+                            reply_tokens = estimate_tokens(ai_response)
+                        else:
+                            ai_response = "Sorry, I couldn't generate a response. Please try again."
+                            reply_tokens = None
                 
-                print(f"AI Response: {ai_response[:200]}...")
+                    print(f"AI Response: {ai_response[:200]}...")
                 
-                # Check if AI wants to use a tool
-                tool_name, parameters = agent_engine.parse_tool_call(ai_response)
+                    # Check if AI wants to use a tool (text protocol, a cheap substring check when unused)
+                    with tracer.span('tool.parse', protocol='text', response_chars=len(ai_response)):
+                        tool_name, parameters = agent_engine.parse_tool_call(ai_response)
+                    if reply_tokens:
+                        generation_policy.record(intent, TOOL if tool_name else ANSWER, reply_tokens, first_iteration)
                 
-                if tool_name:
-                    print(f"Tool call detected: {tool_name} with params: {parameters}")
+                    if tool_name:
+                        print(f"Tool call detected: {tool_name} with params: {parameters}")
                     
-                    # Execute the tool
-                    tool_result = agent_engine.execute_tool_call(tool_name, parameters)
-                    tool_calls_made.append({
-                        'tool': tool_name,
-                        'parameters': parameters,
-                        'result': tool_result
-                    })
+                        # Execute the tool
+                        tool_result = agent_engine.execute_tool_call(tool_name, parameters, speculation)
+                        tool_calls_made.append({
+                            'tool': tool_name,
+                            'parameters': parameters,
+                            'result': tool_result
+                        })
                     
-                    print(f"Tool result: {tool_result}")
+                        print(f"Tool result: {tool_result}")
                     
-                    # Add AI response with tool call to conversation
-                    conversation.append({"role": "assistant", "content": ai_response})
+                        # Add AI response with tool call to conversation
+                        conversation.append({"role": "assistant", "content": ai_response})
                     
-                    # Add tool result to conversation
-                    tool_result_message = agent_engine.format_tool_result(tool_name, tool_result)
-                    conversation.append({"role": "user", "content": tool_result_message})
+                        # Add tool result to conversation
+                        tool_result_message = agent_engine.format_tool_result(tool_name, tool_result)
+                        conversation.append({"role": "user", "content": tool_result_message})
+                        persisted = save_checkpoint(conversation_id, conversation, persisted, user_message,
+                                                    turn_start, iterations, tool_calls_made)
                     
-                    # Continue loop to let AI process the result
-                    continue
-                else:
-                    # No tool call, this is the final response
-                    conversation.append({"role": "assistant", "content": ai_response})
-                    session['conversation'] = conversation
+                        # Continue loop to let AI process the result
+                        continue
+                    else:
+                        # No tool call, this is the final response
+                        conversation.append({"role": "assistant", "content": ai_response})
+                        save_conversation(conversation_id, conversation, persisted)
+                        remember_turn(conversation_id, turn_start, user_message, ai_response, tool_calls_made)
                     
-                    return jsonify({
-                        "reply": ai_response,
-                        "tool_calls": tool_calls_made,
-                        "iterations": iterations
-                    })
+                        return jsonify({
+                            "reply": ai_response,
+                            "tool_calls": tool_calls_made,
+                            "iterations": iterations,
+                            "conversation_id": conversation_id
+                        })
                 
-            except Exception as e:
-                print(f"Exception in iteration {iterations}: {str(e)}")
-                return jsonify({"error": f"API error: {str(e)}"}), 500
+                except RateLimitExceeded as e:
+                    iteration_span.set_error(e)
+                    print(f"Rate limit in iteration {iterations}: {str(e)}")
+                    return rate_limit_response(e)
+                except Exception as e:
+                    iteration_span.set_error(e)
+                    print(f"Exception in iteration {iterations}: {str(e)}")
+                    # Completed tool steps are checkpointed; retrying the message or /chat/resume continues from them
+                    return jsonify({
+                        "error": f"API error: {str(e)}",
+                        "resumable": bool(tool_calls_made),
+                        "conversation_id": conversation_id
+                    }), 500
         
         # Max iterations reached
         final_response = "I've completed the task. Let me know if you need anything else!"
         conversation.append({"role": "assistant", "content": final_response})
-        session['conversation'] = conversation
+        save_conversation(conversation_id, conversation, persisted)
+        remember_turn(conversation_id, turn_start, user_message, final_response, tool_calls_made)
         
         return jsonify({
             "reply": final_response,
             "tool_calls": tool_calls_made,
-            "iterations": iterations
+            "iterations": iterations,
+            "conversation_id": conversation_id
         })
         
     except Exception as e:
         print(f"Exception in chat endpoint: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
-@app.route('/tools', methods=['GET'])
+@bp.route('/tools', methods=['GET'])
 def list_tools():
     """List all available tools"""
     from tools import TOOL_DEFINITIONS
@@ -236,7 +1059,7 @@ def list_tools():
         'tools': TOOL_DEFINITIONS
     })
 
-@app.route('/execute-tool', methods=['POST'])
+@bp.route('/execute-tool', methods=['POST'])
 def execute_tool_endpoint():
     """Execute a specific tool directly"""
     try:
@@ -247,20 +1070,119 @@ def execute_tool_endpoint():
         tool_name = data['tool_name']
         parameters = data.get('parameters', {})
         
+        from tools import execute_tool
         result = execute_tool(tool_name, **parameters)
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/clear', methods=['POST'])
+@bp.route('/admin/profiles', methods=['GET'])
+@admin_required
+def list_profiles():
+    """List recorded request profiles (requires X-Admin-Token)"""
+    return jsonify({
+        'status': 'success',
+        'profiles': request_profiler.list_profiles()
+    })
+
+@bp.route('/admin/profiles/<path:filename>', methods=['GET'])
+@admin_required
+def get_profile(filename):
+    """Download a profile file, e.g. <id>.wall.folded (requires X-Admin-Token)"""
+    return send_from_directory(request_profiler.directory, filename, mimetype='text/plain')
+
+@bp.route('/admin/scheduler', methods=['GET'])
+@admin_required
+def scheduler_stats():
+    """Agent loop queue depth and wait times (requires X-Admin-Token)"""
+    return jsonify({
+        'status': 'success',
+        'scheduler': scheduler.stats()
+    })
+
+@bp.route('/admin/generation', methods=['GET'])
+@admin_required
+def generation_stats():
+    """Learned generation budgets per intent and phase (requires X-Admin-Token)"""
+    return jsonify({
+        'status': 'success',
+        'generation': generation_policy.stats()
+    })
+
+@bp.route('/admin/speculation', methods=['GET'])
+@admin_required
+def speculation_stats():
+    """Speculative tool execution hit rates (requires X-Admin-Token)"""
+    return jsonify({
+        'status': 'success',
+        'speculation': speculator.stats()
+    })
+
+@bp.route('/admin/cache', methods=['GET'])
+@admin_required
+def cache_stats():
+    """Shared cache size and this worker's hit rate (requires X-Admin-Token)"""
+    cache = get_assistant().shared_cache
+    return jsonify({
+        'status': 'success',
+        'cache': cache.stats() if cache else {'enabled': False}
+    })
+
+@bp.route('/clear', methods=['POST'])
 def clear_conversation():
-    """Clear the conversation history"""
-    session.pop('conversation', None)
+    """
+    Clear a conversation's history
+    Expects optional JSON: {"conversation_id": "id"} (defaults to the session's conversation)
+    """
+    data = request.get_json(silent=True)
+    conversation_store.delete(get_client_id(), get_conversation_id(data))
+    if not (data or {}).get('conversation_id'):
+        session.pop('conversation_id', None)
     return jsonify({"status": "conversation cleared"})
 
+def create_app(config=None, preload=False):
+    """
+    Application factory
+    Args:
+        config: Optional dict of settings overriding the environment
+        preload: Load all lazy backends now (for gunicorn --preload, so
+            workers share them copy-on-write)
+    """
+    app = Flask(__name__)
+    app.config.update(load_config(config))
+    # Required for session
+    app.secret_key = app.config['SECRET_KEY']
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)  # Session expires in 2 hours
+    
+    # Enable CORS for all routes
+    from flask_cors import CORS
+    CORS(app, supports_credentials=True)
+    
+    # The tracer is process-wide, like the shared cache
+    tracer.configure(
+        path=app.config['TRACE_FILE'],
+        max_mb=app.config['TRACE_MAX_MB'],
+        backups=app.config['TRACE_BACKUPS'],
+        enabled=app.config['TRACING_ENABLED']
+    )
+    app.extensions['assistant'] = Assistant(app.config)
+    app.register_blueprint(bp)
+    
+    if preload:
+        app.extensions['assistant'].warm()
+    return app
+
+def __getattr__(name):
+    """Build the default app on first access, so `gunicorn app:app` keeps working"""
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
-    app.run(
+    create_app().run(
         host=os.getenv('FLASK_HOST', '0.0.0.0'),
         port=int(os.getenv('FLASK_PORT', 5000)),
         debug=os.getenv('FLASK_DEBUG', 'True') == 'True'
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,90 @@
+"""
+App Testing - Helpers for tests that run the app against temporary stores
+"""
+import os
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Config keys of every file or directory the app writes, with their name in the temporary directory
+STORE_PATHS = {
+    'RATE_LIMIT_DB': 'ratelimit.db',
+    'CONVERSATION_DB': 'conversations.db',
+    'IDEMPOTENCY_DB': 'idempotency.db',
+    'SCHEDULER_DB': 'scheduler.db',
+    'SHARED_CACHE_DB': 'cache.db',
+    'MEMORY_DIR': 'memory',
+    'PROFILE_DIR': 'profiles',
+    'TRACE_FILE': 'traces.jsonl'
+}
+
+
+def store_config(directory):
+    """Config overrides that place all of the app's stores in directory"""
+    return {key: os.path.join(directory, name) for key, name in STORE_PATHS.items()}
+
+
+@contextmanager
+def temporary_stores():
+    """
+    A temporary directory for the app's stores. It is removed afterwards and
+    the process-wide shared cache and tracer that create_app() configured are
+    restored.
+    """
+    import shared_cache
+    from tracing import tracer
+    directory = tempfile.mkdtemp()
+    previous_cache = shared_cache.shared_cache, shared_cache.shared_cache_configured
+    previous_tracer = tracer.exporter, tracer.enabled
+    try:
+        yield directory
+    finally:
+        shared_cache.shared_cache, shared_cache.shared_cache_configured = previous_cache
+        if tracer.exporter is not None:
+            tracer.exporter.flush()
+        tracer.exporter, tracer.enabled = previous_tracer
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def make_app(directory, **overrides):
+    """An app (OpenRouter, no memory or speculation unless overridden) with its stores in directory"""
+    import app
+    return app.create_app({
+        'OPENROUTER_API_KEY': 'test',
+        'MEMORY_ENABLED': False,
+        'SPECULATIVE_EXECUTION': False,
+        **store_config(directory),
+        **overrides
+    })
+
+
+class UpstreamResponse:
+    """Stand-in for the requests.Response of an upstream chat completion"""
+
+    def __init__(self, data, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.data = data
+        self.text = data if isinstance(data, str) else json.dumps(data)
+
+    def json(self):
+        return self.data
+
+
+def reply(content, finish_reason='stop'):
+    """Upstream response with a plain assistant message"""
+    return UpstreamResponse({
+        "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}]
+    })
+
+
+def native_tool_calls(*calls):
+    """Upstream response calling tools natively; calls are (name, arguments) pairs"""
+    return UpstreamResponse({"choices": [{
+        "message": {"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+            for i, (name, arguments) in enumerate(calls)
+        ]},
+        "finish_reason": "tool_calls"
+    }]})
@@ -0,0 +1,107 @@
+"""
+Benchmark of MemoryStore retrieval at hundreds of thousands of memories
+
+Fills a temporary store with synthetic memories (Zipf-distributed vocabulary,
+20-200 words each), then measures search latency for short and long queries
+and recall against an exact scan of every vector. Recall queries are built
+from the words of a stored memory, so each has one known relevant memory;
+"found" is the share of those that the search returns in its top k, for the
+sketch pre-filter and for the exact scan, and "same top k" is the share of
+the exact scan's top k that the pre-filtered search also returns.
+
+Usage:
+    python bench_memory_store.py
+    python bench_memory_store.py --memories 500000 --queries 200
+"""
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from memory_store import MemoryStore
+
+TARGET_MS = 5.0
+
+
+def make_text(rng, vocabulary, weights, words):
+    return ' '.join(rng.choices(vocabulary, weights, k=words))
+
+
+def fill(store, owner, count, rng, vocabulary, weights, batch=5000):
+    texts = []
+    start = time.perf_counter()
+    for done in range(0, count, batch):
+        chunk = [make_text(rng, vocabulary, weights, rng.randint(20, 200)) for _ in range(min(batch, count - done))]
+        store.add_many(owner, chunk)
+        texts.extend(chunk)
+        print(f"\r  {len(texts)}/{count} memories", end='', flush=True)
+    print(f" ({time.perf_counter() - start:.0f} s)")
+    return texts
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--memories', type=int, default=300000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    vocabulary = [f"w{i}" for i in range(20000)]
+    weights = [1 / (rank + 1) ** 1.05 for rank in range(len(vocabulary))]
+    directory = tempfile.mkdtemp()
+    try:
+        store = MemoryStore(directory, max_memories=args.memories + 1)
+        exact = MemoryStore(directory, max_memories=args.memories + 1, exact_rows=args.memories + 1)
+        print(f"Filling {args.memories} memories")
+        texts = fill(store, 'bench', args.memories, rng, vocabulary, weights)
+        assert store.count('bench') == args.memories
+
+        print(f"\n{'query':<22} {'p50':>8} {'p95':>8} {'exact p50':>10}")
+        for label, words in (('short (8 words)', 8), ('medium (30 words)', 30), ('long (150 words)', 150)):
+            queries = [make_text(rng, vocabulary, weights, words) for _ in range(args.queries)]
+            store.search('bench', queries[0])
+            timings, exact_timings = [], []
+            for query in queries:
+                start = time.perf_counter()
+                store.search('bench', query, top_k=args.top_k, min_score=0)
+                timings.append((time.perf_counter() - start) * 1000)
+            for query in queries[:10]:
+                start = time.perf_counter()
+                exact.search('bench', query, top_k=args.top_k, min_score=0)
+                exact_timings.append((time.perf_counter() - start) * 1000)
+            print(f"{label:<22} {percentile(timings, 0.5):>5.2f} ms {percentile(timings, 0.95):>5.2f} ms "
+                  f"{percentile(exact_timings, 0.5):>7.2f} ms")
+
+        print(f"\n{'recall query':<22} {'sketch found':>13} {'exact found':>12} {'same top k':>11}")
+        for label, share in (('half of the words', 0.5), ('a quarter of the words', 0.25)):
+            found = exact_found = same = 0
+            for _ in range(args.queries):
+                target = rng.randrange(len(texts))
+                words = texts[target].split()
+                query = ' '.join(rng.sample(words, max(3, int(len(words) * share))))
+                wanted = texts[target]
+                results = [m['text'] for m in store.search('bench', query, top_k=args.top_k, min_score=0)]
+                exact_results = [m['text'] for m in exact.search('bench', query, top_k=args.top_k, min_score=0)]
+                found += wanted in results
+                exact_found += wanted in exact_results
+                same += len(set(results) & set(exact_results)) / args.top_k
+            print(f"{label:<22} {found / args.queries:>13.0%} {exact_found / args.queries:>12.0%} "
+                  f"{same / args.queries:>11.0%}")
+
+        p50 = percentile(timings, 0.5)
+        print(f"\nLong-query p50 {p50:.2f} ms (target {TARGET_MS:.0f} ms)")
+        return 0 if p50 <= TARGET_MS else 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Benchmark of the cross-worker SharedCache against per-process caches
+
+Two measurements:
+  1. Operation latency in one process: an in-process LRU dict (the pattern
+     tools.py used for fetched pages) vs SharedCache get/set.
+  2. A simulated gunicorn deployment: several worker processes serve the same
+     skewed (Zipf) stream of tool calls, each call costing --compute-ms on a
+     miss (a web search or weather lookup). With per-process caches each worker
+     warms its own copy; with SharedCache a result computed by any worker is
+     a hit for all of them, and concurrent misses on one key compute it once.
+
+Usage:
+    python bench_shared_cache.py
+    python bench_shared_cache.py --workers 8 --requests 400 --keys 500 --compute-ms 50
+"""
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+from shared_cache import SharedCache
+
+
+class LocalCache:
+    """Per-process baseline: bounded LRU dict with TTL behind a lock"""
+
+    def __init__(self, max_entries=1024, default_ttl=3600):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                return default
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + (self.default_ttl if ttl is None else ttl))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute, ttl=None):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def size_bytes(self):
+        with self.lock:
+            return sum(len(json.dumps(value)) for value, _ in self.entries.values())
+
+
+def search_result(key):
+    """A value shaped like a web_search result (~2 KB of JSON)"""
+    rng = random.Random(key)
+    return {
+        'success': True,
+        'query': key,
+        'results': [
+            {'title': f"Result {i} for {key}", 'link': f"https://example.com/{key}/{i}",
+             'snippet': ' '.join(rng.choice(['data', 'model', 'agent', 'search', 'page']) for _ in range(50))}
+            for i in range(5)
+        ]
+    }
+
+
+def per_op(function, number=2000):
+    """Best-of-5 microseconds per call"""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def bench_latency(db_path):
+    local = LocalCache()
+    shared = SharedCache(db_path)
+    shared.clear()
+    value = search_result('latency')
+    page = {'title': 'Page', 'text': 'x' * 20000, 'truncated': False, 'etag': '"abc"', 'last_modified': None}
+    for cache in (local, shared):
+        cache.set('hit', value)
+        cache.set('page', page)
+    counter = iter(range(10 ** 9))
+    rows = [
+        ('get hit (2 KB)', lambda c: c.get('hit')),
+        ('get hit (20 KB page)', lambda c: c.get('page')),
+        ('get miss', lambda c: c.get('missing')),
+        ('set (2 KB)', lambda c: c.set(f"set-{next(counter)}", value)),
+    ]
+    print(f"{'operation':<24} {'per-process':>14} {'shared':>12}")
+    for name, op in rows:
+        print(f"{name:<24} {per_op(lambda: op(local)):>11.1f} us {per_op(lambda: op(shared)):>9.1f} us")
+    shared.clear()
+
+
+def zipf_keys(seed, count, keys, skew=1.1):
+    rng = random.Random(seed)
+    weights = [1.0 / (rank ** skew) for rank in range(1, keys + 1)]
+    return [f"query-{k}" for k in rng.choices(range(keys), weights=weights, k=count)]
+
+
+def worker(mode, db_path, seed, args, results):
+    cache = SharedCache(db_path) if mode == 'shared' else LocalCache()
+    computes = 0
+    latencies = []
+
+    def compute(key):
+        nonlocal computes
+        computes += 1
+        time.sleep(args.compute_ms / 1000)
+        return search_result(key)
+
+    for key in zipf_keys(seed, args.requests, args.keys):
+        start = time.perf_counter()
+        cache.get_or_compute(('tool', 'web_search', key), lambda: compute(key), ttl=600)
+        latencies.append(time.perf_counter() - start)
+    size = cache.size_bytes() if mode == 'local' else None
+    results.put({'computes': computes, 'latencies': latencies, 'bytes': size})
+
+
+def bench_workers(mode, db_path, args):
+    if mode == 'shared':
+        SharedCache(db_path).clear()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mode, db_path, seed, args, results))
+        for seed in range(args.workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(l for outcome in outcomes for l in outcome['latencies'])
+    computes = sum(outcome['computes'] for outcome in outcomes)
+    if mode == 'shared':
+        size = SharedCache(db_path).stats()['bytes']
+    else:
+        size = sum(outcome['bytes'] for outcome in outcomes)
+    return {
+        'requests': len(latencies),
+        'computes': computes,
+        'hit_rate': 1 - computes / len(latencies),
+        'seconds': elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'cached_kb': size / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='tool calls per worker')
+    parser.add_argument('--keys', type=int, default=300, help='distinct tool calls')
+    parser.add_argument('--compute-ms', type=float, default=20, help='cost of a miss')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'ai_assistant_cache_bench.db'))
+    args = parser.parse_args()
+
+    print("== Operation latency, one process\n")
+    bench_latency(args.db)
+
+    print(f"\n== {args.workers} workers x {args.requests} calls over {args.keys} keys, "
+          f"{args.compute_ms:.0f} ms per miss\n")
+    print(f"{'cache':<12} {'computes':>9} {'hit rate':>9} {'wall':>8} {'p50':>9} {'p99':>9} {'cached':>10}")
+    for mode in ('local', 'shared'):
+        r = bench_workers(mode, args.db, args)
+        label = 'per-process' if mode == 'local' else 'shared'
+        print(f"{label:<12} {r['computes']:>9} {r['hit_rate']:>9.1%} {r['seconds']:>7.2f}s "
+              f"{r['p50_ms']:>6.2f} ms {r['p99_ms']:>6.1f} ms {r['cached_kb']:>7.0f} KB")
+
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(args.db + suffix)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Conversation Store - Server-side conversation histories shared by all worker processes
+"""
+import json
+import time
+
+from sqlite_store import database_path, create_private, connect
+
+
+class ConversationStore:
+    """
+    Conversation histories in SQLite, keyed by client and conversation ID.
+
+    Messages are stored one row each so a turn only appends the messages it
+    added instead of rewriting the whole history. A turn interrupted by an
+    upstream failure leaves a checkpoint describing how far it got.
+    """
+
+    def __init__(self, db_path=None, ttl_seconds=7 * 24 * 3600):
+        self.db_path = db_path or database_path('ai_assistant_conversations.db')
+        self.ttl_seconds = ttl_seconds
+        # Histories are private
+        create_private(self.db_path)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "owner TEXT, id TEXT, updated REAL, PRIMARY KEY (owner, id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "owner TEXT, conversation_id TEXT, seq INTEGER, message TEXT, "
+                "PRIMARY KEY (owner, conversation_id, seq))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints ("
+                "owner TEXT, conversation_id TEXT, state TEXT, PRIMARY KEY (owner, conversation_id))"
+            )
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def load(self, owner, conversation_id):
+        """
+        Load a conversation's messages
+        Returns:
+            List of messages, or None if the conversation doesn't exist or expired
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT updated FROM conversations WHERE owner = ? AND id = ?",
+                (owner, conversation_id)
+            ).fetchone()
+            if row is None or row[0] < time.time() - self.ttl_seconds:
+                return None
+            rows = conn.execute(
+                "SELECT message FROM messages WHERE owner = ? AND conversation_id = ? ORDER BY seq",
+                (owner, conversation_id)
+            ).fetchall()
+            return [json.loads(message) for (message,) in rows]
+        finally:
+            conn.close()
+
+    def load_checkpoint(self, owner, conversation_id):
+        """
+        Load the checkpoint of the conversation's unfinished turn
+        Returns:
+            The state dict passed to save(), or None if the last turn finished
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT state FROM checkpoints WHERE owner = ? AND conversation_id = ?",
+                (owner, conversation_id)
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+        finally:
+            conn.close()
+
+    def save(self, owner, conversation_id, messages, start=0, checkpoint=None):
+        """
+        Persist a conversation
+        Args:
+            messages: The full message list
+            start: Number of leading messages already stored unchanged; only
+                messages[start:] are written
+            checkpoint: State of an unfinished turn, stored atomically with the
+                messages; None marks the last turn as finished
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (owner, id, updated) VALUES (?, ?, ?)",
+                (owner, conversation_id, now)
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE owner = ? AND conversation_id = ? AND seq >= ?",
+                (owner, conversation_id, start)
+            )
+            conn.executemany(
+                "INSERT INTO messages (owner, conversation_id, seq, message) VALUES (?, ?, ?, ?)",
+                [(owner, conversation_id, seq, json.dumps(message))
+                 for seq, message in enumerate(messages[start:], start)]
+            )
+            if checkpoint is None:
+                conn.execute(
+                    "DELETE FROM checkpoints WHERE owner = ? AND conversation_id = ?", (owner, conversation_id)
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints (owner, conversation_id, state) VALUES (?, ?, ?)",
+                    (owner, conversation_id, json.dumps(checkpoint))
+                )
+        conn.close()
+
+    def delete(self, owner, conversation_id):
+        """Delete a conversation and its messages"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE owner = ? AND conversation_id = ?", (owner, conversation_id))
+            conn.execute("DELETE FROM checkpoints WHERE owner = ? AND conversation_id = ?", (owner, conversation_id))
+            conn.execute("DELETE FROM conversations WHERE owner = ? AND id = ?", (owner, conversation_id))
+        conn.close()
+
+    def purge_expired(self):
+        """Delete conversations that haven't been used within the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM messages WHERE (owner, conversation_id) IN "
+                "(SELECT owner, id FROM conversations WHERE updated < ?)",
+                (cutoff,)
+            )
+            conn.execute(
+                "DELETE FROM checkpoints WHERE (owner, conversation_id) IN "
+                "(SELECT owner, id FROM conversations WHERE updated < ?)",
+                (cutoff,)
+            )
+            conn.execute("DELETE FROM conversations WHERE updated < ?", (cutoff,))
+        conn.close()
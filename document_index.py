@@ -0,0 +1,208 @@
+"""
+Document Index - On-disk BM25 inverted index over workspace files
+"""
+import os
+import re
+import math
+import time
+import hashlib
+import threading
+from collections import Counter
+
+from sqlite_store import database_path, create_private, connect
+
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.rst', '.csv', '.json', '.yaml', '.yml', '.toml', '.ini', '.cfg',
+    '.html', '.css', '.xml', '.py', '.js', '.ts', '.java', '.c', '.cpp', '.h', '.go',
+    '.rs', '.rb', '.php', '.sh', '.sql'
+}
+DOCX_EXTENSION = '.docx'
+SKIP_DIRS = {'.git', '__pycache__', 'node_modules', 'venv', '.venv', '.tox', '.mypy_cache', '.pytest_cache'}
+
+MAX_FILE_SIZE = 2 * 1024 * 1024
+PASSAGE_LINES = 15
+REFRESH_INTERVAL = 5.0
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9_]{2,}')
+
+
+def tokenize(text):
+    """Lowercase word tokens used for both indexing and queries"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def read_lines(path):
+    """
+    Read a document as a list of lines
+    .docx paragraphs become lines; returns None for unsupported files
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == DOCX_EXTENSION:
+        try:
+            import docx
+        except ImportError:
+            return None
+        return [paragraph.text for paragraph in docx.Document(path).paragraphs]
+    if extension in TEXT_EXTENSIONS:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read().splitlines()
+    return None
+
+
+class DocumentIndex:
+    """
+    BM25 search over fixed-size line passages of every supported file under root.
+
+    Files are re-indexed only when their mtime or size changes, so a refresh
+    after the first build costs one stat per file.
+    """
+
+    def __init__(self, root='.', db_path=None):
+        self.root = os.path.abspath(root)
+        if not db_path:
+            root_hash = hashlib.sha1(self.root.encode()).hexdigest()[:12]
+            db_path = database_path(f'ai_assistant_docindex_{root_hash}.db')
+        self.db_path = db_path
+        self.last_refresh = 0.0
+        self.refresh_lock = threading.Lock()
+        # Passages are copied from workspace files
+        create_private(self.db_path)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS passages ("
+                "id INTEGER PRIMARY KEY, path TEXT, start_line INTEGER, end_line INTEGER, "
+                "length INTEGER, text TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS passages_path ON passages (path)")
+            conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT, passage_id INTEGER, tf INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_term ON postings (term)")
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_passage ON postings (passage_id)")
+        conn.close()
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def scan(self):
+        """Yield (relative path, mtime, size) for every indexable file under root"""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith('.')]
+            for filename in filenames:
+                extension = os.path.splitext(filename)[1].lower()
+                if extension not in TEXT_EXTENSIONS and extension != DOCX_EXTENSION:
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                if stat.st_size <= MAX_FILE_SIZE:
+                    yield os.path.relpath(full_path, self.root), stat.st_mtime, stat.st_size
+
+    def refresh(self, force=False):
+        """
+        Bring the index up to date with the files on disk
+        Returns:
+            Number of files (re)indexed or removed
+        """
+        if not force and time.time() - self.last_refresh < REFRESH_INTERVAL:
+            return 0
+        with self.refresh_lock:
+            conn = self._connect()
+            try:
+                indexed = {path: (mtime, size) for path, mtime, size in conn.execute("SELECT path, mtime, size FROM files")}
+                changed = 0
+                seen = set()
+                for path, mtime, size in self.scan():
+                    seen.add(path)
+                    if indexed.get(path) != (mtime, size):
+                        with conn:
+                            self._remove_file(conn, path)
+                            self._index_file(conn, path, mtime, size)
+                        changed += 1
+                for path in set(indexed) - seen:
+                    with conn:
+                        self._remove_file(conn, path)
+                    changed += 1
+                self.last_refresh = time.time()
+                return changed
+            finally:
+                conn.close()
+
+    def _remove_file(self, conn, path):
+        conn.execute(
+            "DELETE FROM postings WHERE passage_id IN (SELECT id FROM passages WHERE path = ?)", (path,)
+        )
+        conn.execute("DELETE FROM passages WHERE path = ?", (path,))
+        conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _index_file(self, conn, path, mtime, size):
+        try:
+            lines = read_lines(os.path.join(self.root, path))
+        except Exception as e:
+            print(f"Could not index {path}: {e}")
+            lines = None
+        conn.execute("INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, mtime, size))
+        for start in range(0, len(lines or []), PASSAGE_LINES):
+            text = '\n'.join(lines[start:start + PASSAGE_LINES])
+            terms = Counter(tokenize(text))
+            if not terms:
+                continue
+            cursor = conn.execute(
+                "INSERT INTO passages (path, start_line, end_line, length, text) VALUES (?, ?, ?, ?, ?)",
+                (path, start + 1, min(start + PASSAGE_LINES, len(lines)), sum(terms.values()), text)
+            )
+            conn.executemany(
+                "INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?)",
+                [(term, cursor.lastrowid, tf) for term, tf in terms.items()]
+            )
+
+    def search(self, query, max_results=5):
+        """
+        Rank passages against a query with BM25
+        Returns:
+            List of {'path', 'start_line', 'end_line', 'score', 'text'} dicts, best first
+        """
+        self.refresh()
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        conn = self._connect()
+        try:
+            total, total_length = conn.execute("SELECT COUNT(*), SUM(length) FROM passages").fetchone()
+            if not total:
+                return []
+            avg_length = total_length / total
+
+            scores = Counter()
+            for term in terms:
+                postings = conn.execute(
+                    "SELECT p.passage_id, p.tf, s.length FROM postings p JOIN passages s ON s.id = p.passage_id "
+                    "WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, tf, length in postings:
+                    scores[passage_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+
+            results = []
+            for passage_id, score in scores.most_common(max_results):
+                path, start_line, end_line, text = conn.execute(
+                    "SELECT path, start_line, end_line, text FROM passages WHERE id = ?", (passage_id,)
+                ).fetchone()
+                results.append({
+                    'path': path,
+                    'start_line': start_line,
+                    'end_line': end_line,
+                    'score': round(score, 3),
+                    'text': text
+                })
+            return results
+        finally:
+            conn.close()
@@ -0,0 +1,120 @@
+"""
+Generation Policy - Per-iteration token budgets and stop sequences learned from observed replies
+"""
+import threading
+from collections import deque
+
+TOOL = 'tool'
+PLAN = 'plan'
+ANSWER = 'answer'
+
+
+class GenerationPolicy:
+    """
+    Chooses max_tokens, temperature and stop sequences for each upstream call.
+
+    Calls are grouped by intent (the tools detect_intent suggested for the
+    user's message) and phase: 'tool' when the reply is expected to be a tool
+    call, 'plan' for plan-mode planning and 'answer' for everything else.
+    Budgets start from conservative defaults and, once enough replies of a
+    group have been seen, become the group's p95 reply length plus a margin.
+    Replies that still hit the budget are continued by the caller, so a low
+    budget costs an extra call, never a truncated answer.
+    """
+
+    def __init__(self, defaults=None, min_tokens=64, max_tokens=4000, margin=1.25,
+                 window=200, min_samples=20, stop_sequences=None):
+        self.defaults = defaults or {TOOL: 256, PLAN: 600, ANSWER: 1000}
+        self.temperatures = {TOOL: 0.2, PLAN: 0.2, ANSWER: 0.7}
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.margin = margin
+        self.window = window
+        self.min_samples = min_samples
+        self.stop_sequences = stop_sequences or []
+        self.lengths = {}
+        # First-iteration outcomes per intent: [tool calls, direct answers]
+        self.outcomes = {}
+        self.lock = threading.Lock()
+
+    def intent_key(self, suggestions):
+        """Group key for a list of suggested tools"""
+        return '+'.join(sorted(suggestions)) or 'chat'
+
+    def predict_phase(self, intent, tool_calls_made):
+        """
+        Guess whether the next reply will be a tool call
+        Only the first iteration of a message with suggested tools is
+        expected to call a tool, unless that intent usually gets direct answers.
+        """
+        if tool_calls_made or intent == 'chat':
+            return ANSWER
+        with self.lock:
+            tool_calls, answers = self.outcomes.get(intent, (0, 0))
+        if tool_calls + answers >= self.min_samples and answers > tool_calls:
+            return ANSWER
+        return TOOL
+
+    def budget(self, intent, phase):
+        """max_tokens for a call: learned p95 length plus margin, or the phase default"""
+        with self.lock:
+            lengths = sorted(self.lengths.get((intent, phase), ()))
+        if len(lengths) < self.min_samples:
+            return self.defaults[phase]
+        p95 = lengths[int(len(lengths) * 0.95)]
+        return int(min(self.max_tokens, max(self.min_tokens, p95 * self.margin)))
+
+    def settings(self, intent, phase, text_protocol=True):
+        """
+        Generation settings for one call
+        Returns:
+            {'max_tokens', 'temperature', 'stop'}; stop sequences only apply to
+            the text tool protocol
+        """
+        return {
+            'max_tokens': self.budget(intent, phase),
+            'temperature': self.temperatures[phase],
+            'stop': list(self.stop_sequences) if text_protocol else None
+        }
+
+    def continuation_settings(self, intent, text_protocol=True):
+        """Settings for continuing a reply that hit its budget"""
+        settings = self.settings(intent, ANSWER, text_protocol)
+        settings['max_tokens'] = max(settings['max_tokens'], self.defaults[ANSWER])
+        return settings
+
+    def record(self, intent, phase, tokens, first_iteration=False):
+        """Record the length of a complete reply (including continuations)"""
+        with self.lock:
+            lengths = self.lengths.get((intent, phase))
+            if lengths is None:
+                lengths = self.lengths[(intent, phase)] = deque(maxlen=self.window)
+            lengths.append(tokens)
+            if first_iteration and phase != PLAN:
+                outcome = self.outcomes.setdefault(intent, [0, 0])
+                outcome[0 if phase == TOOL else 1] += 1
+
+    def stats(self):
+        """Learned budgets per intent and phase"""
+        with self.lock:
+            groups = {key: sorted(lengths) for key, lengths in self.lengths.items()}
+            outcomes = {intent: list(counts) for intent, counts in self.outcomes.items()}
+        return {
+            'budgets': {
+                f"{intent}/{phase}": {
+                    'samples': len(lengths),
+                    'p50': lengths[len(lengths) // 2],
+                    'max_tokens': self.budget(intent, phase)
+                }
+                for (intent, phase), lengths in groups.items()
+            },
+            'first_iteration_outcomes': {
+                intent: {'tool_calls': counts[0], 'answers': counts[1]}
+                for intent, counts in outcomes.items()
+            }
+        }
+
+
+def estimate_tokens(text):
+    """Rough token count when the upstream doesn't report usage"""
+    return len(text) // 4 + 1
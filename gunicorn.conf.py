@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration - run with: gunicorn -c gunicorn.conf.py
+
+The app is built once in the master with every lazy backend loaded, then
+forked, so workers start instantly and share those pages copy-on-write.
+"""
+import gc
+import os
+
+wsgi_app = 'app:create_app(preload=True)'
+preload_app = True
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', 5000)}"
+workers = int(os.getenv('GUNICORN_WORKERS', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Agent turns can chain several upstream calls
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 300))
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach, so
+    # collections in the workers don't write to (and un-share) those pages
+    gc.freeze()
@@ -0,0 +1,127 @@
+"""
+Idempotency Store - Deduplicates retried and concurrent requests by Idempotency-Key
+"""
+import time
+
+from sqlite_store import database_path, create_private, connect, Wakeups
+
+NEW = 'new'
+DONE = 'done'
+PENDING = 'pending'
+CONFLICT = 'conflict'
+
+
+class IdempotencyStore:
+    """
+    Tracks requests by idempotency key in SQLite so every worker process sees them.
+
+    The first request with a key claims it and runs; duplicates arriving while it
+    runs wait for its result, and retries after it finished get the stored reply.
+    Completed results are evicted after ttl_seconds or when more than
+    max_entries are stored.
+    """
+
+    def __init__(self, db_path=None, ttl_seconds=24 * 3600, max_entries=10000,
+                 wait_timeout=300, poll_interval=0.25):
+        self.db_path = db_path or database_path('ai_assistant_idempotency.db')
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.wakeups = Wakeups(poll_interval)
+        # Stored replies can contain file contents and code output
+        create_private(self.db_path)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS requests ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, state TEXT, status INTEGER, body TEXT, created REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS requests_created ON requests (created)")
+        conn.close()
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def begin(self, key, fingerprint):
+        """
+        Claim a key or look up its state
+        Returns:
+            (NEW, None) if the caller should run the request,
+            (DONE, (status, body)) if a result is stored,
+            (PENDING, None) if another request with this key is running,
+            (CONFLICT, None) if the key was used for a different request body
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                # A pending claim older than wait_timeout belongs to a crashed worker
+                conn.execute(
+                    "DELETE FROM requests WHERE key = ? AND state = ? AND created < ?",
+                    (key, PENDING, now - self.wait_timeout)
+                )
+                conn.execute(
+                    "DELETE FROM requests WHERE key = ? AND created < ?", (key, now - self.ttl_seconds)
+                )
+                claimed = conn.execute(
+                    "INSERT OR IGNORE INTO requests (key, fingerprint, state, created) VALUES (?, ?, ?, ?)",
+                    (key, fingerprint, PENDING, now)
+                ).rowcount
+            if claimed:
+                return NEW, None
+            row = conn.execute(
+                "SELECT fingerprint, state, status, body FROM requests WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return self.begin(key, fingerprint)
+        stored_fingerprint, state, status, body = row
+        if stored_fingerprint != fingerprint:
+            return CONFLICT, None
+        if state == DONE:
+            return DONE, (status, body)
+        return PENDING, None
+
+    def wait(self, key, fingerprint):
+        """
+        Wait for the request holding key to finish
+        Returns:
+            begin()'s result once the key is no longer pending (NEW if the
+            original request failed and the caller should run it instead)
+        """
+        def finished():
+            state, result = self.begin(key, fingerprint)
+            return None if state == PENDING else (state, result)
+        return self.wakeups.wait_for(finished, key, self.wait_timeout) or (PENDING, None)
+
+    def complete(self, key, status, body):
+        """Store the result for key and wake any waiting duplicates"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE requests SET state = ?, status = ?, body = ? WHERE key = ?",
+                    (DONE, status, body, key)
+                )
+                conn.execute(
+                    "DELETE FROM requests WHERE state = ? AND created < ?", (DONE, time.time() - self.ttl_seconds)
+                )
+                conn.execute(
+                    "DELETE FROM requests WHERE state = ? AND key IN ("
+                    "SELECT key FROM requests WHERE state = ? ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                    (DONE, DONE, self.max_entries)
+                )
+        finally:
+            conn.close()
+        self.wakeups.notify(key)
+
+    def abandon(self, key):
+        """Drop a claim without storing a result so the request can be retried"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM requests WHERE key = ? AND state = ?", (key, PENDING))
+        finally:
+            conn.close()
+        self.wakeups.notify(key)
@@ -0,0 +1,359 @@
+"""
+Memory Store - Long-term conversation memory with vectorized similarity retrieval
+"""
+import os
+import re
+import json
+import math
+import time
+import zlib
+import fcntl
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]{2,}')
+SEGMENT_PATTERN = re.compile(r'seg-(\d{6})$')
+SKETCH_BITS = 512
+SKETCH_WORDS = SKETCH_BITS // 64
+
+
+def popcount(words):
+    """Number of set bits in each element of a uint64 array, as uint8"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # NumPy < 2.0: SWAR bit counting
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = (words & np.uint64(0x3333333333333333)) + ((words >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((words * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.uint8)
+
+
+def closest(distance, count, stride=16):
+    """Sorted indices of the `count` smallest distances: everything under the cutoff, then ties"""
+    if len(distance) >= count * stride:
+        # A cutoff estimated from every stride-th distance (with headroom) keeps a
+        # superset cheaply; the exact selection then runs on that superset only
+        sample = np.cumsum(np.bincount(distance[::stride], minlength=SKETCH_BITS + 1))
+        chosen = np.flatnonzero(distance <= int(np.searchsorted(sample, count * 1.25 / stride)))
+        if len(chosen) >= count:
+            return chosen[closest(distance[chosen], count, stride)]
+    cutoff = int(np.searchsorted(np.cumsum(np.bincount(distance, minlength=SKETCH_BITS + 1)), count))
+    chosen = np.flatnonzero(distance <= cutoff)
+    if len(chosen) > count:
+        ties = np.flatnonzero(distance[chosen] == cutoff)
+        chosen = np.delete(chosen, ties[len(ties) - (len(chosen) - count):])
+    return chosen
+
+
+class MemoryStore:
+    """
+    Past turns and tool results stored as hashed-feature vectors. Each client's
+    memories are split into segments of up to segment_size rows, one directory
+    of append-only files each:
+
+        vectors.f32   - float32 matrix, one L2-normalized row per memory
+        sketches.u64  - 512-bit sign sketch of each row, stored word-major
+                        (all rows' first words, then all second words, ...)
+        texts.jsonl   - memory text and metadata, one JSON record per line
+        offsets.u64   - byte offset of each record in texts.jsonl
+
+    Retrieval ranks rows by the Hamming distance between their sketch and the
+    query's (random-hyperplane sketches approximate cosine similarity): the
+    first half of every sketch (32 bytes per memory instead of dim * 4) keeps
+    the closest coarse_candidates rows, the full sketch narrows those to
+    `candidates`, and only these are scored exactly against the memory-mapped
+    vectors. Clients with at most exact_rows memories are scored exactly.
+
+    Growth is bounded: a client's oldest segment is dropped once it holds more
+    than max_memories, and purge_expired() removes clients with no new
+    memories for ttl_days. Directories are created readable by this user only.
+    """
+
+    def __init__(self, directory=None, dim=256, segment_size=65536, max_memories=200000,
+                 ttl_days=180, coarse_candidates=16384, candidates=2048, exact_rows=8192):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ai_assistant_memory')
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.segment_size = segment_size
+        self.max_memories = max_memories
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.coarse_candidates = coarse_candidates
+        self.candidates = candidates
+        self.exact_rows = exact_rows
+        self.hyperplanes = self._hyperplanes()
+        self.segments = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        try:
+            os.chmod(self.directory, 0o700)
+        except OSError:
+            pass
+
+    def _hyperplanes(self):
+        """
+        Random +/-1 hyperplanes for the sketches, derived from SHA-256 so every
+        process (and NumPy version) computes the same ones
+        """
+        seeds = b''.join(
+            hashlib.sha256(f"sketch:{i}:{j}".encode()).digest()
+            for i in range(self.dim) for j in range(SKETCH_BITS // 256)
+        )
+        bits = np.unpackbits(np.frombuffer(seeds, dtype=np.uint8)).reshape(self.dim, SKETCH_BITS)
+        return np.where(bits, 1.0, -1.0).astype(np.float32)
+
+    def sketch(self, vectors):
+        """SKETCH_BITS-bit sign sketches of a (rows, dim) matrix, as (rows, SKETCH_WORDS) uint64"""
+        bits = np.packbits((vectors @ self.hyperplanes) > 0, axis=-1)
+        return np.ascontiguousarray(bits).view(np.uint64)
+
+    def _owner_dir(self, owner):
+        safe_owner = re.sub(r'[^A-Za-z0-9_-]', '_', owner)[:64]
+        return os.path.join(self.directory, safe_owner)
+
+    def vectorize(self, text):
+        """
+        Hash unigrams and bigrams into a signed, L2-normalized feature vector
+        crc32 is used instead of hash() so vectors match across processes.
+        """
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+        for feature, count in features.items():
+            h = zlib.crc32(feature.encode())
+            sign = 1.0 if h & 0x80000000 else -1.0
+            vector[h % self.dim] += sign * (1.0 + math.log(count))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _segment_paths(self, owner_dir):
+        """Segment directories of a client, oldest first"""
+        try:
+            names = os.listdir(owner_dir)
+        except OSError:
+            return []
+        return [os.path.join(owner_dir, name) for name in sorted(names) if SEGMENT_PATTERN.match(name)]
+
+    def _rows(self, segment):
+        try:
+            return os.path.getsize(os.path.join(segment, 'vectors.f32')) // self.row_bytes
+        except OSError:
+            return 0
+
+    def _create_segment(self, owner_dir, index, capacity):
+        segment = os.path.join(owner_dir, f"seg-{index:06d}")
+        os.makedirs(segment, mode=0o700, exist_ok=True)
+        with open(os.path.join(segment, 'sketches.u64'), 'ab') as f:
+            f.truncate(capacity * SKETCH_WORDS * 8)
+        return segment
+
+    def _write_sketches(self, segment, start, sketches):
+        path = os.path.join(segment, 'sketches.u64')
+        capacity = os.path.getsize(path) // (SKETCH_WORDS * 8)
+        with open(path, 'r+b') as f:
+            for word in range(SKETCH_WORDS):
+                f.seek((word * capacity + start) * 8)
+                f.write(np.ascontiguousarray(sketches[:, word]).tobytes())
+
+    def add(self, owner, text, metadata=None):
+        """Append one memory for owner"""
+        self.add_many(owner, [text], metadata)
+
+    def add_many(self, owner, texts, metadata=None):
+        """Append several memories for owner, sharing one metadata dict"""
+        owner_dir = self._owner_dir(owner)
+        os.makedirs(owner_dir, mode=0o700, exist_ok=True)
+        vectors = np.stack([self.vectorize(text) for text in texts])
+        sketches = self.sketch(vectors)
+        records = [(json.dumps({'text': text, **(metadata or {})}) + '\n').encode('utf-8') for text in texts]
+
+        lock_path = os.path.join(owner_dir, 'lock')
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # The lock file's mtime marks the client's last activity for purge_expired()
+            os.utime(lock_path)
+            segments = self._segment_paths(owner_dir)
+            done = 0
+            while done < len(texts):
+                if segments and self._rows(segments[-1]) < self.segment_size:
+                    segment = segments[-1]
+                else:
+                    index = int(SEGMENT_PATTERN.match(os.path.basename(segments[-1])).group(1)) + 1 if segments else 0
+                    segment = self._create_segment(owner_dir, index, self.segment_size)
+                    segments.append(segment)
+                start = self._rows(segment)
+                batch = slice(done, done + min(len(texts) - done, max(1, self.segment_size - start)))
+                # Vectors are written last: a row is visible to readers once its vector is
+                with open(os.path.join(segment, 'texts.jsonl'), 'ab') as f:
+                    offset = f.tell()
+                    offsets = []
+                    for record in records[batch]:
+                        offsets.append(offset)
+                        offset += len(record)
+                    f.write(b''.join(records[batch]))
+                with open(os.path.join(segment, 'offsets.u64'), 'ab') as f:
+                    f.write(np.array(offsets, dtype=np.uint64).tobytes())
+                self._write_sketches(segment, start, sketches[batch])
+                with open(os.path.join(segment, 'vectors.f32'), 'ab') as f:
+                    f.write(vectors[batch].tobytes())
+                done = batch.stop
+            # Retention: drop whole segments, oldest first
+            total = sum(self._rows(segment) for segment in segments)
+            while len(segments) > 1 and total > self.max_memories:
+                total -= self._rows(segments[0])
+                shutil.rmtree(segments.pop(0), ignore_errors=True)
+
+    def _open_segments(self, owner):
+        """
+        Memory-mapped segments of owner
+        Returns:
+            List of (path, vectors, sketch words); vectors are remapped when a segment grows
+        """
+        owner_dir = self._owner_dir(owner)
+        paths = self._segment_paths(owner_dir)
+        opened = []
+        with self.lock:
+            for stale in [path for path in self.segments if path.startswith(owner_dir + os.sep) and path not in paths]:
+                del self.segments[stale]
+            for path in paths:
+                rows = self._rows(path)
+                cached = self.segments.get(path)
+                if rows == 0:
+                    continue
+                try:
+                    if cached is None or cached[1].shape[0] != rows:
+                        sketch_path = os.path.join(path, 'sketches.u64')
+                        capacity = os.path.getsize(sketch_path) // (SKETCH_WORDS * 8)
+                        words = cached[2] if cached else np.memmap(
+                            sketch_path, dtype=np.uint64, mode='r', shape=(SKETCH_WORDS, capacity)
+                        )
+                        vectors = np.memmap(
+                            os.path.join(path, 'vectors.f32'), dtype=np.float32, mode='r', shape=(rows, self.dim)
+                        )
+                        cached = self.segments[path] = (path, vectors, words)
+                except OSError:
+                    # Dropped by retention in another process
+                    continue
+                opened.append(cached)
+        return opened
+
+    def _read_record(self, path, row):
+        offsets = np.memmap(os.path.join(path, 'offsets.u64'), dtype=np.uint64, mode='r')
+        with open(os.path.join(path, 'texts.jsonl'), 'rb') as f:
+            f.seek(int(offsets[row]))
+            return json.loads(f.readline())
+
+    def _candidates(self, segments, query_vector, limit):
+        """
+        Best (score, segment index, row) by exact score, from sketch-ranked candidates
+        when there are more than exact_rows memories
+        """
+        total = sum(vectors.shape[0] for _, vectors, _ in segments)
+        if total <= self.exact_rows:
+            scored = [(vectors @ query_vector, index, np.arange(vectors.shape[0]))
+                      for index, (_, vectors, _) in enumerate(segments)]
+        else:
+            query_words = self.sketch(query_vector[None, :])[0]
+            half = SKETCH_WORDS // 2
+            # Coarse pass over every row with the first half of the sketch...
+            distances = []
+            for _, vectors, words in segments:
+                rows = vectors.shape[0]
+                # uint8 wraps only for a half opposite to the query, which the exact score then rejects
+                distance = popcount(words[0, :rows] ^ query_words[0])
+                for word in range(1, half):
+                    distance += popcount(words[word, :rows] ^ query_words[word])
+                distances.append(distance)
+            distance = np.concatenate(distances)
+            coarse = closest(distance, self.coarse_candidates)
+            # ...then the full sketch for the rows it kept
+            distance = distance[coarse].astype(np.uint16)
+            starts = np.cumsum([0] + [vectors.shape[0] for _, vectors, _ in segments])
+            bounds = np.searchsorted(coarse, starts)
+            for index, (_, _, words) in enumerate(segments):
+                span = slice(bounds[index], bounds[index + 1])
+                rows = coarse[span] - starts[index]
+                for word in range(half, SKETCH_WORDS):
+                    distance[span] += popcount(words[word, rows] ^ query_words[word])
+            chosen = coarse[closest(distance, self.candidates)]
+            bounds = np.searchsorted(chosen, starts)
+            scored = []
+            for index, (_, vectors, _) in enumerate(segments):
+                rows = chosen[bounds[index]:bounds[index + 1]] - starts[index]
+                if len(rows):
+                    scored.append((vectors[rows] @ query_vector, index, rows))
+
+        best = []
+        for scores, index, rows in scored:
+            k = min(len(scores), limit)
+            top = np.argpartition(scores, -k)[-k:]
+            best.extend((float(scores[i]), index, int(rows[i])) for i in top)
+        best.sort(reverse=True)
+        return best[:limit]
+
+    def search(self, owner, query, top_k=4, min_score=0.15, exclude=None):
+        """
+        Find owner's memories most similar to query
+        Args:
+            exclude: Optional predicate on a memory record; matching memories are skipped
+        Returns:
+            List of memory records (with 'score'), best first
+        """
+        segments = self._open_segments(owner)
+        if not segments:
+            return []
+        query_vector = self.vectorize(query)
+        if not query_vector.any():
+            return []
+
+        # Over-fetch so excluded memories don't leave the result short
+        results = []
+        for score, index, row in self._candidates(segments, query_vector, top_k * 3):
+            if score < min_score:
+                break
+            try:
+                record = self._read_record(segments[index][0], row)
+            except OSError:
+                continue
+            if exclude and exclude(record):
+                continue
+            record['score'] = round(score, 3)
+            results.append(record)
+            if len(results) == top_k:
+                break
+        return results
+
+    def count(self, owner):
+        """Number of memories stored for owner"""
+        return sum(vectors.shape[0] for _, vectors, _ in self._open_segments(owner))
+
+    def purge_expired(self):
+        """
+        Remove clients that haven't stored a memory for ttl_days
+        Returns:
+            Number of clients removed
+        """
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.directory):
+            owner_dir = os.path.join(self.directory, name)
+            lock_path = os.path.join(owner_dir, 'lock')
+            try:
+                if os.path.getmtime(lock_path) >= cutoff:
+                    continue
+                with open(lock_path, 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    if os.path.getmtime(lock_path) >= cutoff:
+                        continue
+                    shutil.rmtree(owner_dir, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
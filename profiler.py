@@ -0,0 +1,161 @@
+"""
+Request Profiler - Opt-in sampling profiles of individual requests
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import tempfile
+import threading
+from collections import Counter
+
+
+def frame_name(frame):
+    """Flamegraph frame label: function name plus where it is defined"""
+    code = frame.f_code
+    directory, filename = os.path.split(code.co_filename)
+    return f"{code.co_name} ({os.path.basename(directory)}/{filename}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """Root-first, semicolon-joined stack for the collapsed-stack format"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfileSession:
+    """
+    Samples one thread's stack from a background thread.
+
+    Every sample goes into the wall-clock profile; samples taken while the
+    thread's CPU clock advanced also go into the CPU profile, so time spent
+    waiting on upstream calls shows up only in the wall-clock one.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.target = threading.get_ident()
+        try:
+            self.cpu_clock = time.pthread_getcpuclockid(self.target)
+        except (AttributeError, OSError):
+            self.cpu_clock = None
+        self.wall_samples = Counter()
+        self.cpu_samples = Counter()
+        self.stopped = threading.Event()
+        self.started = time.time()
+        self.cpu_start = self._cpu_time()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def _cpu_time(self):
+        return time.clock_gettime(self.cpu_clock) if self.cpu_clock is not None else 0.0
+
+    def _sample(self):
+        last_cpu = self._cpu_time()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            if frame is None:
+                continue
+            stack = collapse_stack(frame)
+            self.wall_samples[stack] += 1
+            cpu = self._cpu_time()
+            if self.cpu_clock is not None and cpu - last_cpu >= self.interval / 2:
+                self.cpu_samples[stack] += 1
+            last_cpu = cpu
+
+    def stop(self):
+        """Stop sampling; returns (wall seconds, cpu seconds)"""
+        self.stopped.set()
+        self.thread.join()
+        return time.time() - self.started, self._cpu_time() - self.cpu_start
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and writes their profiles to a directory
+    as collapsed stacks (<id>.wall.folded, <id>.cpu.folded), which flamegraph.pl
+    and speedscope both import, plus <id>.json metadata.
+
+    Disabled unless an admin token or a sampling rate is configured; when
+    disabled, the per-request cost is a single attribute check.
+    """
+
+    def __init__(self, directory=None, admin_token=None, sample_rate=0.0, interval=0.005, max_profiles=200):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ai_assistant_profiles')
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self.enabled = bool(admin_token) or sample_rate > 0
+
+    def is_admin(self, headers):
+        """Check the X-Admin-Token header against the configured admin token"""
+        return bool(self.admin_token) and headers.get('X-Admin-Token') == self.admin_token
+
+    def should_profile(self, headers):
+        """Profile when an admin asks with X-Profile, or when sampled"""
+        if headers.get('X-Profile') and self.is_admin(headers):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """Start profiling the calling thread"""
+        return ProfileSession(self.interval)
+
+    def finish(self, session, metadata):
+        """
+        Stop a session and write its profile files
+        Returns:
+            The profile ID
+        """
+        wall_seconds, cpu_seconds = session.stop()
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.directory, exist_ok=True)
+
+        for kind, samples in (('wall', session.wall_samples), ('cpu', session.cpu_samples)):
+            with open(os.path.join(self.directory, f"{profile_id}.{kind}.folded"), 'w') as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        with open(os.path.join(self.directory, f"{profile_id}.json"), 'w') as f:
+            json.dump({
+                'id': profile_id,
+                'started': session.started,
+                'wall_seconds': round(wall_seconds, 4),
+                'cpu_seconds': round(cpu_seconds, 4),
+                'samples': sum(session.wall_samples.values()),
+                'interval': self.interval,
+                **metadata
+            }, f)
+
+        self.prune()
+        return profile_id
+
+    def list_profiles(self):
+        """Metadata of stored profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return profiles
+
+    def prune(self):
+        """Delete the oldest profiles beyond max_profiles"""
+        names = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in names[:-self.max_profiles]:
+            for suffix in ('.json', '.wall.folded', '.cpu.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except OSError:
+                    pass
@@ -0,0 +1,184 @@
+"""
+Upstream Rate Limiter - Token bucket governor shared by all worker processes
+"""
+import time
+from email.utils import parsedate_to_datetime
+
+from sqlite_store import database_path, create_private, connect
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot be admitted within the queue budget"""
+
+    def __init__(self, message, retry_after, status_code=503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value
+    Args:
+        value: Header value, either delay-seconds or an HTTP-date
+    Returns:
+        Delay in seconds, or None if the value can't be parsed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_reset_time(value):
+    """
+    Parse an X-RateLimit-Reset header value into an absolute epoch time
+    OpenRouter sends epoch milliseconds, other providers send epoch seconds
+    or seconds-until-reset.
+    """
+    if not value:
+        return None
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > 1e12:
+        return reset / 1000.0
+    if reset > 1e9:
+        return reset
+    return time.time() + reset
+
+
+class RateLimitGovernor:
+    """
+    Token bucket per upstream model, stored in SQLite so every gunicorn
+    worker on the host draws from the same bucket.
+
+    Requests that find the bucket empty reserve a future slot (the balance
+    goes negative) and sleep until it arrives, which queues them in arrival
+    order. A request whose slot is further away than max_wait is shed instead.
+    """
+
+    def __init__(self, db_path=None, rate_per_minute=20, burst=None, max_wait=15.0):
+        self.db_path = db_path or database_path('ai_assistant_ratelimit.db')
+        self.rate = rate_per_minute / 60.0
+        self.burst = float(burst or max(1, rate_per_minute // 4))
+        self.max_wait = max_wait
+        create_private(self.db_path)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL, updated REAL, blocked_until REAL)"
+            )
+
+    def _connect(self):
+        return connect(self.db_path, autocommit=True)
+
+    def _load(self, conn, key, now):
+        """
+        Current balance of key's bucket
+        Returns:
+            (tokens, refill_from, blocked_until); refill_from is in the future
+            while a block is in effect, since tokens only accrue after it ends
+        """
+        row = conn.execute(
+            "SELECT tokens, updated, blocked_until FROM buckets WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return self.burst, now, 0.0
+        tokens, updated, blocked_until = row
+        if now > updated:
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            updated = now
+        return tokens, updated, blocked_until
+
+    def _store(self, conn, key, tokens, updated, blocked_until):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (key, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+            (key, tokens, updated, blocked_until)
+        )
+
+    def reserve(self, key):
+        """
+        Reserve the next slot for key
+        Returns:
+            Seconds the caller must wait before sending
+        Raises:
+            RateLimitExceeded if the wait would exceed max_wait
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            tokens, refill_from, blocked_until = self._load(conn, key, now)
+            wait = max(0.0, blocked_until - now)
+            if tokens < 1:
+                wait = max(wait, refill_from - now + (1 - tokens) / self.rate)
+            if wait > self.max_wait:
+                conn.execute("ROLLBACK")
+                raise RateLimitExceeded(
+                    f"Upstream rate limit queue is full for {key}",
+                    retry_after=wait,
+                    status_code=503
+                )
+            self._store(conn, key, tokens - 1, refill_from, blocked_until)
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+    def acquire(self, key):
+        """Block until a slot for key is available (or raise RateLimitExceeded)"""
+        wait = self.reserve(key)
+        if wait > 0:
+            print(f"Rate limiter: queued {wait:.2f}s for {key}")
+            time.sleep(wait)
+        return wait
+
+    def block(self, key, seconds):
+        """Stop admitting requests for key for the given number of seconds"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            tokens, refill_from, blocked_until = self._load(conn, key, now)
+            until = max(blocked_until, now + seconds)
+            # The bucket is empty when the block ends and refills from then on, so
+            # queued requests are spaced out instead of all firing at once.
+            # Slots already reserved beyond the block stay reserved.
+            self._store(conn, key, min(tokens, 0.0), max(refill_from, until), until)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def update_from_headers(self, key, status_code, headers):
+        """
+        Adjust the bucket from upstream response headers
+        Returns:
+            Seconds until upstream will accept requests again (0 if not limited)
+        """
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_at = parse_reset_time(headers.get('X-RateLimit-Reset'))
+
+        if retry_after is None and reset_at is not None:
+            try:
+                exhausted = float(remaining) <= 0
+            except (TypeError, ValueError):
+                exhausted = status_code == 429
+            if exhausted:
+                retry_after = max(0.0, reset_at - time.time())
+
+        if retry_after is None and status_code == 429:
+            retry_after = 1.0 / self.rate
+
+        if retry_after:
+            self.block(key, retry_after)
+            return retry_after
+        return 0.0
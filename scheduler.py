@@ -0,0 +1,235 @@
+"""
+Fair Scheduler - Per-client admission control for agent loops, shared by all worker processes
+"""
+import time
+import threading
+from collections import deque
+
+from rate_limiter import RateLimitExceeded
+from sqlite_store import database_path, create_private, connect, Wakeups
+
+WAITING = 'waiting'
+RUNNING = 'running'
+RELEASED = 'released'
+
+
+class FairScheduler:
+    """
+    Admits agent loops under a global concurrency limit and a per-client limit,
+    queueing the excess in weighted fair order.
+
+    Each queued request gets a virtual finish tag: the later of the scheduler's
+    virtual time and the client's previous tag, plus 1 / weight. Requests are
+    admitted in tag order, so a client with ten queued requests holds tags
+    spread over ten "rounds" and a client arriving with one request is served
+    after at most one of them. State lives in SQLite so every gunicorn worker
+    on the host shares one queue.
+
+    A queued request holds a gunicorn request thread while it waits, so the
+    queue is bounded per client and in total (max_queued) and requests beyond
+    that are rejected at once instead of tying up the threads other clients
+    need to reach the queue.
+    """
+
+    def __init__(self, db_path=None, max_concurrent=8, per_client_limit=2, max_queued_per_client=2,
+                 max_queued=4, max_wait=60.0, lease_seconds=900, poll_interval=0.05):
+        self.db_path = db_path or database_path('ai_assistant_scheduler.db')
+        self.max_concurrent = max_concurrent
+        self.per_client_limit = per_client_limit
+        self.max_queued_per_client = max_queued_per_client
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self.lease_seconds = lease_seconds
+        self.wakeups = Wakeups(poll_interval)
+        self.waits = deque(maxlen=1000)
+        self.waits_lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        create_private(self.db_path)
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, owner TEXT, tag REAL, state TEXT, "
+                "enqueued REAL, started REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tickets_state_tag ON tickets (state, tag)")
+            conn.execute("CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, last_tag REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS clock (id INTEGER PRIMARY KEY, vtime REAL)")
+            conn.execute("INSERT OR IGNORE INTO clock (id, vtime) VALUES (0, 0)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return connect(self.db_path, autocommit=True)
+
+    def _expire(self, conn, now):
+        """Drop tickets left behind by crashed workers"""
+        conn.execute("DELETE FROM tickets WHERE state = ? AND started < ?", (RUNNING, now - self.lease_seconds))
+        conn.execute("DELETE FROM tickets WHERE state = ? AND enqueued < ?", (WAITING, now - self.max_wait - 30))
+
+    def _head(self, conn, now):
+        """
+        The next ticket to admit, ignoring tickets _expire() would drop
+        Returns:
+            (ticket ID, tag), or None if nothing can be admitted now
+        """
+        running = conn.execute(
+            "SELECT COUNT(*) FROM tickets WHERE state = ? AND started >= ?", (RUNNING, now - self.lease_seconds)
+        ).fetchone()[0]
+        if running >= self.max_concurrent:
+            return None
+        # Clients already at their limit are skipped, not allowed to block the queue
+        return conn.execute(
+            "SELECT id, tag FROM tickets t WHERE state = ? AND enqueued >= ? AND ("
+            "SELECT COUNT(*) FROM tickets r WHERE r.owner = t.owner AND r.state = ? AND r.started >= ?) < ? "
+            "ORDER BY tag, id LIMIT 1",
+            (WAITING, now - self.max_wait - 30, RUNNING, now - self.lease_seconds, self.per_client_limit)
+        ).fetchone()
+
+    def enqueue(self, owner, weight=1.0):
+        """
+        Queue a request for owner
+        Returns:
+            The ticket ID
+        Raises:
+            RateLimitExceeded (429) if owner already has max_queued_per_client waiting,
+            or max_queued requests are waiting in total
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            self._expire(conn, now)
+            queued, queued_by_owner = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(owner = ?), 0) FROM tickets WHERE state = ?", (owner, WAITING)
+            ).fetchone()
+            if queued_by_owner >= self.max_queued_per_client or queued >= self.max_queued:
+                conn.execute("ROLLBACK")
+                self.rejected += 1
+                raise RateLimitExceeded(
+                    "Too many requests queued for this client" if queued_by_owner >= self.max_queued_per_client
+                    else "Server queue is full",
+                    retry_after=self.estimate_wait(),
+                    status_code=429
+                )
+            vtime = conn.execute("SELECT vtime FROM clock WHERE id = 0").fetchone()[0]
+            row = conn.execute("SELECT last_tag FROM owners WHERE owner = ?", (owner,)).fetchone()
+            tag = max(vtime, row[0] if row else 0.0) + 1.0 / weight
+            conn.execute("INSERT OR REPLACE INTO owners (owner, last_tag) VALUES (?, ?)", (owner, tag))
+            ticket = conn.execute(
+                "INSERT INTO tickets (owner, tag, state, enqueued) VALUES (?, ?, ?, ?)",
+                (owner, tag, WAITING, now)
+            ).lastrowid
+            conn.execute("COMMIT")
+            return ticket
+        finally:
+            conn.close()
+
+    def try_admit(self, ticket):
+        """
+        Start ticket if it is the first eligible one in tag order and there is capacity
+        Returns:
+            True if the ticket is now running
+        """
+        conn = self._connect()
+        try:
+            # Waiters poll with a plain read and take the write lock only when they are next
+            head = self._head(conn, time.time())
+            if head is None or head[0] != ticket:
+                return False
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            self._expire(conn, now)
+            head = self._head(conn, now)
+            if head is None or head[0] != ticket:
+                conn.execute("COMMIT")
+                return False
+            conn.execute("UPDATE tickets SET state = ?, started = ? WHERE id = ?", (RUNNING, now, ticket))
+            conn.execute("UPDATE clock SET vtime = MAX(vtime, ?) WHERE id = 0", (head[1],))
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def release(self, ticket):
+        """Finish or abandon a ticket and wake local waiters"""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM tickets WHERE id = ?", (ticket,))
+        finally:
+            conn.close()
+        self.wakeups.notify(RELEASED)
+
+    def acquire(self, owner, weight=1.0):
+        """
+        Block until owner's request is admitted
+        Returns:
+            (ticket, seconds waited)
+        Raises:
+            RateLimitExceeded (429 if owner's queue is full, 503 if not admitted within max_wait)
+        """
+        start = time.time()
+        ticket = self.enqueue(owner, weight)
+        try:
+            # Every release can admit the next ticket, so waiters share one wakeup key
+            if not self.wakeups.wait_for(lambda: self.try_admit(ticket) or None, RELEASED, self.max_wait):
+                self.rejected += 1
+                raise RateLimitExceeded(
+                    "Server is busy, request was not admitted in time",
+                    retry_after=self.estimate_wait(),
+                    status_code=503
+                )
+        except BaseException:
+            self.release(ticket)
+            raise
+        waited = time.time() - start
+        with self.waits_lock:
+            self.waits.append(waited)
+            self.admitted += 1
+        return ticket, waited
+
+    def recent_waits(self):
+        with self.waits_lock:
+            return sorted(self.waits)
+
+    def estimate_wait(self):
+        """Rough seconds until a new request would be admitted, from recent waits"""
+        waits = self.recent_waits()
+        return max(1.0, waits[len(waits) // 2]) if waits else 1.0
+
+    def stats(self):
+        """Queue depth and wait times: global state from SQLite, waits observed by this process"""
+        conn = self._connect()
+        try:
+            now = time.time()
+            rows = conn.execute(
+                "SELECT owner, state, COUNT(*), MIN(enqueued) FROM tickets GROUP BY owner, state"
+            ).fetchall()
+        finally:
+            conn.close()
+        clients = {}
+        totals = {RUNNING: 0, WAITING: 0}
+        oldest = None
+        for owner, state, count, enqueued in rows:
+            clients.setdefault(owner[:12], {RUNNING: 0, WAITING: 0})[state] = count
+            totals[state] += count
+            if state == WAITING:
+                oldest = enqueued if oldest is None else min(oldest, enqueued)
+        waits = self.recent_waits()
+        return {
+            'running': totals[RUNNING],
+            'waiting': totals[WAITING],
+            'max_concurrent': self.max_concurrent,
+            'per_client_limit': self.per_client_limit,
+            'max_queued': self.max_queued,
+            'oldest_wait_seconds': round(now - oldest, 3) if oldest else 0.0,
+            'clients': clients,
+            'worker': {
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'wait_p50': round(waits[len(waits) // 2], 3) if waits else 0.0,
+                'wait_p95': round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+                'wait_max': round(waits[-1], 3) if waits else 0.0
+            }
+        }
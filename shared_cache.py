@@ -0,0 +1,271 @@
+"""
+Shared Cache - Key-value cache with TTL and LRU eviction, shared by all worker processes
+"""
+import os
+import json
+import time
+import threading
+
+from sqlite_store import database_path, create_private, connect, Wakeups
+
+
+class SharedCache:
+    """
+    JSON values in one SQLite database (WAL mode), so every gunicorn worker on
+    the host reads and fills the same entries instead of keeping its own cold copy.
+
+    WAL lets readers run beside a writer, so a hit is a single indexed SELECT on
+    a connection kept open per thread. Last-access times are only rewritten
+    when older than touch_interval, which keeps hot reads from becoming writes.
+    Expired entries are never returned; they are deleted, together with the
+    least recently accessed entries once the stored size passes max_bytes, by a
+    sweep that runs every sweep_every writes.
+
+    get_or_compute is single-flight across processes: the first caller to miss
+    a key takes a lease on it and computes the value, and concurrent callers in
+    any worker wait for that value instead of computing it again.
+    """
+
+    def __init__(self, db_path=None, max_bytes=256 * 1024 * 1024, default_ttl=3600,
+                 lease_seconds=60, poll_interval=0.02, touch_interval=30, sweep_every=256):
+        self.db_path = db_path or database_path('ai_assistant_cache.db')
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.lease_seconds = lease_seconds
+        self.touch_interval = touch_interval
+        self.sweep_every = sweep_every
+        self.local = threading.local()
+        self.wakeups = Wakeups(poll_interval)
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.computes = 0
+        self.waits = 0
+        self.evictions = 0
+        # Cached results include read_file and list_files output
+        create_private(self.db_path)
+        conn = connect(self.db_path)
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "key TEXT PRIMARY KEY, value TEXT, size INTEGER, expires REAL, accessed REAL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+                conn.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)")
+                conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """This thread's connection; a forked worker opens its own instead of using the parent's"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = connect(self.db_path, autocommit=True)
+            # A crash can only lose the latest writes, which a cache can afford
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def make_key(key):
+        """Cache keys are strings; tuples and other JSON values are serialized"""
+        return key if isinstance(key, str) else json.dumps(key, sort_keys=True)
+
+    def _lookup(self, conn, key):
+        """(found, value) for a key, refreshing its access time if that is stale"""
+        now = time.time()
+        row = conn.execute("SELECT value, expires, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return False, None
+        if now - row[2] > self.touch_interval:
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0])
+
+    def _count(self, counter, amount=1):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, key, default=None):
+        """Cached value for key, or default if it is missing or expired"""
+        found, value = self._lookup(self._connect(), self.make_key(key))
+        self._count('hits' if found else 'misses')
+        return value if found else default
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a JSON-serializable value for ttl seconds (default_ttl if None)
+        Returns:
+            False if the value is too large to cache, True otherwise
+        """
+        data = json.dumps(value)
+        if len(data) > self.max_bytes // 8:
+            return False
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+            (self.make_key(key), data, len(data), now + (self.default_ttl if ttl is None else ttl), now)
+        )
+        with self.lock:
+            self.writes += 1
+            sweep = self.writes % self.sweep_every == 0
+        if sweep:
+            self.sweep()
+        return True
+
+    def delete(self, key):
+        """Remove key from the cache"""
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (self.make_key(key),))
+
+    def _claim(self, conn, key, owner):
+        """
+        Take the compute lease on key
+        Returns:
+            (claimed, found, value); found is True if the value was stored meanwhile
+        """
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            found, value = self._lookup(conn, key)
+            claimed = False
+            if not found:
+                # A lease past its expiry belongs to a crashed or stuck worker
+                conn.execute("DELETE FROM leases WHERE key = ? AND expires <= ?", (key, now))
+                claimed = conn.execute(
+                    "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                    (key, owner, now + self.lease_seconds)
+                ).rowcount == 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed, found, value
+
+    def _release(self, conn, key, owner):
+        conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+        self.wakeups.notify(key)
+
+    def get_or_compute(self, key, compute, ttl=None, cache_if=None):
+        """
+        Cached value for key, computing and storing it on a miss
+        Only one caller across all workers computes a missing key at a time;
+        the others wait for its result. If the computing caller doesn't store a
+        value (it failed, or cache_if rejected it), one of the waiters takes over.
+        Args:
+            compute: Zero-argument function producing the value
+            cache_if: Optional predicate; values it rejects are returned but not stored
+        """
+        key = self.make_key(key)
+        conn = self._connect()
+        found, value = self._lookup(conn, key)
+        if found:
+            self._count('hits')
+            return value
+        self._count('misses')
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+
+        def settled():
+            """The claim, or None while another caller holds the lease and no value is stored"""
+            claimed, found, value = self._claim(conn, key, owner)
+            return (claimed, found, value) if claimed or found else None
+
+        claim = settled()
+        if claim is None:
+            # Wait for the lease holder's value, or for it to give the lease up
+            self._count('waits')
+            claim = self.wakeups.wait_for(settled, key, self.lease_seconds)
+            if claim is None:
+                # Don't wait on a stuck lease forever; compute without caching
+                self._count('computes')
+                return compute()
+        claimed, found, value = claim
+        if found:
+            return value
+        self._count('computes')
+        try:
+            value = compute()
+            if cache_if is None or cache_if(value):
+                self.set(key, value, ttl)
+        finally:
+            self._release(conn, key, owner)
+        return value
+
+    def sweep(self):
+        """Delete expired entries and leases, then evict LRU entries beyond max_bytes"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM leases WHERE expires <= ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            evicted = 0
+            if total > self.max_bytes:
+                # Least recently accessed first, until the total is back under 90% of the limit
+                evicted = conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    "SELECT key FROM (SELECT key, size, SUM(size) OVER (ORDER BY accessed, key) AS running "
+                    "FROM entries) WHERE running - size < ?)",
+                    (total - int(self.max_bytes * 0.9),)
+                ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count('evictions', evicted)
+
+    def clear(self):
+        """Remove every entry"""
+        self._connect().execute("DELETE FROM entries")
+
+    def stats(self):
+        """Size of the shared cache, and hit counts observed by this process"""
+        entries, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE expires > ?", (time.time(),)
+        ).fetchone()
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'worker': {
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                    'computes': self.computes,
+                    'waits': self.waits,
+                    'evictions': self.evictions
+                }
+            }
+
+
+# Process-wide cache used by the tool layer; the app installs its configured one
+shared_cache = None
+shared_cache_configured = False
+shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """The process-wide SharedCache, created from the environment on first use; None if disabled"""
+    global shared_cache, shared_cache_configured
+    with shared_cache_lock:
+        if not shared_cache_configured:
+            if os.getenv('SHARED_CACHE_ENABLED', 'True') == 'True':
+                shared_cache = SharedCache(
+                    db_path=os.getenv('SHARED_CACHE_DB'),
+                    max_bytes=int(os.getenv('SHARED_CACHE_MAX_MB', 256)) * 1024 * 1024
+                )
+            shared_cache_configured = True
+        return shared_cache
+
+
+def set_shared_cache(cache):
+    """Install cache (or None to disable sharing) as the process-wide cache"""
+    global shared_cache, shared_cache_configured
+    with shared_cache_lock:
+        shared_cache = cache
+        shared_cache_configured = True
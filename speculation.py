@@ -0,0 +1,192 @@
+"""
+Speculation - Runs likely tool calls in the background before the model asks for them
+"""
+import re
+import json
+import time
+import inspect
+import threading
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import tracer
+
+# Tools without side effects whose parameters can be derived from the user's message
+SPECULATIVE_TOOLS = ('get_current_time', 'web_search', 'get_weather', 'fetch_url')
+URL_PATTERN = re.compile(r'https?://[^\s<>"\')\]]+')
+WEATHER_LOCATION = re.compile(
+    r'weather\s+(?:like\s+)?(?:in|for|at)\s+([a-z][a-z .\'-]{1,40}?)\s*(?:[?.!,]|\b(?:today|tomorrow|now|this)\b|$)',
+    re.IGNORECASE
+)
+# Speculation needs more confidence than a prompt hint: whole-word phrases that
+# ask for the tool directly ("now" must not match "know", "what is" alone is not a search)
+SPECULATION_TRIGGERS = {
+    'get_current_time': re.compile(
+        r"\b(?:what(?:'s| is) the (?:current )?(?:time|date|day)|what time|current (?:time|date)|"
+        r"today'?s date|what day is it)\b",
+        re.IGNORECASE
+    ),
+    'web_search': re.compile(r'\b(?:search(?: the web)?(?: for)?|look up|google|latest news)\b', re.IGNORECASE)
+}
+
+
+def normalize(value):
+    """Normalize a parameter value so trivially different calls match"""
+    if isinstance(value, str):
+        # URLs are case-sensitive (paths, query strings) and may end in '?'
+        if URL_PATTERN.fullmatch(value.strip()):
+            return value.strip()
+        value = ' '.join(value.lower().split()).rstrip('?.! ')
+        return int(value) if value.isdigit() else value
+    return value
+
+
+def call_key(tool_name, parameters):
+    """Canonical key of a tool call: defaults filled in, values normalized"""
+    from tools import AgentTools
+    values = dict(parameters)
+    try:
+        bound = inspect.signature(getattr(AgentTools, tool_name)).bind(**parameters)
+        bound.apply_defaults()
+        values = bound.arguments
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return tool_name, json.dumps({name: normalize(value) for name, value in values.items()}, sort_keys=True)
+
+
+class Speculator:
+    """
+    Predicts tool calls from the user's message and starts them in a thread
+    pool while the first upstream call is in flight. Only side-effect-free
+    tools are speculated, so an unused result is simply dropped.
+
+    Hit-rate metrics are kept per process: started, hits (a speculative result
+    answered a tool call the model made), and unused (discarded at the end of
+    the request).
+    """
+
+    def __init__(self, max_workers=4, max_age=30.0, max_query_chars=300):
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.max_query_chars = max_query_chars
+        self.executor = None
+        self.lock = threading.Lock()
+        self.started = Counter()
+        self.hits = Counter()
+        self.unused = Counter()
+
+    def predict(self, message, suggestions):
+        """
+        Tool calls the message will likely need
+        Suggested tools are only speculated when the message asks for them
+        unambiguously: a trigger phrase, a single URL or a weather location.
+        Returns:
+            List of (tool_name, parameters)
+        """
+        calls = []
+        if 'get_current_time' in suggestions and SPECULATION_TRIGGERS['get_current_time'].search(message):
+            calls.append(('get_current_time', {}))
+        if ('web_search' in suggestions and len(message) <= self.max_query_chars
+                and SPECULATION_TRIGGERS['web_search'].search(message)):
+            calls.append(('web_search', {'query': message.strip()}))
+        if 'fetch_url' in suggestions:
+            urls = URL_PATTERN.findall(message)
+            if len(urls) == 1:
+                calls.append(('fetch_url', {'url': urls[0]}))
+        if 'get_weather' in suggestions:
+            match = WEATHER_LOCATION.search(message)
+            if match:
+                calls.append(('get_weather', {'location': match.group(1).strip()}))
+        return [call for call in calls if call[0] in SPECULATIVE_TOOLS]
+
+    def start(self, execute, message, suggestions):
+        """
+        Start predicted calls in the background
+        Args:
+            execute: Function (tool_name, parameters) -> result
+        Returns:
+            A SpeculationBatch, or None if nothing was predicted
+        """
+        calls = self.predict(message, suggestions)
+        if not calls:
+            return None
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            for tool_name, _ in calls:
+                self.started[tool_name] += 1
+        batch = SpeculationBatch(self)
+        for tool_name, parameters in calls:
+            context = contextvars.copy_context()
+            future = self.executor.submit(context.run, self._run, execute, tool_name, parameters)
+            batch.futures[call_key(tool_name, parameters)] = (future, time.time())
+        print(f"Speculatively running: {[tool_name for tool_name, _ in calls]}")
+        return batch
+
+    def _run(self, execute, tool_name, parameters):
+        with tracer.span('tool.speculate', **{'tool.name': tool_name}):
+            return execute(tool_name, parameters)
+
+    def stats(self):
+        """Speculation counts and hit rates per tool"""
+        with self.lock:
+            tools = {
+                tool_name: {
+                    'started': started,
+                    'hits': self.hits[tool_name],
+                    'unused': self.unused[tool_name],
+                    'hit_rate': round(self.hits[tool_name] / started, 3)
+                }
+                for tool_name, started in self.started.items()
+            }
+            started = sum(self.started.values())
+            hits = sum(self.hits.values())
+        return {
+            'started': started,
+            'hits': hits,
+            'hit_rate': round(hits / started, 3) if started else 0.0,
+            'tools': tools
+        }
+
+
+class SpeculationBatch:
+    """Speculative calls started for one request"""
+
+    def __init__(self, speculator):
+        self.speculator = speculator
+        self.futures = {}
+
+    def take(self, tool_name, parameters):
+        """
+        Claim the speculative result matching a requested tool call
+        Waits for the call if it is still running.
+        Returns:
+            The tool result, or None if there is no usable match
+        """
+        entry = self.futures.pop(call_key(tool_name, parameters), None)
+        if entry is None:
+            return None
+        future, started = entry
+        try:
+            result = future.result()
+        except Exception:
+            result = None
+        # Failed or stale results are re-run for real
+        if not isinstance(result, dict) or not result.get('success') or time.time() - started > self.speculator.max_age:
+            self._count_unused(tool_name)
+            return None
+        with self.speculator.lock:
+            self.speculator.hits[tool_name] += 1
+        return result
+
+    def discard(self):
+        """Drop results the model never asked for"""
+        for (tool_name, _), (future, _) in self.futures.items():
+            future.cancel()
+            self._count_unused(tool_name)
+        self.futures.clear()
+
+    def _count_unused(self, tool_name):
+        with self.speculator.lock:
+            self.speculator.unused[tool_name] += 1
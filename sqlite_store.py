@@ -0,0 +1,89 @@
+"""
+SQLite Store - Shared plumbing of the SQLite databases every worker process uses
+"""
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+
+
+def database_path(filename):
+    """Default location of a store's database, in the system temp directory"""
+    return os.path.join(tempfile.gettempdir(), filename)
+
+
+def create_private(db_path):
+    """
+    Create the database file readable by this user only, unless it already exists.
+    SQLite gives the -wal and -shm files the same permissions.
+    """
+    try:
+        os.close(os.open(db_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    except FileExistsError:
+        pass
+
+
+def connect(db_path, autocommit=False):
+    """
+    Open a connection in WAL mode, so readers run beside a writer
+    Args:
+        autocommit: Leave transactions to the caller (BEGIN IMMEDIATE ... COMMIT)
+            instead of Python's implicit ones
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    if autocommit:
+        conn.isolation_level = None
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class Wakeups:
+    """
+    Waiting for state in a shared database to change. A change made in this
+    process wakes local waiters at once through notify(); changes made by
+    other workers are noticed by polling every poll_interval.
+    """
+
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self.events = {}
+        self.lock = threading.Lock()
+
+    def notify(self, key):
+        """Wake this process's waiters on key"""
+        with self.lock:
+            entry = self.events.pop(key, None)
+        if entry:
+            entry[0].set()
+
+    def _wait(self, key, timeout):
+        with self.lock:
+            entry = self.events.get(key)
+            if entry is None:
+                entry = self.events[key] = [threading.Event(), 0]
+            entry[1] += 1
+        try:
+            entry[0].wait(timeout)
+        finally:
+            # Drop the event with its last waiter, so keys changed by other workers don't pile up
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0 and self.events.get(key) is entry:
+                    del self.events[key]
+
+    def wait_for(self, check, key, timeout):
+        """
+        Call check until it returns something other than None
+        Returns:
+            check's result, or None if timeout seconds passed first
+        """
+        deadline = time.time() + timeout
+        while True:
+            result = check()
+            if result is not None:
+                return result
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self._wait(key, min(self.poll_interval, remaining))
@@ -0,0 +1,239 @@
+"""
+Microbenchmarks for AgentEngine and tools hot paths, with regression budgets
+
+Times the per-request CPU work of the agent (intent detection, prompt
+assembly, tool call parsing, result formatting, tool dispatch) on generated
+inputs and compares it to the stored baseline in bench_baseline.json.
+
+Timings are stored relative to a fixed pure-Python calibration loop, so a
+baseline recorded on one machine stays meaningful on another. Allocations
+are the peak bytes traced by tracemalloc during one call.
+
+Usage:
+    python test_benchmarks.py            # run and compare against the baseline
+    python test_benchmarks.py --update   # record a new baseline
+    python -m pytest test_benchmarks.py  # same comparison, as a test
+"""
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import tracemalloc
+from contextlib import contextmanager
+
+from agent_engine import AgentEngine
+from tools import execute_tool
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+# Allowed slowdown / allocation growth relative to the baseline. Timings on
+# shared machines jitter by tens of percent; allocations are deterministic.
+TIME_BUDGET = float(os.getenv('BENCH_TIME_BUDGET', 2.0))
+ALLOC_BUDGET = float(os.getenv('BENCH_ALLOC_BUDGET', 1.25))
+ALLOC_SLACK_BYTES = 4096
+REPEATS = 7
+MIN_SECONDS = 0.05
+
+WORDS = ("the agent search result weather python file data model request token answer "
+         "tool call query page time value list server memory index error user").split()
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_inputs():
+    """Realistic inputs: short chats, a 100-turn history and 1 MB tool outputs"""
+    rng = random.Random(42)
+    history = [{"role": "system", "content": AgentEngine().create_system_prompt()}]
+    for turn in range(100):
+        history.append({"role": "user", "content": words(rng, rng.randint(5, 40))})
+        history.append({"role": "assistant", "content": words(rng, rng.randint(20, 200))})
+    return {
+        'short_message': "What's the weather like in Paris today?",
+        'long_message': words(rng, 4000) + " please search for the latest results",
+        'history': history,
+        'tool_response': words(rng, 30000) + '\nTOOL_CALL: web_search\nPARAMETERS: {"query": "latest AI news", "max_results": 5}\n',
+        'plain_response': words(rng, 30000),
+        'file_result': {
+            'success': True,
+            'file_path': 'data/large.txt',
+            'content': words(rng, 180000)[:1024 * 1024],
+            'size': 1024 * 1024
+        },
+        'search_result': {
+            'success': True,
+            'query': 'latest AI news',
+            'results': [
+                {'title': words(rng, 8), 'link': f"https://example.com/{i}", 'snippet': words(rng, 40)}
+                for i in range(10)
+            ]
+        }
+    }
+
+
+@contextmanager
+def app_context():
+    """
+    A pushed app context for the app benchmarks, with every store in a
+    temporary directory; popped and removed afterwards
+    """
+    from app_testing import temporary_stores, make_app
+    with temporary_stores() as directory:
+        flask_app = make_app(
+            directory,
+            OPENROUTER_API_KEY='',
+            HUGGINGFACE_API_KEY='benchmark',
+            SHARED_CACHE_ENABLED=False,
+            TRACING_ENABLED=False
+        )
+        with flask_app.app_context():
+            yield
+
+
+def hf_prompt(conversation):
+    """Hugging Face prompt assembly as done by app.build_payload; needs app_context()"""
+    import app
+    return lambda: app.build_payload(conversation, False)
+
+
+def make_benchmarks():
+    """Name -> zero-argument callable"""
+    engine = AgentEngine()
+    inputs = make_inputs()
+    return {
+        'detect_intent.short': lambda: engine.detect_intent(inputs['short_message']),
+        'detect_intent.long': lambda: engine.detect_intent(inputs['long_message']),
+        'enhance_message_with_intent.short': lambda: engine.enhance_message_with_intent(inputs['short_message']),
+        'parse_tool_call.large_response': lambda: engine.parse_tool_call(inputs['tool_response']),
+        'parse_tool_call.no_call': lambda: engine.parse_tool_call(inputs['plain_response']),
+        'format_tool_result.1mb_file': lambda: engine.format_tool_result('read_file', inputs['file_result']),
+        'format_tool_result.search': lambda: engine.format_tool_result('web_search', inputs['search_result']),
+        'create_system_prompt.text': lambda: engine.create_system_prompt(),
+        'create_system_prompt.native': lambda: engine.create_system_prompt(native_tools=True),
+        'build_payload.hf_100_turns': hf_prompt(inputs['history']),
+        'execute_tool.dispatch': lambda: execute_tool('calculate', expression='2 + 2'),
+    }
+
+
+def calibrate():
+    """Seconds per run of a fixed pure-Python workload, used as the time unit"""
+    def workload():
+        total = 0
+        for i in range(10000):
+            total += i * i % 7
+        return str(total) * 10
+    return min(timeit.repeat(workload, number=20, repeat=REPEATS)) / 20
+
+
+def time_per_call(function):
+    """Best-of-REPEATS seconds per call"""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < MIN_SECONDS and number < 1000000:
+        number *= 10
+    return min(timer.repeat(repeat=REPEATS, number=number)) / number
+
+
+def peak_allocation(function):
+    """Peak bytes allocated during one call"""
+    function()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - start
+
+
+def run_benchmarks():
+    """Measure every benchmark; times are in calibration units"""
+    unit = calibrate()
+    results = {}
+    # The context stays pushed for the whole run so build_payload is measured without the push
+    with app_context():
+        for name, function in make_benchmarks().items():
+            seconds = time_per_call(function)
+            results[name] = {
+                'relative_time': seconds / unit,
+                'seconds': seconds,
+                'peak_bytes': peak_allocation(function)
+            }
+    return results
+
+
+def find_regressions(results, baseline):
+    """List of human-readable budget violations"""
+    failures = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['relative_time'] > base['relative_time'] * TIME_BUDGET:
+            failures.append(f"{name}: {result['relative_time'] / base['relative_time']:.2f}x slower than baseline")
+        if result['peak_bytes'] > base['peak_bytes'] * ALLOC_BUDGET + ALLOC_SLACK_BYTES:
+            failures.append(f"{name}: peak allocation {result['peak_bytes']} B vs baseline {base['peak_bytes']} B")
+    return failures
+
+
+def print_results(results, baseline):
+    print(f"{'benchmark':<36} {'time':>12} {'vs base':>8} {'peak alloc':>12} {'vs base':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        time_ratio = f"{result['relative_time'] / base['relative_time']:.2f}x" if base else 'new'
+        alloc_ratio = f"{result['peak_bytes'] / max(base['peak_bytes'], 1):.2f}x" if base else 'new'
+        print(f"{name:<36} {result['seconds'] * 1e6:>9.1f} us {time_ratio:>8} "
+              f"{result['peak_bytes'] / 1024:>9.1f} KB {alloc_ratio:>8}")
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)['benchmarks']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_baseline(results):
+    with open(BASELINE_FILE, 'w') as f:
+        json.dump({
+            'recorded': time.strftime('%Y-%m-%d'),
+            'python': sys.version.split()[0],
+            'benchmarks': {
+                name: {'relative_time': float(f"{r['relative_time']:.4g}"), 'peak_bytes': r['peak_bytes']}
+                for name, r in results.items()
+            }
+        }, f, indent=2)
+        f.write('\n')
+
+
+def test_hot_paths_within_budget():
+    """No hot path regresses past the time or allocation budget"""
+    baseline = load_baseline()
+    results = run_benchmarks()
+    print_results(results, baseline)
+    failures = find_regressions(results, baseline)
+    assert not failures, '\n'.join(failures)
+
+
+if __name__ == "__main__":
+    if '--update' in sys.argv:
+        results = run_benchmarks()
+        print_results(results, {})
+        save_baseline(results)
+        print(f"\nBaseline written to {BASELINE_FILE}")
+    else:
+        baseline = load_baseline()
+        if not baseline:
+            print("No baseline found; record one with: python test_benchmarks.py --update")
+        results = run_benchmarks()
+        print_results(results, baseline)
+        failures = find_regressions(results, baseline)
+        if failures:
+            print("\nRegressions:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("\nAll hot paths within budget")
@@ -0,0 +1,93 @@
+"""
+Checkpoint tests - interrupted turns resume from their completed tool steps
+
+Runs plan mode against temporary stores with a scripted upstream whose
+synthesis call fails, then retries, changes the message or calls
+/chat/resume, counting tool executions.
+"""
+import json
+from unittest import mock
+
+from agent_engine import AgentEngine
+from app_testing import temporary_stores, make_app, reply, UpstreamResponse
+
+PLAN = reply(json.dumps({"steps": [{"id": "s1", "tool": "calculate", "parameters": {"expression": "6*7"}}]}))
+QUESTION = 'What is 6*7?'
+
+
+class ScriptedUpstream:
+    """requests.post stand-in returning responses in order and recording payloads"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.payloads = []
+
+    def __call__(self, url, headers, json):
+        self.payloads.append(json)
+        return self.responses.pop(0)
+
+
+def interrupted_plan(client, upstream):
+    """Run a plan whose synthesis call fails"""
+    failed = client.post('/chat', json={'message': QUESTION, 'conversation_id': 'c1', 'mode': 'plan'})
+    assert failed.status_code == 500
+    assert failed.get_json()['resumable'] is True
+    assert len(upstream.payloads) == 2
+
+
+def test_retry_resumes_plan_synthesis():
+    upstream = ScriptedUpstream(PLAN, UpstreamResponse("overloaded", status_code=500), reply("It is 42."))
+    execute = AgentEngine.execute_tool_call
+    with temporary_stores() as directory, mock.patch('requests.post', upstream), \
+            mock.patch.object(AgentEngine, 'execute_tool_call', autospec=True, side_effect=execute) as tool:
+        client = make_app(directory, SHARED_CACHE_ENABLED=False).test_client()
+        interrupted_plan(client, upstream)
+        assert tool.call_count == 1
+
+        retried = client.post('/chat', json={'message': QUESTION, 'conversation_id': 'c1', 'mode': 'plan'})
+        data = retried.get_json()
+        assert data['reply'] == "It is 42."
+        assert data['tool_calls'][0]['result']['result'] == 42
+        assert data['iterations'] == 2
+        # Only the synthesis call was repeated, not the planning call or the tool
+        assert tool.call_count == 1
+        assert 'PLAN_RESULTS' in upstream.payloads[2]['messages'][-1]['content']
+        assert client.post('/chat/resume', json={'conversation_id': 'c1'}).status_code == 404
+
+
+def test_resume_endpoint_continues_plan():
+    upstream = ScriptedUpstream(PLAN, UpstreamResponse("overloaded", status_code=500), reply("It is 42."))
+    with temporary_stores() as directory, mock.patch('requests.post', upstream):
+        client = make_app(directory).test_client()
+        interrupted_plan(client, upstream)
+        resumed = client.post('/chat/resume', json={'conversation_id': 'c1'})
+        assert resumed.get_json()['reply'] == "It is 42."
+        assert len(upstream.payloads) == 3
+
+
+def test_different_message_discards_checkpoint():
+    upstream = ScriptedUpstream(PLAN, UpstreamResponse("overloaded", status_code=500), reply("Hello!"))
+    with temporary_stores() as directory, mock.patch('requests.post', upstream):
+        client = make_app(directory).test_client()
+        interrupted_plan(client, upstream)
+        other = client.post('/chat', json={'message': 'hi', 'conversation_id': 'c1'})
+        assert other.get_json()['reply'] == "Hello!"
+        assert other.get_json()['tool_calls'] == []
+        # The abandoned turn is not sent upstream and can't be resumed
+        assert not any(QUESTION in (msg['content'] or '') for msg in upstream.payloads[2]['messages'])
+        assert client.post('/chat/resume', json={'conversation_id': 'c1'}).status_code == 404
+
+
+def test_resume_without_checkpoint_is_404():
+    with temporary_stores() as directory:
+        client = make_app(directory).test_client()
+        response = client.post('/chat/resume', json={'conversation_id': 'nothing'})
+        assert response.status_code == 404
+
+
+if __name__ == "__main__":
+    test_retry_resumes_plan_synthesis()
+    test_resume_endpoint_continues_plan()
+    test_different_message_discards_checkpoint()
+    test_resume_without_checkpoint_is_404()
+    print("Interrupted turns resume from their checkpoints")
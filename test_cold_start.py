@@ -0,0 +1,71 @@
+"""
+Cold start budget test - import time and memory of a fresh app process
+
+Runs `import app; app.create_app()` in new interpreters and fails if startup
+exceeds the time or RSS budget, or if a lazily loaded backend got imported.
+Budgets can be overridden with COLD_START_BUDGET_MS and COLD_START_BUDGET_MB.
+"""
+import os
+import sys
+import json
+import subprocess
+
+BUDGET_MS = float(os.getenv('COLD_START_BUDGET_MS', 400))
+BUDGET_MB = float(os.getenv('COLD_START_BUDGET_MB', 60))
+RUNS = 3
+
+# Backends that must only be imported when a tool or feature first needs them
+LAZY_MODULES = ['requests', 'numpy', 'duckduckgo_search', 'docx', 'bs4', 'memory_store', 'document_index']
+
+# The app's stores go to a temporary directory, as in test_benchmarks.py.
+# Peak RSS comes from VmHWM, which starts over at exec; ru_maxrss of a
+# subprocess includes the peak of the (possibly large) process that forked it
+PROBE = """
+import sys, time, json, shutil, tempfile, resource
+from app_testing import store_config
+directory = tempfile.mkdtemp()
+start = time.perf_counter()
+import app
+app.create_app({'OPENROUTER_API_KEY': 'cold-start-test', **store_config(directory)})
+elapsed = time.perf_counter() - start
+shutil.rmtree(directory, ignore_errors=True)
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({
+    'ms': elapsed * 1000,
+    'rss_mb': peak_rss_mb(),
+    'loaded': [name for name in %r if name in sys.modules]
+}))
+""" % (LAZY_MODULES,)
+
+def measure_cold_start():
+    """Best-of-RUNS startup measurement in fresh interpreters"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE],
+            cwd=here, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(results, key=lambda r: r['ms'])
+
+def test_cold_start_budget():
+    """Startup time and peak RSS stay within budget, with no eager backend imports"""
+    result = measure_cold_start()
+    print(f"Cold start: {result['ms']:.0f} ms (budget {BUDGET_MS:.0f}), "
+          f"RSS {result['rss_mb']:.1f} MB (budget {BUDGET_MB:.0f})")
+    assert not result['loaded'], f"Imported at startup: {result['loaded']}"
+    assert result['ms'] <= BUDGET_MS, f"Cold start took {result['ms']:.0f} ms"
+    assert result['rss_mb'] <= BUDGET_MB, f"Cold start RSS was {result['rss_mb']:.1f} MB"
+
+if __name__ == "__main__":
+    test_cold_start_budget()
+    print("Cold start within budget")
@@ -0,0 +1,57 @@
+"""
+Generation tests - continuation of replies cut off by their token budget
+
+Runs /chat against temporary stores with a scripted upstream.
+"""
+from unittest import mock
+
+from app import CONTINUE_PROMPT, DEFAULT_GENERATION
+from app_testing import temporary_stores, make_app, reply, UpstreamResponse
+
+
+def chat(responses, **config):
+    """Post one message; returns the reply and the payloads sent upstream"""
+    payloads = []
+
+    def post(url, headers, json):
+        payloads.append(json)
+        return responses.pop(0)
+
+    with temporary_stores() as directory, mock.patch('requests.post', post):
+        client = make_app(directory, NATIVE_TOOL_CALLING=False, **config).test_client()
+        response = client.post('/chat', json={'message': 'Tell me a story'})
+    assert not responses
+    return response.get_json()['reply'], payloads
+
+
+def test_fixed_settings_do_not_continue():
+    text, payloads = chat([reply("Once upon a", finish_reason='length')], ADAPTIVE_GENERATION=False)
+    assert text == "Once upon a"
+    assert len(payloads) == 1
+    assert payloads[0]['max_tokens'] == DEFAULT_GENERATION['max_tokens']
+    assert 'stop' not in payloads[0]
+
+
+def test_adaptive_generation_continues_cut_off_replies():
+    text, payloads = chat([reply("Once upon a", finish_reason='length'), reply("time.")])
+    assert text == "Once upon a time."
+    assert payloads[1]['messages'][-1]['content'] == CONTINUE_PROMPT
+
+
+def test_continuation_stops_at_tool_calls():
+    cut_off_with_tools = UpstreamResponse({"choices": [{
+        "message": {"role": "assistant", "content": "time",
+                    "tool_calls": [{"id": "call_0", "type": "function",
+                                    "function": {"name": "get_current_time", "arguments": "{}"}}]},
+        "finish_reason": "length"
+    }]})
+    text, payloads = chat([reply("Once upon a", finish_reason='length'), cut_off_with_tools])
+    assert text == "Once upon a time"
+    assert len(payloads) == 2
+
+
+if __name__ == "__main__":
+    test_fixed_settings_do_not_continue()
+    test_adaptive_generation_continues_cut_off_replies()
+    test_continuation_stops_at_tool_calls()
+    print("Cut-off replies are continued only with adaptive generation")
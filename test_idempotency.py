@@ -0,0 +1,55 @@
+"""
+Idempotency-Key test - retried /chat requests are replayed, not re-run
+
+Runs the app against temporary stores with the upstream call replaced by a
+counter, and checks that a retry with the same Idempotency-Key gets the
+stored reply even from a client that doesn't keep the client_id cookie.
+"""
+import os
+import stat
+from unittest import mock
+
+from app_testing import temporary_stores, make_app, reply
+
+
+def test_retry_without_cookie_is_replayed():
+    """Two identical cookie-less POSTs with one Idempotency-Key call upstream once"""
+    calls = []
+
+    def post(url, headers, json):
+        calls.append(json)
+        return reply(f"reply {len(calls)}")
+
+    with temporary_stores() as directory, mock.patch('requests.post', post):
+        flask_app = make_app(directory)
+        responses = []
+        for _ in range(2):
+            # A fresh client without a cookie jar, like a script retrying on timeout
+            client = flask_app.test_client(use_cookies=False)
+            responses.append(client.post(
+                '/chat',
+                json={'message': 'hello', 'conversation_id': 'retry'},
+                headers={'Idempotency-Key': 'retry-1'},
+                environ_base={'REMOTE_ADDR': '10.0.0.7'}
+            ))
+        other = flask_app.test_client(use_cookies=False).post(
+            '/chat',
+            json={'message': 'hello', 'conversation_id': 'retry'},
+            headers={'Idempotency-Key': 'retry-1'},
+            environ_base={'REMOTE_ADDR': '10.0.0.8'}
+        )
+        first, retry = responses
+        assert first.status_code == retry.status_code == 200
+        assert retry.headers.get('Idempotent-Replayed') == 'true'
+        assert retry.get_json()['reply'] == first.get_json()['reply']
+        # The same key from another caller is a different request
+        assert other.headers.get('Idempotent-Replayed') is None
+        assert len(calls) == 2
+        # Stored replies are readable by this user only
+        mode = os.stat(flask_app.config['IDEMPOTENCY_DB']).st_mode
+        assert stat.S_IMODE(mode) == 0o600
+
+
+if __name__ == "__main__":
+    test_retry_without_cookie_is_replayed()
+    print("Idempotent retries replayed")
@@ -0,0 +1,65 @@
+"""
+Native tool calling fallback test - conversations recorded with native tool
+calls keep working after the model falls back to the text protocol
+
+Runs the app against temporary stores with a scripted upstream: one
+conversation uses native tool calls, a second one gets the "tools not
+supported" 400, and the first is then continued, in this app and in a second
+app sharing its stores like another gunicorn worker.
+"""
+from unittest import mock
+
+from agent_engine import AgentEngine
+from app_testing import temporary_stores, make_app, reply, native_tool_calls, UpstreamResponse
+
+
+def test_older_native_conversation_after_fallback():
+    """A native conversation is converted to the text protocol once native tools are disabled"""
+    responses = [
+        native_tool_calls(('calculate', {'expression': '6*7'})),
+        reply("It is 42."),
+        UpstreamResponse("tools are not supported by this model", status_code=400),
+        reply("Hello!"),
+        reply("Still 42."),
+        reply("42 again.")
+    ]
+    payloads = []
+
+    def post(url, headers, json):
+        payloads.append(json)
+        return responses.pop(0)
+
+    text_prompt = AgentEngine().create_system_prompt()
+    with temporary_stores() as directory, mock.patch('requests.post', post):
+        client = make_app(directory).test_client()
+        first = client.post('/chat', json={'message': 'What is 6*7?', 'conversation_id': 'native'})
+        assert first.get_json()['tool_calls'][0]['result']['result'] == 42
+        assert 'tools' in payloads[0]
+
+        # The 400 disables native tools and converts only this conversation
+        second = client.post('/chat', json={'message': 'hi', 'conversation_id': 'other'})
+        assert second.get_json()['reply'] == "Hello!"
+        assert 'tools' not in payloads[3]
+
+        # The older native conversation is rewritten before it is sent
+        third = client.post('/chat', json={'message': 'And again?', 'conversation_id': 'native'})
+        assert third.get_json()['reply'] == "Still 42."
+        payload = payloads[4]
+        assert 'tools' not in payload
+        assert payload['messages'][0]['content'] == text_prompt
+        assert not any(msg['role'] == 'tool' or msg.get('tool_calls') for msg in payload['messages'])
+        assert any('TOOL_RESULT' in (msg['content'] or '') for msg in payload['messages'])
+
+        # Another worker sharing the stores skips the native attempt and sees the converted history
+        worker = make_app(directory).test_client()
+        worker.set_cookie('client_id', client.get_cookie('client_id').value)
+        fourth = worker.post('/chat', json={'message': 'Once more?', 'conversation_id': 'native'})
+        assert fourth.get_json()['reply'] == "42 again."
+        assert 'tools' not in payloads[5]
+        assert payloads[5]['messages'][0]['content'] == text_prompt
+        assert not responses
+
+
+if __name__ == "__main__":
+    test_older_native_conversation_after_fallback()
+    print("Native conversations converted after the fallback")
@@ -0,0 +1,132 @@
+"""
+Plan mode tests - parsing, reference resolution and DAG execution of tool plans
+"""
+import json
+import time
+import threading
+
+import pytest
+
+from agent_engine import AgentEngine
+
+
+def plan(*steps, answer=None):
+    message = {"steps": list(steps)}
+    if answer is not None:
+        message["answer"] = answer
+    return "Here is the plan:\n" + json.dumps(message)
+
+
+def test_parse_plan_fills_defaults():
+    steps, answer = AgentEngine().parse_plan(plan(
+        {"tool": "calculate", "parameters": {"expression": "1+1"}},
+        {"tool": "get_current_time"}
+    ))
+    assert [step['id'] for step in steps] == ['s1', 's2']
+    assert steps[1]['parameters'] == {} and steps[1]['depends_on'] == []
+    assert answer is None
+    assert AgentEngine().parse_plan(plan(answer="No tools needed")) == ([], "No tools needed")
+
+
+@pytest.mark.parametrize('message, error', [
+    ("no plan here", "No JSON plan found"),
+    ('{"steps": {"tool": "calculate"}}', "must be a list"),
+    (plan("calculate"), "must be an object"),
+    (plan({"tool": "rm_rf"}), "Unknown tool"),
+    (plan({"id": "a", "tool": "calculate"}, {"id": "a", "tool": "calculate"}), "Duplicate step id"),
+    (plan({"tool": "calculate", "parameters": "1+1"}), "Invalid parameters"),
+    (plan({"tool": "calculate", "depends_on": "s0"}), "Invalid parameters"),
+])
+def test_parse_plan_rejects_malformed_plans(message, error):
+    with pytest.raises(ValueError, match=error):
+        AgentEngine().parse_plan(message)
+
+
+def test_step_references():
+    engine = AgentEngine()
+    results = {'s1': {'success': True, 'result': 42, 'items': [{'url': 'http://a'}, {'url': 'http://b'}]}}
+    # A whole-parameter reference keeps the referenced value's type
+    assert engine.resolve_step_references({'x': '{{s1.result}}'}, results) == {'x': 42}
+    assert engine.resolve_step_references('{{ s1.items.1.url }}', results) == 'http://b'
+    # References inside text are substituted, non-strings as JSON
+    assert engine.resolve_step_references(['{{s1.result}} + 1', 'first: {{s1.items.0}}'], results) == \
+        ['42 + 1', 'first: {"url": "http://a"}']
+    with pytest.raises(KeyError):
+        engine.resolve_step_references('{{s2.result}}', results)
+
+
+def test_execute_plan_resolves_and_reports_parameters():
+    engine = AgentEngine()
+    steps, _ = engine.parse_plan(plan(
+        {"id": "a", "tool": "calculate", "parameters": {"expression": "6*7"}},
+        {"id": "b", "tool": "calculate", "parameters": {"expression": "{{a.result}} + 1"}, "depends_on": ["a"]}
+    ))
+    results, parameters = engine.execute_plan(steps)
+    assert results['b']['result'] == 43
+    assert parameters == {'a': {'expression': '6*7'}, 'b': {'expression': '42 + 1'}}
+
+
+def test_execute_plan_failed_unresolved_and_circular_dependencies():
+    engine = AgentEngine()
+    steps, _ = engine.parse_plan(plan(
+        {"id": "bad", "tool": "calculate", "parameters": {"expression": "1+"}},
+        {"id": "after_bad", "tool": "calculate", "parameters": {"expression": "{{bad.result}}"}, "depends_on": ["bad"]},
+        {"id": "missing_ref", "tool": "calculate", "parameters": {"expression": "{{nowhere.result}}"}},
+        {"id": "x", "tool": "calculate", "parameters": {"expression": "1"}, "depends_on": ["y"]},
+        {"id": "y", "tool": "calculate", "parameters": {"expression": "2"}, "depends_on": ["x"]},
+        {"id": "orphan", "tool": "calculate", "parameters": {"expression": "3"}, "depends_on": ["ghost"]}
+    ))
+    results, parameters = engine.execute_plan(steps)
+    assert not results['bad']['success']
+    assert results['after_bad']['error'] == "Skipped: dependency bad failed"
+    assert results['missing_ref']['error'].startswith("Could not resolve reference")
+    for step_id in ('x', 'y', 'orphan'):
+        assert results[step_id]['error'] == 'Unresolvable or circular dependency'
+        assert step_id in parameters
+    assert [step['id'] for step in engine.failed_steps(steps, results)] == \
+        ['bad', 'after_bad', 'missing_ref', 'x', 'y', 'orphan']
+
+
+def test_independent_steps_run_in_parallel():
+    engine = AgentEngine()
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def slow_tool(tool_name, parameters, speculation=None):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.2)
+        with lock:
+            running[0] -= 1
+        return {'success': True, 'result': parameters['expression']}
+
+    engine.execute_tool_call = slow_tool
+    steps, _ = engine.parse_plan(plan(
+        *({"id": f"p{i}", "tool": "calculate", "parameters": {"expression": str(i)}} for i in range(4)),
+        {"id": "last", "tool": "calculate", "parameters": {"expression": "{{p0.result}}"}, "depends_on": ["p0", "p3"]}
+    ))
+    start = time.perf_counter()
+    results, _ = engine.execute_plan(steps)
+    elapsed = time.perf_counter() - start
+    assert peak[0] == 4
+    assert results['last']['result'] == '0'
+    # Two waves: the four independent steps, then the dependent one
+    assert elapsed < 0.6
+
+
+def test_revised_plan_reusing_ids_is_renamed():
+    engine = AgentEngine()
+    previous = {'s1': {'success': True, 'result': 1}, 's2': {'success': False, 'error': 'boom'}}
+    steps, _ = engine.parse_plan(plan(
+        {"id": "s2", "tool": "calculate", "parameters": {"expression": "{{s1.result}} + 1"}, "depends_on": ["s1"]},
+        {"id": "s3", "tool": "calculate", "parameters": {"expression": "{{ s2.result }} * 2"}, "depends_on": ["s2"]}
+    ))
+    assert engine.rename_reused_ids(steps, previous) == {'s2': 's2_2'}
+    assert [step['id'] for step in steps] == ['s2_2', 's3']
+    # References inside the revised plan follow the renamed step; earlier steps stay reachable
+    assert steps[1]['depends_on'] == ['s2_2']
+    assert steps[1]['parameters'] == {'expression': '{{ s2_2.result }} * 2'}
+    assert steps[0]['parameters'] == {'expression': '{{s1.result}} + 1'}
+    results, _ = engine.execute_plan(steps, previous)
+    assert results['s2_2']['result'] == 2 and results['s3']['result'] == 4
+    assert results['s2'] == previous['s2']
@@ -0,0 +1,106 @@
+"""
+Rate limiter tests - token bucket spacing, shedding and upstream header handling
+
+Each test uses a temporary database and a fake clock, so waits are computed
+but never slept.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from email.utils import formatdate
+from unittest import mock
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimitGovernor, RateLimitExceeded
+
+KEY = 'model'
+
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@contextmanager
+def governor(**settings):
+    """A governor on a temporary database, with time.time() replaced by a FakeClock"""
+    directory = tempfile.mkdtemp()
+    clock = FakeClock()
+    try:
+        with mock.patch.object(rate_limiter.time, 'time', clock):
+            yield RateLimitGovernor(db_path=os.path.join(directory, 'ratelimit.db'), **settings), clock
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_reservations_are_spaced_at_the_rate():
+    with governor(rate_per_minute=60, burst=2, max_wait=30) as (limiter, clock):
+        # The burst is admitted at once, then one slot per second in arrival order
+        assert [limiter.reserve(KEY) for _ in range(5)] == [0, 0, 1, 2, 3]
+        clock.now += 3
+        assert limiter.reserve(KEY) == pytest.approx(1)
+        # An idle bucket refills up to the burst, not beyond
+        clock.now += 60
+        assert [limiter.reserve(KEY) for _ in range(3)] == [0, 0, 1]
+
+
+def test_workers_share_one_bucket():
+    with governor(rate_per_minute=60, burst=1) as (limiter, clock):
+        other_worker = RateLimitGovernor(db_path=limiter.db_path, rate_per_minute=60, burst=1)
+        assert limiter.reserve(KEY) == 0
+        assert other_worker.reserve(KEY) == 1
+        assert limiter.reserve('other-model') == 0
+
+
+def test_request_is_shed_when_the_wait_is_too_long():
+    with governor(rate_per_minute=60, burst=1, max_wait=2.5) as (limiter, clock):
+        assert [limiter.reserve(KEY) for _ in range(3)] == [0, 1, 2]
+        with pytest.raises(RateLimitExceeded) as shed:
+            limiter.reserve(KEY)
+        assert shed.value.status_code == 503
+        assert shed.value.retry_after == pytest.approx(3)
+        # A shed request doesn't take a slot
+        clock.now += 1
+        assert limiter.reserve(KEY) == pytest.approx(2)
+
+
+def test_block_delays_reservations_and_refills_afterwards():
+    with governor(rate_per_minute=60, burst=3, max_wait=30) as (limiter, clock):
+        limiter.block(KEY, 5)
+        # The bucket is empty when the block ends, so queued requests are spaced out after it
+        assert [limiter.reserve(KEY) for _ in range(3)] == [6, 7, 8]
+        clock.now += 20
+        assert limiter.reserve(KEY) == 0
+
+
+def test_retry_after_header_blocks_the_bucket():
+    with governor(rate_per_minute=60, burst=2, max_wait=30) as (limiter, clock):
+        assert limiter.update_from_headers(KEY, 429, {'Retry-After': '7'}) == 7
+        assert limiter.reserve(KEY) == pytest.approx(8)
+    with governor(rate_per_minute=60, burst=2, max_wait=30) as (limiter, clock):
+        retry_at = formatdate(clock.now + 4, usegmt=True)
+        assert limiter.update_from_headers(KEY, 429, {'Retry-After': retry_at}) == pytest.approx(4)
+
+
+def test_rate_limit_reset_headers():
+    with governor(rate_per_minute=60, burst=2, max_wait=30) as (limiter, clock):
+        # Requests left: nothing to do
+        headers = {'X-RateLimit-Remaining': '3', 'X-RateLimit-Reset': str(int((clock.now + 30) * 1000))}
+        assert limiter.update_from_headers(KEY, 200, headers) == 0
+        assert limiter.reserve(KEY) == 0
+        # Exhausted: blocked until the reset time (OpenRouter sends epoch milliseconds)
+        headers = {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int((clock.now + 10) * 1000))}
+        assert limiter.update_from_headers(KEY, 200, headers) == pytest.approx(10)
+        assert limiter.reserve(KEY) == pytest.approx(11)
+
+
+def test_bare_429_blocks_for_one_slot():
+    with governor(rate_per_minute=30, burst=2, max_wait=30) as (limiter, clock):
+        assert limiter.update_from_headers(KEY, 429, {}) == pytest.approx(2)
+        assert limiter.update_from_headers(KEY, 500, {}) == 0
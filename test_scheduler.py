@@ -0,0 +1,130 @@
+"""
+Scheduler tests - fair admission order, bounded queues and the 429/503 rejections
+
+The FairScheduler tests drive tickets by hand on a temporary database; the
+app tests check how /chat and the admin routes surface the scheduler.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+
+from rate_limiter import RateLimitExceeded
+from scheduler import FairScheduler
+from app_testing import temporary_stores, make_app
+
+
+@contextmanager
+def fair_scheduler(**settings):
+    """A scheduler on a temporary database"""
+    directory = tempfile.mkdtemp()
+    try:
+        yield FairScheduler(db_path=os.path.join(directory, 'scheduler.db'), **settings)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def admission_order(scheduler, running, pending):
+    """Release running one ticket at a time and record which pending ticket is admitted next"""
+    order = []
+    pending = list(pending)
+    while pending:
+        scheduler.release(running)
+        admitted = [ticket for ticket in pending if scheduler.try_admit(ticket)]
+        assert len(admitted) == 1
+        running = admitted[0]
+        pending.remove(running)
+        order.append(running)
+    return order
+
+
+def test_light_client_is_not_queued_behind_a_heavy_one():
+    with fair_scheduler(max_concurrent=1, per_client_limit=1, max_queued_per_client=3, max_queued=10) as scheduler:
+        blocker = scheduler.enqueue('blocker')
+        assert scheduler.try_admit(blocker)
+        heavy = [scheduler.enqueue('heavy') for _ in range(3)]
+        light = scheduler.enqueue('light')
+        # The light request arrived last but is served after one heavy request, not three
+        assert admission_order(scheduler, blocker, heavy + [light]) == [heavy[0], light, heavy[1], heavy[2]]
+
+
+def test_client_at_its_limit_does_not_block_the_queue():
+    with fair_scheduler(max_concurrent=2, per_client_limit=1) as scheduler:
+        first = scheduler.enqueue('heavy')
+        assert scheduler.try_admit(first)
+        second = scheduler.enqueue('heavy')
+        light = scheduler.enqueue('light')
+        assert not scheduler.try_admit(second)
+        assert scheduler.try_admit(light)
+
+
+def test_full_queues_are_rejected_with_429():
+    with fair_scheduler(max_concurrent=1, max_queued_per_client=2, max_queued=3) as scheduler:
+        scheduler.enqueue('a')
+        scheduler.enqueue('a')
+        with pytest.raises(RateLimitExceeded, match='this client') as rejected:
+            scheduler.enqueue('a')
+        assert rejected.value.status_code == 429
+        scheduler.enqueue('b')
+        with pytest.raises(RateLimitExceeded, match='queue is full') as rejected:
+            scheduler.enqueue('c')
+        assert rejected.value.status_code == 429
+        assert scheduler.stats()['waiting'] == 3
+
+
+def test_request_not_admitted_in_time_gets_503():
+    with fair_scheduler(max_concurrent=1, max_wait=0.2) as scheduler:
+        running, _ = scheduler.acquire('a')
+        with pytest.raises(RateLimitExceeded) as rejected:
+            scheduler.acquire('b')
+        assert rejected.value.status_code == 503
+        # The abandoned ticket leaves the queue, so it doesn't hold a place
+        assert scheduler.stats()['waiting'] == 0
+        scheduler.release(running)
+        assert scheduler.acquire('b')[1] < 0.2
+
+
+def test_chat_rejections_carry_retry_after():
+    with temporary_stores() as directory:
+        flask_app = make_app(directory, MAX_CONCURRENT_AGENTS=1, PER_CLIENT_QUEUE=1, SCHEDULER_MAX_WAIT=0.2)
+        scheduler = flask_app.extensions['assistant'].scheduler
+        client = flask_app.test_client()
+        client_id = 'ab' * 16
+        client.set_cookie('client_id', client_id)
+        running, _ = scheduler.acquire('someone else')
+        busy = client.post('/chat', json={'message': 'hi'})
+        assert busy.status_code == 503
+        assert int(busy.headers['Retry-After']) >= 1
+        # A full queue is rejected at once instead of waiting for max_wait
+        queued = scheduler.enqueue(f"client:{client_id}")
+        full = client.post('/chat', json={'message': 'hi'})
+        assert full.status_code == 429 and 'Retry-After' in full.headers
+        scheduler.release(queued)
+        scheduler.release(running)
+
+
+def test_admin_routes_require_the_admin_token():
+    with temporary_stores() as directory:
+        client = make_app(directory, ADMIN_TOKEN='secret').test_client()
+        for path in ('/admin/scheduler', '/admin/generation', '/admin/speculation', '/admin/cache', '/admin/profiles'):
+            assert client.get(path).status_code == 403
+            assert client.get(path, headers={'X-Admin-Token': 'wrong'}).status_code == 403
+            assert client.get(path, headers={'X-Admin-Token': 'secret'}).status_code == 200
+        stats = client.get('/admin/scheduler', headers={'X-Admin-Token': 'secret'}).get_json()['scheduler']
+        assert stats['max_queued'] >= 1
+    with temporary_stores() as directory:
+        # Without a configured token the admin routes are closed
+        client = make_app(directory, ADMIN_TOKEN=None).test_client()
+        assert client.get('/admin/scheduler', headers={'X-Admin-Token': ''}).status_code == 403
+
+
+if __name__ == "__main__":
+    test_light_client_is_not_queued_behind_a_heavy_one()
+    test_client_at_its_limit_does_not_block_the_queue()
+    test_full_queues_are_rejected_with_429()
+    test_request_not_admitted_in_time_gets_503()
+    test_chat_rejections_carry_retry_after()
+    test_admin_routes_require_the_admin_token()
+    print("Scheduler admits fairly and rejects with 429/503")
@@ -0,0 +1,106 @@
+"""
+Shared cache tests - single-flight get_or_compute, private database, tool calls through the cache
+
+Two SharedCache objects on one temporary database stand in for two gunicorn
+workers: they share entries and leases but not in-process wakeups.
+"""
+import os
+import stat
+import time
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from agent_engine import AgentEngine
+from shared_cache import SharedCache
+
+
+@contextmanager
+def caches(count=2, **settings):
+    """count caches sharing a temporary database"""
+    directory = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(directory, 'cache.db')
+        yield [SharedCache(db_path=db_path, **settings) for _ in range(count)]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_concurrently(functions):
+    """Start every function at once and return their results in order"""
+    results = [None] * len(functions)
+    barrier = threading.Barrier(len(functions))
+
+    def run(i):
+        barrier.wait()
+        results[i] = functions[i]()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(functions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_callers_compute_once():
+    with caches(poll_interval=0.01) as workers:
+        computed = []
+
+        def compute():
+            computed.append(True)
+            time.sleep(0.2)
+            return {'value': 42}
+
+        # Four callers in each of two "workers" miss the same key together
+        results = run_concurrently([
+            lambda cache=cache: cache.get_or_compute('key', compute) for cache in workers for _ in range(4)
+        ])
+        assert len(computed) == 1
+        assert results == [{'value': 42}] * 8
+        assert sum(cache.stats()['worker']['waits'] for cache in workers) == 7
+        # Later callers in either worker get the stored value without computing
+        assert workers[1].get_or_compute('key', compute) == {'value': 42}
+        assert len(computed) == 1
+
+
+def test_waiter_takes_over_when_the_value_is_not_stored():
+    with caches(count=1, poll_interval=0.01) as (cache,):
+        calls = []
+
+        def compute():
+            calls.append(True)
+            time.sleep(0.1)
+            return {'success': len(calls) > 1}
+
+        # The first result is rejected by cache_if, so one waiter computes again and stores its result
+        results = run_concurrently([
+            lambda: cache.get_or_compute('key', compute, cache_if=lambda value: value['success'])
+            for _ in range(3)
+        ])
+        assert len(calls) == 2
+        assert sorted(result['success'] for result in results) == [False, True, True]
+        assert cache.get('key') == {'success': True}
+
+
+def test_database_is_private():
+    with caches(count=1) as (cache,):
+        assert stat.S_IMODE(os.stat(cache.db_path).st_mode) == 0o600
+
+
+def test_cached_tool_with_non_object_arguments_returns_an_error():
+    with caches(count=1) as (cache,):
+        engine = AgentEngine()
+        engine.cache = cache
+        for arguments in (['python', 'sqlite'], 'python sqlite'):
+            result = engine.execute_tool_call('web_search', arguments)
+            assert result['success'] is False and result['error']
+
+
+if __name__ == "__main__":
+    test_concurrent_callers_compute_once()
+    test_waiter_takes_over_when_the_value_is_not_stored()
+    test_database_is_private()
+    test_cached_tool_with_non_object_arguments_returns_an_error()
+    print("Shared cache computes each missing key once")
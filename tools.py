@@ -2,13 +2,361 @@
 AI Agent Tools - Provides various capabilities for the AI agent
 """
 import os
+import re
 import json
-import requests
+import codecs
+import time
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from duckduckgo_search import DDGS
-import subprocess
+from html.parser import HTMLParser
 import sys
 
+from shared_cache import get_shared_cache
+
+# Limits for fetch_url
+FETCH_TIMEOUT = (5, 10)  # connect, read seconds
+FETCH_MAX_BYTES = 3 * 1024 * 1024
+FETCH_MAX_TEXT = 50000
+FETCH_MAX_URLS = 5
+FETCH_CACHE_SIZE = 128
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+
+# Pooled HTTP session shared by all fetch_url calls, created on first use
+http_session = None
+http_session_lock = threading.Lock()
+
+# Workspace document search index, built on first use
+DOCUMENT_ROOT = os.getenv('DOCUMENT_ROOT', '.')
+document_index = None
+document_index_lock = threading.Lock()
+
+# Extracted page text by URL, revalidated with ETag/Last-Modified. Kept in the
+# cross-worker shared cache when it is enabled, in this process otherwise.
+fetch_cache = OrderedDict()
+fetch_cache_lock = threading.Lock()
+FETCH_CACHE_TTL = 24 * 3600
+
+# Limits for the read_file / list_directory cache
+FILE_CACHE_MAX_BYTES = int(os.getenv('FILE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+FILE_CACHE_MAX_ENTRIES = 1024
+
+
+def get_http_session():
+    """Return the shared HTTP session, importing requests on first use"""
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            import requests
+            session = requests.Session()
+            session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+            session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16))
+            session.headers['User-Agent'] = 'Mozilla/5.0 (compatible; AI-Assistant/1.0)'
+            http_session = session
+        return http_session
+
+
+def cached_page(url):
+    """Previously fetched page for url, or None"""
+    cache = get_shared_cache()
+    if cache:
+        return cache.get(('fetch', url))
+    with fetch_cache_lock:
+        page = fetch_cache.get(url)
+        if page:
+            fetch_cache.move_to_end(url)
+        return page
+
+
+def store_page(url, page):
+    """Keep a page that can be revalidated on the next fetch"""
+    cache = get_shared_cache()
+    if cache:
+        cache.set(('fetch', url), page, ttl=FETCH_CACHE_TTL)
+        return
+    with fetch_cache_lock:
+        fetch_cache[url] = page
+        while len(fetch_cache) > FETCH_CACHE_SIZE:
+            fetch_cache.popitem(last=False)
+
+
+def preload_backends():
+    """
+    Import the libraries tools load lazily. Tool backends are imported on first
+    use to keep startup fast; a preloading server calls this before forking.
+    """
+    import subprocess
+    from duckduckgo_search import DDGS
+    from document_index import DocumentIndex
+    get_http_session()
+
+
+def file_signature(path):
+    """(mtime_ns, size, inode) of a path, or None if it can't be stat'ed"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class FileCache:
+    """
+    Bounded LRU cache for filesystem tool results.
+    
+    Each entry records the (mtime_ns, size, inode) of every path it was built
+    from and is revalidated with stat on each hit, so changes made outside the
+    tools are noticed; write_file and create_directory invalidate affected
+    entries directly. Paths modified within the last second are not cached,
+    since a second change in the same mtime tick could go unnoticed.
+    """
+    
+    RACY_NS = 1000000000
+    
+    def __init__(self, max_bytes=FILE_CACHE_MAX_BYTES, max_entries=FILE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        """Return the cached value for key if every path it depends on is unchanged"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            signatures, value, _ = entry
+            if all(file_signature(path) == signature for path, signature in signatures):
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                    self.hits += 1
+                return value
+            self.invalidate(key)
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key, signatures, value, cost):
+        """
+        Cache a value
+        Args:
+            signatures: List of (path, file_signature(path)) taken before the value was built
+            cost: Approximate size of the value in bytes
+        """
+        if cost > self.max_bytes // 4 or any(signature is None for _, signature in signatures):
+            return
+        if time.time_ns() - max(signature[0] for _, signature in signatures) < self.RACY_NS:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (signatures, value, cost)
+            self.bytes += cost
+            while self.bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                _, (_, _, evicted_cost) = self.entries.popitem(last=False)
+                self.bytes -= evicted_cost
+    
+    def invalidate(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+    
+    def invalidate_path(self, path):
+        """Drop the cached contents of path and the listings of its ancestor directories"""
+        path = os.path.abspath(path)
+        self.invalidate(('read', path))
+        self.invalidate(('list', path))
+        parent = os.path.dirname(path)
+        while parent != path:
+            self.invalidate(('list', parent))
+            path, parent = parent, os.path.dirname(parent)
+
+
+file_cache = FileCache()
+
+
+class HTMLTextExtractor(HTMLParser):
+    """
+    Incremental HTML to text extractor. Pages are fed chunk by chunk as they
+    download, so no DOM is built and reading can stop once enough text is found.
+    """
+    
+    SKIP_TAGS = {'script', 'style', 'noscript', 'svg', 'nav', 'footer', 'header', 'aside', 'form', 'template'}
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'section', 'article', 'main', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote'}
+    MAIN_TAGS = {'main', 'article'}
+    VOID_TAGS = {'br', 'img', 'hr', 'meta', 'link', 'input', 'source', 'wbr'}
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip_depth = 0
+        self.main_depth = 0
+        self.in_title = False
+        self.title = ''
+        self.parts = []
+        self.main_parts = []
+        self.length = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.VOID_TAGS:
+            if tag == 'br':
+                self.add_text('\n')
+            return
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.MAIN_TAGS:
+            self.main_depth += 1
+        elif tag == 'title':
+            self.in_title = True
+        if tag in self.BLOCK_TAGS:
+            self.add_text('\n')
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in self.MAIN_TAGS and self.main_depth:
+            self.main_depth -= 1
+        elif tag == 'title':
+            self.in_title = False
+        if tag in self.BLOCK_TAGS:
+            self.add_text('\n')
+    
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif not self.skip_depth:
+            self.add_text(' '.join(data.split()) + (' ' if data[-1:].isspace() else ''))
+    
+    def add_text(self, text):
+        if not text or self.skip_depth:
+            return
+        self.parts.append(text)
+        self.length += len(text)
+        if self.main_depth:
+            self.main_parts.append(text)
+    
+    def get_text(self):
+        """Main/article text when the page has it, otherwise all visible text"""
+        main_text = self.clean(self.main_parts)
+        return main_text if len(main_text) >= 200 else self.clean(self.parts)
+    
+    @staticmethod
+    def clean(parts):
+        lines = (line.strip() for line in ''.join(parts).splitlines())
+        return '\n'.join(line for line in lines if line)
+
+def detect_charset(content_type, head):
+    """
+    Charset of a response body: the one declared in the Content-Type header,
+    else in a <meta> tag at the start of the document, else UTF-8. (requests
+    assumes ISO-8859-1 for text without a declared charset.)
+    """
+    match = HEADER_CHARSET.search(content_type)
+    charset = match.group(1) if match else None
+    if charset is None:
+        match = META_CHARSET.search(head[:4096])
+        charset = match.group(1).decode('ascii', 'ignore') if match else None
+    if charset:
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+
+def fetch_single_url(url, max_chars=5000):
+    """Fetch one URL through the pooled session, using the revalidating cache"""
+    try:
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://' + url
+        
+        cached = cached_page(url)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        
+        with get_http_session().get(url, headers=headers, timeout=FETCH_TIMEOUT, stream=True) as response:
+            if response.status_code == 304 and cached:
+                page = cached
+                from_cache = True
+            else:
+                response.raise_for_status()
+                page = extract_page(response)
+                from_cache = False
+                if page['etag'] or page['last_modified']:
+                    store_page(url, page)
+        
+        text = page['text']
+        return {
+            'success': True,
+            'url': url,
+            'title': page['title'],
+            'text': text[:max_chars],
+            'truncated': page['truncated'] or len(text) > max_chars,
+            'cached': from_cache
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'url': url
+        }
+
+
+def extract_page(response):
+    """Stream a response body through the text extractor within the size limits"""
+    content_type = response.headers.get('Content-Type', '').lower()
+    is_html = 'html' in content_type or not content_type
+    if not is_html and not content_type.startswith(('text/', 'application/json', 'application/xml')):
+        raise ValueError(f'Unsupported content type: {content_type}')
+    
+    decoder = None
+    extractor = HTMLTextExtractor()
+    raw_text = []
+    received = 0
+    truncated = False
+    
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        if decoder is None:
+            charset = detect_charset(response.headers.get('Content-Type', ''), chunk)
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+        received += len(chunk)
+        text = decoder.decode(chunk)
+        if is_html:
+            extractor.feed(text)
+            done = extractor.length >= FETCH_MAX_TEXT
+        else:
+            raw_text.append(text)
+            done = received >= FETCH_MAX_TEXT
+        if done or received >= FETCH_MAX_BYTES:
+            truncated = True
+            break
+    
+    if is_html:
+        extractor.close()
+        title, text = ' '.join(extractor.title.split()), extractor.get_text()
+    else:
+        title, text = '', ''.join(raw_text)
+    
+    return {
+        'title': title,
+        'text': text[:FETCH_MAX_TEXT],
+        'truncated': truncated,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+
+
 class AgentTools:
     """Collection of tools that the AI agent can use"""
     
@@ -23,6 +371,7 @@ class AgentTools:
             List of search results with title, link, and snippet
         """
         try:
+            from duckduckgo_search import DDGS
             ddgs = DDGS()
             results = []
             for r in ddgs.text(query, max_results=max_results):
@@ -43,6 +392,34 @@ class AgentTools:
                 'query': query
             }
     
+    @staticmethod
+    def fetch_url(url, max_chars=5000):
+        """
+        Fetch web pages and extract their readable text
+        Args:
+            url: URL to fetch, or several URLs (comma-separated or a list) to fetch concurrently
+            max_chars: Maximum characters of text to return per page
+        Returns:
+            Page title and text (or a list of pages for several URLs)
+        """
+        urls = url if isinstance(url, list) else [u.strip() for u in str(url).split(',') if u.strip()]
+        max_chars = int(max_chars)
+        if not urls:
+            return {
+                'success': False,
+                'error': 'No URL given'
+            }
+        if len(urls) == 1:
+            return fetch_single_url(urls[0], max_chars)
+        
+        urls = urls[:FETCH_MAX_URLS]
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            pages = list(executor.map(lambda u: fetch_single_url(u, max_chars), urls))
+        return {
+            'success': any(page['success'] for page in pages),
+            'pages': pages
+        }
+    
     @staticmethod
     def get_current_time():
         """Get current date and time"""
@@ -97,8 +474,14 @@ class AgentTools:
             File content
         """
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Unchanged files are served from the cache after a single stat
+            key = ('read', os.path.abspath(file_path))
+            content = file_cache.get(key)
+            if content is None:
+                signature = file_signature(key[1])
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                file_cache.put(key, [(key[1], signature)], content, len(content))
             return {
                 'success': True,
                 'file_path': file_path,
@@ -112,6 +495,35 @@ class AgentTools:
                 'file_path': file_path
             }
     
+    @staticmethod
+    def search_documents(query, max_results=5):
+        """
+        Search workspace files (text, Markdown, code, .docx) with a BM25 index
+        Args:
+            query: Search query string
+            max_results: Maximum number of passages to return
+        Returns:
+            Ranked passages with file path and line range
+        """
+        global document_index
+        try:
+            with document_index_lock:
+                if document_index is None:
+                    from document_index import DocumentIndex
+                    document_index = DocumentIndex(DOCUMENT_ROOT)
+            results = document_index.search(query, max_results=int(max_results))
+            return {
+                'success': True,
+                'query': query,
+                'results': results
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'query': query
+            }
+    
     @staticmethod
     def write_file(file_path, content):
         """
@@ -125,6 +537,7 @@ class AgentTools:
         try:
             with open(file_path, 'w', encoding='utf-8') as f:
                 f.write(content)
+            file_cache.invalidate_path(file_path)
             return {
                 'success': True,
                 'file_path': file_path,
@@ -147,27 +560,41 @@ class AgentTools:
             List of files and directories
         """
         try:
-            items = os.listdir(directory_path)
-            files = []
-            directories = []
-            
-            for item in items:
-                full_path = os.path.join(directory_path, item)
-                if os.path.isfile(full_path):
-                    files.append({
-                        'name': item,
-                        'size': os.path.getsize(full_path),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(full_path)).strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                elif os.path.isdir(full_path):
-                    directories.append(item)
+            # Revalidated by stat'ing the directory (entries added or removed) and each listed file
+            key = ('list', os.path.abspath(directory_path))
+            listing = file_cache.get(key)
+            if listing is None:
+                signatures = [(key[1], file_signature(key[1]))]
+                items = os.listdir(directory_path)
+                files = []
+                directories = []
+                
+                for item in items:
+                    full_path = os.path.join(key[1], item)
+                    try:
+                        st = os.stat(full_path)
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(st.st_mode):
+                        files.append({
+                            'name': item,
+                            'size': st.st_size,
+                            'modified': datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+                        })
+                        signatures.append((full_path, (st.st_mtime_ns, st.st_size, st.st_ino)))
+                    elif stat.S_ISDIR(st.st_mode):
+                        directories.append(item)
+                
+                listing = (files, directories, len(items))
+                file_cache.put(key, signatures, listing, 200 * (len(items) + 1))
             
+            files, directories, total_items = listing
             return {
                 'success': True,
                 'directory': directory_path,
-                'files': files,
-                'directories': directories,
-                'total_items': len(items)
+                'files': [dict(entry) for entry in files],
+                'directories': list(directories),
+                'total_items': total_items
             }
         except Exception as e:
             return {
@@ -192,6 +619,7 @@ class AgentTools:
                 f.write(code)
             
             # Execute the code
+            import subprocess
             result = subprocess.run(
                 [sys.executable, temp_file],
                 capture_output=True,
@@ -257,6 +685,7 @@ class AgentTools:
         """
         try:
             os.makedirs(directory_path, exist_ok=True)
+            file_cache.invalidate_path(directory_path)
             return {
                 'success': True,
                 'directory': directory_path
@@ -279,6 +708,15 @@ TOOL_DEFINITIONS = {
         },
         "example": "web_search('latest AI news', 5)"
     },
+    "fetch_url": {
+        "name": "fetch_url",
+        "description": "Fetch web pages and read their main text. Use this to read a page found with web_search; pass several comma-separated URLs to read them at once.",
+        "parameters": {
+            "url": "URL to fetch, or several URLs separated by commas",
+            "max_chars": "Maximum characters of text per page (default: 5000)"
+        },
+        "example": "fetch_url('https://example.com, https://example.org')"
+    },
     "get_current_time": {
         "name": "get_current_time",
         "description": "Get the current date and time. Use this when user asks about current time, date, day of week.",
@@ -301,6 +739,15 @@ TOOL_DEFINITIONS = {
         },
         "example": "read_file('example.txt')"
     },
+    "search_documents": {
+        "name": "search_documents",
+        "description": "Search the contents of local workspace files (text, Markdown, code, Word .docx). Returns the best matching passages with file path and line numbers. Use this before read_file to find where something is.",
+        "parameters": {
+            "query": "Words to search for",
+            "max_results": "Maximum number of passages (default: 5)"
+        },
+        "example": "search_documents('deployment gunicorn workers')"
+    },
     "write_file": {
         "name": "write_file",
         "description": "Write content to a file. Use this to create or modify files.",
@@ -0,0 +1,163 @@
+"""
+Trace Report - Print a waterfall for one trace or critical-path statistics across traces
+
+Usage:
+    python trace_report.py waterfall <trace_id> [--file traces.jsonl]
+    python trace_report.py stats [--file traces.jsonl] [--name "POST /chat"]
+"""
+import os
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+from tracing import DEFAULT_TRACE_FILE
+
+BAR_WIDTH = 50
+
+
+def load_traces(path, backups=2):
+    """Read spans from a JSONL trace file and its rotated backups, grouped by trace ID"""
+    traces = defaultdict(list)
+    paths = [f"{path}.{index}" for index in range(backups, 0, -1)] + [path]
+    for name in [name for name in paths if os.path.exists(name)] or [path]:
+        with open(name) as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                traces[span['traceId']].append(span)
+    return traces
+
+
+def attribute_value(value):
+    return next(iter(value.values()), '')
+
+
+def span_attributes(span):
+    return {item['key']: attribute_value(item['value']) for item in span.get('attributes', [])}
+
+
+def duration_ms(span):
+    return (span['endTimeUnixNano'] - span['startTimeUnixNano']) / 1e6
+
+
+def build_tree(spans):
+    """Return (roots, children by parent span ID), both ordered by start time"""
+    ids = {span['spanId'] for span in spans}
+    children = defaultdict(list)
+    roots = []
+    for span in sorted(spans, key=lambda s: s['startTimeUnixNano']):
+        if span['parentSpanId'] and span['parentSpanId'] in ids:
+            children[span['parentSpanId']].append(span)
+        else:
+            roots.append(span)
+    return roots, children
+
+
+def print_waterfall(spans):
+    """Print spans as an indented timeline with bars scaled to the whole trace"""
+    roots, children = build_tree(spans)
+    start = min(span['startTimeUnixNano'] for span in spans)
+    end = max(span['endTimeUnixNano'] for span in spans)
+    total = max(end - start, 1)
+    print(f"Trace {spans[0]['traceId']}  {len(spans)} spans  {total / 1e6:.1f} ms\n")
+
+    def show(span, depth):
+        offset = int((span['startTimeUnixNano'] - start) / total * BAR_WIDTH)
+        width = max(1, int((span['endTimeUnixNano'] - span['startTimeUnixNano']) / total * BAR_WIDTH))
+        bar = ' ' * offset + '█' * width
+        error = ' ERROR' if span['status']['code'] == 'STATUS_CODE_ERROR' else ''
+        attributes = ' '.join(f"{k}={v}" for k, v in span_attributes(span).items())
+        label = ('  ' * depth + span['name'])[:40]
+        print(f"{label:<40} {bar:<{BAR_WIDTH}} {duration_ms(span):9.1f} ms{error}  {attributes}")
+        for child in children[span['spanId']]:
+            show(child, depth + 1)
+
+    for root in roots:
+        show(root, 0)
+
+
+def critical_path(span, children, totals):
+    """
+    Attribute a span's duration to the spans on its critical path.
+    Walking back from the span's end, the child that finished last before the
+    cursor is on the path; gaps between such children count as the span's own time.
+    """
+    cursor = span['endTimeUnixNano']
+    own = 0
+    for child in sorted(children[span['spanId']], key=lambda s: s['endTimeUnixNano'], reverse=True):
+        if child['endTimeUnixNano'] > cursor:
+            continue
+        own += cursor - child['endTimeUnixNano']
+        critical_path(child, children, totals)
+        cursor = child['startTimeUnixNano']
+    own += max(0, cursor - span['startTimeUnixNano'])
+    totals[span['name']] += own
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def print_stats(traces, root_name=None):
+    """Aggregate durations and critical-path time per span name across traces"""
+    durations = defaultdict(list)
+    critical = defaultdict(float)
+    root_total = 0
+    count = 0
+    for spans in traces.values():
+        roots, children = build_tree(spans)
+        for root in roots:
+            if root_name and root['name'] != root_name:
+                continue
+            count += 1
+            root_total += root['endTimeUnixNano'] - root['startTimeUnixNano']
+            critical_path(root, children, critical)
+        if not root_name or any(root['name'] == root_name for root in roots):
+            for span in spans:
+                durations[span['name']].append(duration_ms(span))
+
+    if not count:
+        print("No matching traces")
+        return
+
+    print(f"{count} traces, mean root duration {root_total / count / 1e6:.1f} ms\n")
+    print(f"{'span':<28} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'crit ms/trace':>14} {'crit %':>7}")
+    for name, total in sorted(critical.items(), key=lambda item: item[1], reverse=True):
+        values = durations[name]
+        print(f"{name[:28]:<28} {len(values):>7} {percentile(values, 0.5):>9.1f} {percentile(values, 0.95):>9.1f} "
+              f"{total / count / 1e6:>14.1f} {100 * total / root_total:>6.1f}%")
+
+
+def main():
+    # Same settings as the app: environment variables, then the .env file
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    parser = argparse.ArgumentParser(description="Inspect traces written by the AI Assistant backend")
+    parser.add_argument('--file', default=os.getenv('TRACE_FILE') or DEFAULT_TRACE_FILE, help="Trace JSONL file")
+    parser.add_argument('--backups', type=int, default=int(os.getenv('TRACE_BACKUPS', 2)),
+                        help="Number of rotated trace files to read")
+    commands = parser.add_subparsers(dest='command', required=True)
+    waterfall = commands.add_parser('waterfall', help="Print the timeline of one trace")
+    waterfall.add_argument('trace_id')
+    stats = commands.add_parser('stats', help="Critical-path statistics across traces")
+    stats.add_argument('--name', help="Only traces whose root span has this name")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file, args.backups)
+    if args.command == 'waterfall':
+        spans = traces.get(args.trace_id)
+        if not spans:
+            print(f"Trace {args.trace_id} not found in {args.file}")
+            sys.exit(1)
+        print_waterfall(spans)
+    else:
+        print_stats(traces, args.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Tracing - Lightweight spans for requests, agent iterations, upstream and tool calls
+"""
+import os
+import json
+import time
+import fcntl
+import queue
+import random
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+
+STATUS_OK = 'STATUS_CODE_OK'
+STATUS_ERROR = 'STATUS_CODE_ERROR'
+
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def otlp_value(value):
+    """Wrap an attribute value in an OTLP AnyValue"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': value}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Span:
+    """One timed operation; serialized with OTLP span field names"""
+
+    def __init__(self, name, trace_id, parent_id, attributes, kind):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = ''
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = str(message)
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'attributes': [{'key': k, 'value': otlp_value(v)} for k, v in self.attributes.items()],
+            'status': {'code': self.status, 'message': self.status_message}
+        }
+
+
+class NoopSpan:
+    """Stand-in when tracing is disabled"""
+
+    trace_id = ''
+    span_id = ''
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JsonlExporter:
+    """
+    Writes finished spans to a JSONL file from a background thread.
+    export() only enqueues, so request threads never wait on disk; spans are
+    dropped if the queue is full.
+
+    Once the file reaches max_bytes it is rotated to path.1 (path.1 to path.2,
+    and so on), keeping at most `backups` old files. Rotation takes a lock
+    file so several worker processes sharing the path rotate it once.
+    """
+
+    def __init__(self, path, max_queue=10000, max_bytes=50 * 1024 * 1024, backups=2):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def export(self, span):
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            spans = [self.queue.get()]
+            # Batch whatever else is waiting into one write
+            while len(spans) < 512:
+                try:
+                    spans.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(''.join(json.dumps(span.to_dict()) + '\n' for span in spans))
+                    size = f.tell()
+                if size >= self.max_bytes:
+                    self._rotate()
+            except OSError as e:
+                print(f"Trace export failed: {e}")
+            for _ in spans:
+                self.queue.task_done()
+
+    def _rotate(self):
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another process may have rotated while this one waited for the lock
+            try:
+                if os.path.getsize(self.path) < self.max_bytes:
+                    return
+            except OSError:
+                return
+            if self.backups < 1:
+                os.remove(self.path)
+                return
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            os.replace(self.path, self.path + '.1')
+
+    def flush(self):
+        """Block until queued spans are written"""
+        if self.thread is not None:
+            self.queue.join()
+
+
+class Tracer:
+    """Creates spans; the active span is tracked per thread/context with contextvars"""
+
+    def __init__(self, exporter=None, enabled=True):
+        self.exporter = exporter
+        self.enabled = enabled and exporter is not None
+
+    def configure(self, path=None, max_mb=50, backups=2, enabled=True):
+        """
+        Export spans to a JSONL file, or stop tracing
+        Args:
+            path: Trace file (default DEFAULT_TRACE_FILE)
+            max_mb: Size at which the file is rotated
+            backups: Number of rotated files kept
+        """
+        path = path or DEFAULT_TRACE_FILE
+        exporter = self.exporter
+        if enabled and (exporter is None or (exporter.path, exporter.max_bytes, exporter.backups)
+                        != (path, max_mb * 1024 * 1024, backups)):
+            if exporter is not None:
+                exporter.flush()
+            self.exporter = JsonlExporter(path, max_bytes=max_mb * 1024 * 1024, backups=backups)
+        self.enabled = enabled
+
+    @contextmanager
+    def span(self, name, kind='SPAN_KIND_INTERNAL', **attributes):
+        """
+        Time a block as a child of the current span (or as a new trace root)
+        Exceptions mark the span as an error and propagate.
+        """
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        parent = current_span.get()
+        span = Span(
+            name,
+            parent.trace_id if parent else f"{random.getrandbits(128):032x}",
+            parent.span_id if parent else None,
+            attributes,
+            kind
+        )
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self.exporter.export(span)
+
+    def current(self):
+        """The active span (a no-op span outside any trace)"""
+        return current_span.get() or NOOP_SPAN
+
+
+DEFAULT_TRACE_FILE = os.path.join(tempfile.gettempdir(), 'ai_assistant_traces.jsonl')
+# Off until the app configures it from its settings (create_app calls tracer.configure)
+tracer = Tracer()